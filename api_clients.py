@@ -0,0 +1,107 @@
+"""
+OpenAI APIのクライアントをプロセス全体で共有する
+- HTTPの接続プール（keep-alive）は1プロセスに1つだけ作り、OpenAIクライアントとChatOpenAIの両方で使い回す
+- セッションごとに持つのはメモリやチェインなどの軽い状態だけにし、接続の確立（TLSハンドシェイク）やクライアントの初期化を繰り返さない
+- httpx / openai / langchain_openai の読み込みには時間がかかるため、クライアントを最初に作る時点で読み込む
+"""
+import threading
+import constants as ct
+
+_http_client = None
+_openai_clients = {}
+_chat_models = {}
+_lock = threading.Lock()
+
+
+def create_http_client():
+    """
+    接続数の上限・keep-aliveの保持時間・タイムアウトを設定したHTTPクライアントの作成
+    """
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=ct.OPENAI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=ct.OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=ct.OPENAI_HTTP_KEEPALIVE_EXPIRY_SEC
+        ),
+        timeout=httpx.Timeout(
+            ct.OPENAI_HTTP_READ_TIMEOUT_SEC,
+            connect=ct.OPENAI_HTTP_CONNECT_TIMEOUT_SEC,
+            pool=ct.OPENAI_HTTP_POOL_TIMEOUT_SEC
+        ),
+        follow_redirects=True
+    )
+
+
+def get_http_client():
+    """
+    プロセス全体で共有するHTTPクライアントの取得
+    """
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = create_http_client()
+        return _http_client
+
+
+def get_openai_client(api_key, base_url=None):
+    """
+    プロセス全体で共有するOpenAIクライアントの取得（APIキーと接続先ごとに1つ）
+    Args:
+        api_key: APIキー
+        base_url: 接続先（Noneの場合はOpenAIのAPI）
+    """
+    http_client = get_http_client()
+    key = (api_key, base_url)
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            from openai import OpenAI
+            client = _openai_clients[key] = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=ct.OPENAI_MAX_RETRIES,
+                http_client=http_client
+            )
+        return client
+
+
+def get_chat_model(api_key, base_url=None, model_name="gpt-4o-mini", temperature=0.5):
+    """
+    プロセス全体で共有するChatOpenAIの取得（設定ごとに1つ）
+    ChatOpenAIは呼び出しごとの状態を持たないため、複数のセッションから同時に使ってよい
+    Args:
+        api_key: APIキー
+        base_url: 接続先（Noneの場合はOpenAIのAPI）
+        model_name: モデル名
+        temperature: 温度
+    """
+    http_client = get_http_client()
+    key = (api_key, base_url, model_name, temperature)
+    with _lock:
+        llm = _chat_models.get(key)
+        if llm is None:
+            from langchain_openai import ChatOpenAI
+            llm = _chat_models[key] = ChatOpenAI(
+                model_name=model_name,
+                temperature=temperature,
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=ct.OPENAI_MAX_RETRIES,
+                http_client=http_client
+            )
+        return llm
+
+
+def get_default_clients():
+    """
+    アプリの設定（代替サーバーの指定・APIキー）に応じた共有クライアントの取得
+    Returns:
+        OpenAIクライアントとChatOpenAIの組
+    """
+    if ct.MOCK_OPENAI_BASE_URL:
+        api_key, base_url = "mock", ct.MOCK_OPENAI_BASE_URL
+    else:
+        import streamlit as st
+        api_key, base_url = st.secrets["OPENAI_API_KEY"], None
+    return get_openai_client(api_key, base_url), get_chat_model(api_key, base_url)
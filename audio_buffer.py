@@ -0,0 +1,141 @@
+import os
+import struct
+import threading
+import uuid
+import constants as ct
+
+# 1ターンあたりのメモリコピー量・ディスク書き込み量の計測用カウンター
+_io_stats = {"bytes_copied": 0, "bytes_written": 0}
+_io_stats_lock = threading.Lock()
+
+
+def record_copy(nbytes):
+    with _io_stats_lock:
+        _io_stats["bytes_copied"] += nbytes
+
+
+def record_write(nbytes):
+    with _io_stats_lock:
+        _io_stats["bytes_written"] += nbytes
+
+
+def get_io_stats(reset=False):
+    """
+    コピー量・書き込み量の取得
+    Args:
+        reset: 取得後にカウンターを0に戻すかどうか
+    """
+    with _io_stats_lock:
+        stats = dict(_io_stats)
+        if reset:
+            for key in _io_stats:
+                _io_stats[key] = 0
+    return stats
+
+
+class PcmBuffer:
+    """
+    PCMデータをメモリ上で扱うためのバッファ
+    データはmemoryviewで保持し、分割や受け渡しの際にコピーが発生しないようにする
+    """
+    def __init__(self, data, sample_rate=ct.TTS_PCM_SAMPLE_RATE,
+                 sample_width=ct.TTS_PCM_SAMPLE_WIDTH, channels=ct.TTS_PCM_CHANNELS):
+        # PyAudioの書き込みは読み取り専用バッファしか受け付けないため、読み取り専用のビューにする
+        self.data = memoryview(data).cast("B").toreadonly()
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+
+    @classmethod
+    def from_segment(cls, segment):
+        """
+        pydubのAudioSegmentから生成（raw_dataをそのまま参照）
+        """
+        return cls(segment.raw_data, segment.frame_rate, segment.sample_width, segment.channels)
+
+    @property
+    def frame_bytes(self):
+        return self.sample_width * self.channels
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def duration(self):
+        return self.nbytes / (self.frame_bytes * self.sample_rate)
+
+    def __len__(self):
+        return self.nbytes
+
+    def frames(self, frames_per_buffer=ct.PLAYBACK_FRAMES_PER_BUFFER):
+        """
+        指定フレーム数ごとのmemoryviewを順に返す（コピーなし）
+        """
+        step = frames_per_buffer * self.frame_bytes
+        for offset in range(0, self.nbytes, step):
+            yield self.data[offset:offset + step]
+
+    def wav_header(self):
+        """
+        PCMデータに対応するWAVヘッダー（44バイト）
+        """
+        byte_rate = self.sample_rate * self.frame_bytes
+        return struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF", 36 + self.nbytes, b"WAVE",
+            b"fmt ", 16, 1, self.channels, self.sample_rate,
+            byte_rate, self.frame_bytes, self.sample_width * 8,
+            b"data", self.nbytes
+        )
+
+    def to_wav_bytes(self):
+        """
+        WAV形式のバイト列に変換（ヘッダーとデータを1回のコピーで連結）
+        """
+        record_copy(self.nbytes)
+        return b"".join((self.wav_header(), self.data))
+
+    def upload_file(self, filename="audio.wav"):
+        """
+        OpenAI APIのfile引数にそのまま渡せる (ファイル名, データ, MIMEタイプ) の組を作成
+        """
+        return (filename, self.to_wav_bytes(), "audio/wav")
+
+
+class EncodedAudio:
+    """
+    エンコード済みの音声データ（mp3など。ブラウザへそのまま送る）
+    """
+    def __init__(self, data, mime_type):
+        self.data = data
+        self.mime_type = mime_type
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def __len__(self):
+        return self.nbytes
+
+
+def spill_to_disk(audio_buffer, directory, prefix):
+    """
+    デバッグ用に音声データをWAVファイルとして書き出す（AUDIO_DEBUG_SPILLが有効な場合のみ）
+    Args:
+        audio_buffer: PcmBuffer
+        directory: 出力先ディレクトリ
+        prefix: ファイル名の接頭辞
+    Returns:
+        書き出したファイルのパス（無効な場合はNone）
+    """
+    if not ct.AUDIO_DEBUG_SPILL:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    # 同一秒内の複数リクエストでも衝突しないようにUUIDでファイル名を付ける
+    file_path = os.path.join(directory, f"{prefix}_{uuid.uuid4().hex}.wav")
+    with open(file_path, "wb") as f:
+        f.write(audio_buffer.wav_header())
+        f.write(audio_buffer.data)
+    record_write(audio_buffer.nbytes + 44)
+    return file_path
@@ -0,0 +1,110 @@
+"""
+文字起こし（Whisper）へのアップロード前の音声の前処理
+- フレームごとのエネルギーによる発話区間検出（VAD）
+- 先頭・末尾の無音の除去と、長い無音（ポーズ）の短縮
+- モノラル化と16kHzへのリサンプリング
+"""
+import math
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import medfilt, resample_poly
+from audio_buffer import PcmBuffer
+import constants as ct
+
+
+def to_mono_samples(audio_buffer, sample_rate):
+    """
+    PcmBufferをモノラル・指定サンプリングレートの浮動小数点配列に変換
+    Args:
+        audio_buffer: PcmBuffer
+        sample_rate: 変換後のサンプリングレート
+    """
+    if audio_buffer.sample_width == 1:
+        samples = (np.frombuffer(audio_buffer.data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif audio_buffer.sample_width == 2:
+        samples = np.frombuffer(audio_buffer.data, dtype="<i2").astype(np.float32) / 32768
+    else:
+        samples = np.frombuffer(audio_buffer.data, dtype="<i4").astype(np.float32) / 2147483648
+    if audio_buffer.channels > 1:
+        usable = len(samples) - len(samples) % audio_buffer.channels
+        samples = samples[:usable].reshape(-1, audio_buffer.channels).mean(axis=1)
+    if audio_buffer.sample_rate != sample_rate:
+        divisor = math.gcd(audio_buffer.sample_rate, sample_rate)
+        samples = resample_poly(samples, sample_rate // divisor, audio_buffer.sample_rate // divisor)
+    return samples.astype(np.float32)
+
+
+def detect_speech(samples, sample_rate, frame_ms=ct.VAD_FRAME_MS):
+    """
+    フレームごとの発話判定
+    Args:
+        samples: モノラルの浮動小数点配列
+        sample_rate: サンプリングレート
+        frame_ms: フレーム長（ミリ秒）
+    Returns:
+        フレームごとの真偽値の配列（フレームは重なりなし）
+    """
+    frame_len = int(sample_rate * frame_ms / 1000)
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+    frames = sliding_window_view(samples[:n_frames * frame_len], frame_len)[::frame_len]
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    # ノイズフロアより十分大きく、かつ絶対的に小さすぎないフレームを発話とみなす
+    threshold = max(np.percentile(energy_db, 10) + ct.VAD_NOISE_MARGIN_DB, ct.VAD_MIN_SPEECH_DB)
+    return medfilt((energy_db > threshold).astype(np.float32), 3) > 0
+
+
+def _keep_ranges(speech, frame_ms):
+    """
+    残すサンプル区間（フレーム単位）のリスト
+    発話の前後には余白を付け、長い無音は指定の長さまで縮める
+    """
+    padding = int(ct.VAD_PADDING_MS / frame_ms)
+    max_pause = int(ct.VAD_MAX_PAUSE_MS / frame_ms)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    ranges = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        start, end = max(0, start - padding), min(len(speech), end + padding)
+        if ranges and start - ranges[-1][1] <= max_pause:
+            # ポーズが短い場合はそのまま残す（前の区間とつなげる）
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            if ranges:
+                # 長いポーズは上限の長さだけ残す
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + max_pause // 2)
+                start -= max_pause - max_pause // 2
+            ranges.append((start, end))
+    return ranges
+
+
+def preprocess_for_transcription(audio_buffer, sample_rate=ct.VAD_SAMPLE_RATE):
+    """
+    文字起こし用の音声に変換
+    Args:
+        audio_buffer: 録音したPcmBuffer
+        sample_rate: 変換後のサンプリングレート
+    Returns:
+        (変換後のPcmBuffer（16bitモノラル）, 処理結果の辞書)
+        発話を検出できない場合は、モノラル化・リサンプリングのみ行う
+    """
+    start_time = time.perf_counter()
+    samples = to_mono_samples(audio_buffer, sample_rate)
+    speech = detect_speech(samples, sample_rate)
+    frame_len = int(sample_rate * ct.VAD_FRAME_MS / 1000)
+    ranges = _keep_ranges(speech, ct.VAD_FRAME_MS) if speech.any() else []
+    if ranges:
+        samples = np.concatenate([samples[start * frame_len:end * frame_len] for start, end in ranges])
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    processed = PcmBuffer(pcm.tobytes(), sample_rate, 2, 1)
+    stats = {
+        "original_bytes": audio_buffer.nbytes,
+        "processed_bytes": processed.nbytes,
+        "bytes_saved": audio_buffer.nbytes - processed.nbytes,
+        "original_ms": audio_buffer.duration * 1000,
+        "processed_ms": processed.duration * 1000,
+        "speech_detected": bool(ranges),
+        "preprocess_ms": (time.perf_counter() - start_time) * 1000,
+    }
+    return processed, stats
@@ -0,0 +1,302 @@
+import threading
+import time
+from contextlib import contextmanager
+import constants as ct
+from audio_buffer import PcmBuffer, record_copy
+import latency
+from latency import run_in_context
+
+
+class PcmRingBuffer:
+    """
+    受信スレッドと再生処理の間でPCMデータを受け渡す固定長のリングバッファ
+    受信側は write()、再生側は read() を使い、容量を超える分は受信側が待機する
+    """
+    def __init__(self, capacity=ct.STREAM_RING_BUFFER_SIZE):
+        self._buffer = bytearray(capacity)
+        self._capacity = capacity
+        self._read_pos = 0
+        self._size = 0
+        self._eof = False
+        self._cancelled = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def write(self, data):
+        """
+        PCMデータの書き込み（空きができるまでブロック）
+        Args:
+            data: 書き込むバイト列
+        """
+        view = memoryview(data)
+        with self._cond:
+            while len(view) > 0:
+                while self._size == self._capacity and not self._cancelled:
+                    self._cond.wait()
+                # 再生側が中断した場合は残りを捨てる
+                if self._cancelled:
+                    return
+                write_pos = (self._read_pos + self._size) % self._capacity
+                n = min(len(view), self._capacity - self._size, self._capacity - write_pos)
+                self._buffer[write_pos:write_pos + n] = view[:n]
+                self._size += n
+                view = view[n:]
+                self._cond.notify_all()
+
+    def read(self, max_bytes, align=1):
+        """
+        PCMデータの読み出し（データが届くまでブロック）
+        Args:
+            max_bytes: 読み出す最大バイト数
+            align: 読み出し単位（1フレームのバイト数）。途中で切れたサンプルを返さないために使用
+        Returns:
+            読み出したバイト列。受信が完了して残りがなければ空のバイト列
+        """
+        with self._cond:
+            while self._size < align and not self._eof and not self._cancelled:
+                self._cond.wait()
+            if self._error is not None and self._size < align:
+                raise self._error
+            contiguous = min(max_bytes, self._size, self._capacity - self._read_pos)
+            n = contiguous - contiguous % align
+            if n == 0:
+                return b""
+            data = bytes(self._buffer[self._read_pos:self._read_pos + n])
+            self._read_pos = (self._read_pos + n) % self._capacity
+            self._size -= n
+            self._cond.notify_all()
+            return data
+
+    def close(self, error=None):
+        """
+        受信完了の通知
+        Args:
+            error: 受信中に発生した例外（再生側で再送出される）
+        """
+        with self._cond:
+            self._eof = True
+            self._error = error
+            self._cond.notify_all()
+
+    def cancel(self):
+        """
+        再生側からの中断通知（受信スレッドの書き込みを打ち切る）
+        """
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+
+class SpeechStream:
+    """
+    TTS APIのレスポンスをチャンク単位で受信し、リングバッファへ流し込む
+    受信はバックグラウンドスレッドで行い、再生側は最初のチャンクが届いた時点から読み出せる
+    """
+    def __init__(self, openai_obj, text, voice=ct.TTS_DEFAULT_VOICE, model=ct.TTS_MODEL,
+                 chunk_size=ct.STREAM_CHUNK_SIZE, ring=None):
+        self.ring = ring if ring is not None else PcmRingBuffer()
+        self.started_at = None
+        self.first_chunk_at = None
+        self.finished_at = None
+        self.bytes_received = 0
+        self._openai_obj = openai_obj
+        self._text = text
+        self._voice = voice
+        self._model = model
+        self._chunk_size = chunk_size
+        self._thread = threading.Thread(target=run_in_context(self._run), daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        error = None
+        try:
+            with self._openai_obj.audio.speech.with_streaming_response.create(
+                model=self._model,
+                voice=self._voice,
+                input=self._text,
+                response_format="pcm"
+            ) as response:
+                for chunk in response.iter_bytes(self._chunk_size):
+                    if not chunk:
+                        continue
+                    if self.first_chunk_at is None:
+                        self.first_chunk_at = time.perf_counter()
+                    self.bytes_received += len(chunk)
+                    self.ring.write(chunk)
+                    if self.ring.cancelled:
+                        break
+        except Exception as e:
+            error = e
+        finally:
+            self.finished_at = time.perf_counter()
+            if self.first_chunk_at is not None:
+                latency.record("tts_first_chunk", (self.first_chunk_at - self.started_at) * 1000)
+            latency.record("tts_stream", (self.finished_at - self.started_at) * 1000)
+            self.ring.close(error)
+
+
+def drain_ring_buffer(ring, write, frame_bytes, frames_per_buffer=ct.PLAYBACK_FRAMES_PER_BUFFER):
+    """
+    リングバッファが空になるまで読み出して出力先へ書き込む
+    Args:
+        ring: PcmRingBuffer
+        write: 出力先への書き込み関数
+        frame_bytes: 1フレームのバイト数（サンプル幅 × チャンネル数）
+        frames_per_buffer: 1回に書き込むフレーム数
+    Returns:
+        読み出したバイト数
+    """
+    total = 0
+    try:
+        while True:
+            data = ring.read(frames_per_buffer * frame_bytes, align=frame_bytes)
+            if not data:
+                break
+            write(data)
+            total += len(data)
+    finally:
+        # 途中で例外が起きた場合も受信スレッドを止める
+        ring.cancel()
+    return total
+
+
+class SpeedAdjustedOutput:
+    """
+    再生速度の変換を挟んで出力先へ書き込み、実際に再生したPCMを保持する
+    音程を保つ設定の場合はWSOLAでブロックごとに変換し、それ以外は出力側のサンプリングレートで速度を変える
+    """
+    def __init__(self, speed=1.0, sample_rate=ct.TTS_PCM_SAMPLE_RATE,
+                 sample_width=ct.TTS_PCM_SAMPLE_WIDTH, channels=ct.TTS_PCM_CHANNELS):
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.played = bytearray()
+        self._stretcher = None
+        self.output_rate = int(sample_rate * speed)
+        # WSOLAは16bitモノラルのみ対応
+        if speed != 1.0 and ct.PITCH_PRESERVING_SPEED and sample_width == 2 and channels == 1:
+            from time_stretch import WsolaStretcher
+
+            self._stretcher = WsolaStretcher(speed, sample_rate)
+            self.output_rate = sample_rate
+        self._write = None
+
+    def open(self, write):
+        self._write = write
+        return self
+
+    def write(self, data):
+        if self._stretcher is not None:
+            data = self._stretcher.process(data)
+        if data:
+            self._write(data)
+            self.played += data
+            record_copy(len(data))
+
+    def close(self):
+        if self._stretcher is not None:
+            tail = self._stretcher.flush()
+            if tail:
+                self._write(tail)
+                self.played += tail
+        return PcmBuffer(self.played, self.output_rate, self.sample_width, self.channels)
+
+
+@contextmanager
+def output_stream(sample_rate=ct.TTS_PCM_SAMPLE_RATE, sample_width=ct.TTS_PCM_SAMPLE_WIDTH,
+                  channels=ct.TTS_PCM_CHANNELS):
+    """
+    PyAudioの出力ストリームを開き、書き込み関数を返す
+    Args:
+        sample_rate: 出力のサンプリングレート
+        sample_width: サンプル幅（バイト）
+        channels: チャンネル数
+    """
+    import pyaudio
+
+    p = pyaudio.PyAudio()
+    stream = p.open(
+        format=p.get_format_from_width(sample_width),
+        channels=channels,
+        rate=sample_rate,
+        output=True
+    )
+    try:
+        yield stream.write
+    finally:
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+
+
+def play_ring_buffer(ring, speed=1.0):
+    """
+    リングバッファのTTS音声（PCM）をPyAudioで再生
+    Args:
+        ring: PcmRingBuffer
+        speed: 再生速度（1.0が通常速度）
+    Returns:
+        再生したPCMデータ（PcmBuffer）
+    """
+    output = SpeedAdjustedOutput(speed)
+    with output_stream(output.output_rate) as write:
+        output.open(write)
+        drain_ring_buffer(ring, output.write, ct.TTS_PCM_SAMPLE_WIDTH * ct.TTS_PCM_CHANNELS)
+        return output.close()
+
+
+def collect_ring_buffer(ring, speed=1.0):
+    """
+    リングバッファのTTS音声を再生せずに最後まで受信し、速度変換したPCMを返す（ブラウザ再生用）
+    Args:
+        ring: PcmRingBuffer
+        speed: 再生速度（1.0が通常速度）
+    """
+    output = SpeedAdjustedOutput(speed).open(lambda data: None)
+    drain_ring_buffer(ring, output.write, ct.TTS_PCM_SAMPLE_WIDTH * ct.TTS_PCM_CHANNELS)
+    return output.close()
+
+
+def collect_pcm(audio_buffer, speed=1.0):
+    """
+    メモリ上のPCMデータを再生せずに速度変換（ブラウザ再生用、通常速度の場合はそのまま返す）
+    Args:
+        audio_buffer: PcmBuffer
+        speed: 再生速度（1.0が通常速度）
+    """
+    if speed == 1.0:
+        return audio_buffer
+    output = SpeedAdjustedOutput(speed, audio_buffer.sample_rate, audio_buffer.sample_width, audio_buffer.channels)
+    output.open(lambda data: None)
+    for frames in audio_buffer.frames():
+        output.write(frames)
+    return output.close()
+
+
+def play_pcm(audio_buffer, speed=1.0):
+    """
+    メモリ上のPCMデータをPyAudioで再生（ファイルを経由しない）
+    速度変換はブロック単位で行うため、変換の完了を待たずに再生が始まる
+    Args:
+        audio_buffer: PcmBuffer
+        speed: 再生速度（1.0が通常速度）
+    Returns:
+        再生したPCMデータ（PcmBuffer）
+    """
+    output = SpeedAdjustedOutput(speed, audio_buffer.sample_rate, audio_buffer.sample_width, audio_buffer.channels)
+    with output_stream(output.output_rate, audio_buffer.sample_width, audio_buffer.channels) as write:
+        output.open(write)
+        for frames in audio_buffer.frames():
+            output.write(frames)
+        return output.close()
@@ -0,0 +1,125 @@
+"""
+1ターン分の音声処理で発生するメモリコピー量・ディスク書き込み量を比較
+- legacy: 変更前の record_audio → transcribe_audio → save_to_wav → play_wav（一時ファイル経由。関数は削除済みのため、ここで同じ処理を再現する）
+- buffer: record_audio_buffer → transcribe_audio_buffer → prepare_speech → play_speech（メモリ上で完結）
+録音・TTS音声は合成した正弦波を使い、API呼び出しと再生は行わない
+
+使い方:
+    python benchmarks/bench_audio_pipeline.py --input-seconds 5 --reply-seconds 6 --speed 1.2
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from pydub import AudioSegment
+import constants as ct
+from audio_buffer import PcmBuffer, get_io_stats
+
+
+def make_segment(seconds, sample_rate):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype("<i2")
+    return AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=2, channels=1)
+
+
+def run_legacy(workdir, recording, reply, speed):
+    written = 0
+    copied = 0
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+
+    # record_audio: 録音をWAVファイルに書き出し
+    input_path = os.path.join(workdir, "audio_input.wav")
+    recording.export(input_path, format="wav")
+    written += os.path.getsize(input_path)
+    # transcribe_audio: ファイルを開いてアップロード（読み込み分がコピーになる）
+    with open(input_path, "rb") as f:
+        copied += len(f.read())
+    os.remove(input_path)
+
+    # save_to_wav: mp3を一時ファイルに書き出してからwavへ変換
+    output_path = os.path.join(workdir, "audio_output.wav")
+    if has_ffmpeg:
+        mp3_bytes = reply.export(io.BytesIO(), format="mp3").getvalue()
+        mp3_path = os.path.join(workdir, "temp_audio_output.mp3")
+        with open(mp3_path, "wb") as f:
+            f.write(mp3_bytes)
+        written += len(mp3_bytes)
+        decoded = AudioSegment.from_file(mp3_path, format="mp3")
+        copied += len(decoded.raw_data)
+        os.remove(mp3_path)
+    else:
+        decoded = reply
+    decoded.export(output_path, format="wav")
+    written += os.path.getsize(output_path)
+
+    # play_wav: 読み込み → 速度変更 → 再書き出し → フレーム読み出し
+    audio = AudioSegment.from_wav(output_path)
+    copied += len(audio.raw_data)
+    if speed != 1.0:
+        modified = audio._spawn(audio.raw_data, overrides={"frame_rate": int(audio.frame_rate * speed)})
+        modified = modified.set_frame_rate(audio.frame_rate)
+        copied += len(modified.raw_data)
+        modified.export(output_path, format="wav")
+        written += os.path.getsize(output_path)
+    with wave.open(output_path, "rb") as wav_file:
+        data = wav_file.readframes(1024)
+        while data:
+            copied += len(data)
+            data = wav_file.readframes(1024)
+    os.remove(output_path)
+    return copied, written
+
+
+def run_buffer(recording, reply_pcm):
+    get_io_stats(reset=True)
+    # record_audio_buffer → transcribe_audio_buffer
+    audio_input = PcmBuffer.from_segment(recording)
+    audio_input.upload_file()
+    # prepare_speech → play_speech（非ストリーミング時）: レスポンスのPCMをそのまま再生
+    audio_output = PcmBuffer(reply_pcm)
+    for _ in audio_output.frames():
+        pass
+    stats = get_io_stats(reset=True)
+    return stats["bytes_copied"], stats["bytes_written"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input-seconds", type=float, default=5.0)
+    parser.add_argument("--reply-seconds", type=float, default=6.0)
+    parser.add_argument("--input-rate", type=int, default=44100)
+    parser.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    recording = make_segment(args.input_seconds, args.input_rate)
+    reply = make_segment(args.reply_seconds, ct.TTS_PCM_SAMPLE_RATE)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        legacy = run_legacy(workdir, recording, reply, args.speed)
+        legacy_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    start = time.perf_counter()
+    buffer = run_buffer(recording, reply.raw_data)
+    buffer_time = time.perf_counter() - start
+
+    if shutil.which("ffmpeg") is None:
+        print("(ffmpeg not found: legacy mp3 decode step skipped)")
+    print(f"{'path':<8} {'copied (KB)':>12} {'written (KB)':>13} {'time (ms)':>10}")
+    for name, (copied, written), elapsed in (("legacy", legacy, legacy_time), ("buffer", buffer, buffer_time)):
+        print(f"{name:<8} {copied / 1024:>12.1f} {written / 1024:>13.1f} {elapsed * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
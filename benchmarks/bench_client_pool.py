@@ -0,0 +1,121 @@
+"""
+多数のセッションが同時に最初のターンを実行したときの、OpenAIクライアントの持ち方による違いを計測
+- per-session: セッションごとに OpenAI / ChatOpenAI を作る（変更前の main.py と同じ）
+- shared: api_clients の共有クライアント（プロセスで1つの接続プール）を使う
+1ターンは「回答の生成（チャット） → 回答の音声合成」を2回行い、最初のターンの所要時間と、
+代替サーバーが受け付けた接続の数（= クライアント側で張ったソケットの数）を表示する
+新しい接続には --connect-delay 秒の待ち時間（TCP・TLSのハンドシェイクを模したもの）がかかる
+
+使い方:
+    python benchmarks/bench_client_pool.py --sessions 32 --connect-delay 0.08
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from openai import OpenAI
+from langchain_openai import ChatOpenAI
+import constants as ct
+import api_clients
+import mock_openai_server
+
+
+def pool_stats(http_client):
+    """
+    共有の接続プールにある接続数（全体 / 待機中のkeep-alive接続）
+    httpxの公開APIではない内部の属性を読むため、取得できない版では None を返す
+    """
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return None
+    connections = list(connections)
+    return {
+        "connections": len(connections),
+        "idle": sum(1 for connection in connections if connection.is_idle()),
+    }
+
+
+def per_session_clients(base_url):
+    openai_obj = OpenAI(api_key="mock", base_url=base_url)
+    llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5, api_key="mock", base_url=base_url)
+    return openai_obj, llm
+
+
+def shared_clients(base_url):
+    return api_clients.get_openai_client("mock", base_url), api_clients.get_chat_model("mock", base_url)
+
+
+CLIENT_FACTORIES = {"per-session": per_session_clients, "shared": shared_clients}
+
+
+def run_turn(openai_obj, llm):
+    reply = llm.invoke("Hello! How was your weekend?").content
+    openai_obj.audio.speech.create(model=ct.TTS_MODEL, voice=ct.TTS_DEFAULT_VOICE, input=reply, response_format="pcm")
+
+
+def run_session(factory, base_url, turns):
+    """
+    1セッション分の処理（クライアントの用意 + ターンの実行）
+    Returns:
+        最初のターンの所要時間と、2ターン目以降の平均（ミリ秒）
+    """
+    start = time.perf_counter()
+    openai_obj, llm = factory(base_url)
+    run_turn(openai_obj, llm)
+    first_turn_ms = (time.perf_counter() - start) * 1000
+    later_ms = []
+    for _ in range(turns - 1):
+        start = time.perf_counter()
+        run_turn(openai_obj, llm)
+        later_ms.append((time.perf_counter() - start) * 1000)
+    return first_turn_ms, float(np.mean(later_ms)) if later_ms else 0.0
+
+
+def run_wave(kind, server, sessions, turns):
+    """
+    sessions 個のセッションを同時に開始し、全セッションの完了を待つ
+    """
+    factory = CLIENT_FACTORIES[kind]
+    connections_before = server.connection_count
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = list(executor.map(lambda _: run_session(factory, server.base_url, turns), range(sessions)))
+    first = np.array([first_turn_ms for first_turn_ms, _ in results])
+    later = np.array([later_ms for _, later_ms in results])
+    return {
+        "first_p50": np.percentile(first, 50),
+        "first_p95": np.percentile(first, 95),
+        "later_mean": later.mean(),
+        "sockets": server.connection_count - connections_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--waves", type=int, default=2, help="同時に開始するセッションの組を何回繰り返すか")
+    parser.add_argument("--connect-delay", type=float, default=0.08)
+    parser.add_argument("--profile", default="fast", choices=sorted(mock_openai_server.LATENCY_PROFILES))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = mock_openai_server.start_server(profile=args.profile, seed=args.seed, connect_delay=args.connect_delay)
+    print(f"{args.sessions} concurrent sessions x {args.turns} turns, connect delay {args.connect_delay * 1000:.0f} ms")
+    print(f"{'clients':<12} {'wave':>4} {'first_p50_ms':>13} {'first_p95_ms':>13} {'later_mean_ms':>14} {'sockets':>8}")
+    for kind in CLIENT_FACTORIES:
+        for wave in range(1, args.waves + 1):
+            result = run_wave(kind, server, args.sessions, args.turns)
+            print(f"{kind:<12} {wave:>4} {result['first_p50']:>13.1f} {result['first_p95']:>13.1f} "
+                  f"{result['later_mean']:>14.1f} {result['sockets']:>8}")
+    print(f"\nshared pool after the run: {pool_stats(api_clients.get_http_client())}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+会話履歴の追記・最新n件取得のコストを比較（既定で10万件）
+- json:   旧方式（conversation_history.json 全体を読み込み → 1件追加 → indent=2 で全体を書き直し）
+- sqlite: history_store.HistoryStore（WALモードで1行INSERT、主キー索引で末尾のみ取得）
+
+使い方:
+    python benchmarks/bench_history_store.py --entries 100000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from history_store import HistoryStore
+
+
+def make_entry(i):
+    return {
+        "timestamp": "2025-01-01 12:00:00",
+        "user_input": f"I went to the station yesterday and bought a ticket number {i}.",
+        "ai_response": "That sounds great! Where were you travelling to? Did you enjoy the trip?",
+        "english_level": "中級者",
+        "mode": "日常英会話",
+        "theme": "旅行",
+    }
+
+
+def legacy_append(path, entry):
+    with open(path, "r", encoding="utf-8") as f:
+        history = json.load(f)
+    history["conversations"].append(entry)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+
+
+def legacy_tail(path, num_entries):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["conversations"][-num_entries:]
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--writers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = os.path.join(workdir, "conversation_history.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"conversations": [make_entry(i) for i in range(args.entries)]}, f, ensure_ascii=False, indent=2)
+
+        json_append = timed(lambda: legacy_append(json_path, make_entry(0)), 3)
+        json_tail = timed(lambda: legacy_tail(json_path, 10), 3)
+
+        start = time.perf_counter()
+        store = HistoryStore(os.path.join(workdir, "conversation_history.db"), json_path)
+        migration = (time.perf_counter() - start) * 1000
+        sqlite_append = timed(lambda: store.append(make_entry(0)), 200)
+        sqlite_tail = timed(lambda: store.tail(10), 200)
+
+        # 複数スレッドからの同時追記で件数が欠けないことを確認
+        before = store.count()
+        per_writer = 200
+
+        def writer():
+            for i in range(per_writer):
+                store.append(make_entry(i))
+
+        threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        concurrent = (time.perf_counter() - start) * 1000
+        lost = before + per_writer * args.writers - store.count()
+
+    print(f"entries: {args.entries}")
+    print(f"{'backend':<8} {'append (ms)':>12} {'tail 10 (ms)':>13}")
+    print(f"{'json':<8} {json_append:>12.2f} {json_tail:>13.2f}")
+    print(f"{'sqlite':<8} {sqlite_append:>12.3f} {sqlite_tail:>13.3f}")
+    print(f"migration from json: {migration:.1f} ms")
+    print(f"{args.writers} concurrent writers x {per_writer} appends: {concurrent:.1f} ms, lost writes: {lost}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+同じ (レベル, テーマ) で練習する多数のセッションが問題を取り出すときの、共有プールの有無による違いを計測
+- no-pool: セッションごとに問題文の生成と音声合成を行う（変更前の動作）
+- pool: problem_pool の共有プールから取り出す（不足時の生成は同時に1つにまとめる）
+各セッションは問題を取り出した後、回答時間（--think 秒）を置いて次の問題を取り出す
+結果は問題1つを待った時間（p50 / p95）、LLM・音声合成の呼び出し回数、同じセッションへの重複出題の数
+
+使い方:
+    python benchmarks/bench_problem_pool.py --sessions 16 --problems 5
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import constants as ct
+import functions as ft
+import api_clients
+import mock_openai_server
+from problem_pool import ProblemPool
+
+LEVEL = "中級者"
+THEME = "一般会話"
+
+
+def run_session(take, problems, think):
+    waits = []
+    # 代替サーバーは毎回同じ問題文を返すため、生成ごとに別のオブジェクトになる音声で重複を判定する
+    served = []
+    for _ in range(problems):
+        start = time.perf_counter()
+        _, audio_buffer = take()
+        waits.append((time.perf_counter() - start) * 1000)
+        served.append(audio_buffer)
+        time.sleep(think)
+    return waits, len(served) - len({id(audio_buffer) for audio_buffer in served})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--problems", type=int, default=5)
+    parser.add_argument("--think", type=float, default=0.5, help="問題を取り出してから次を取り出すまでの秒数")
+    parser.add_argument("--profile", default="fast", choices=sorted(mock_openai_server.LATENCY_PROFILES))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    ct.TTS_CACHE_ENABLED = False
+    ct.AUDIO_DEBUG_SPILL = False
+
+    counter_lock = threading.Lock()
+    server = mock_openai_server.start_server(profile=args.profile, seed=args.seed)
+    openai_obj = api_clients.get_openai_client("mock", server.base_url)
+    llm = api_clients.get_chat_model("mock", server.base_url)
+    generate_calls = [0]
+
+    def generate(level, theme):
+        with counter_lock:
+            generate_calls[0] += 1
+        return ft.generate_problem_with_audio(level, theme, llm, openai_obj)
+
+    print(f"{args.sessions} sessions x {args.problems} problems on ({LEVEL}, {THEME}), think {args.think}s")
+    print(f"{'mode':<8} {'wait_p50_ms':>12} {'wait_p95_ms':>12} {'generated':>10} {'repeats':>8}")
+    pool = ProblemPool()
+    modes = {
+        "no-pool": lambda seen: (lambda: generate(LEVEL, THEME)),
+        "pool": lambda seen: (lambda: pool.take(LEVEL, THEME, seen, generate)),
+    }
+    for mode, make_take in modes.items():
+        generate_calls[0] = 0
+        with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+            results = list(executor.map(
+                lambda _: run_session(make_take(set()), args.problems, args.think), range(args.sessions)
+            ))
+        waits = np.concatenate([session_waits for session_waits, _ in results])
+        repeats = sum(session_repeats for _, session_repeats in results)
+        print(f"{mode:<8} {np.percentile(waits, 50):>12.1f} {np.percentile(waits, 95):>12.1f} "
+              f"{generate_calls[0]:>10} {repeats:>8}")
+    print(f"\npool stats: {pool.stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+ローカル発音分析（pronunciation.analyze）の処理時間を音声の長さごとに計測
+ユーザーの録音の代わりに、お手本を0.85倍速に伸ばし途中にポーズを入れた 44.1kHz ステレオ音声を使う
+
+使い方:
+    python benchmarks/bench_pronunciation.py --seconds 3 10 20
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from scipy.signal import resample_poly
+from audio_buffer import PcmBuffer
+from mock_openai_server import synthesize_tone_pcm
+from time_stretch import stretch
+import pronunciation
+
+_SENTENCE = "Could you tell me the way to the station near the park"
+
+
+def make_case(seconds):
+    words = _SENTENCE.split()
+    text = " ".join(words[i % len(words)] for i in range(int(seconds / 0.45) + 1))
+    reference = synthesize_tone_pcm(text)
+    half = len(reference) // 4 * 2
+    user = stretch(reference[:half], 0.85) + bytes(24000) + stretch(reference[half:], 0.85)
+    samples = np.frombuffer(user, dtype="<i2").astype(np.float64)
+    samples = resample_poly(samples, 147, 80)
+    stereo = np.repeat(samples[:, None], 2, axis=1).astype("<i2").tobytes()
+    return text, PcmBuffer(reference), PcmBuffer(stereo, 44100, 2, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, nargs="+", default=[3, 10, 20])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'audio_s':>8} {'median_ms':>10} {'max_ms':>8} {'timing_dev_ms':>14} {'tempo':>6}")
+    for seconds in args.seconds:
+        text, reference, user = make_case(seconds)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = pronunciation.analyze(reference, user, text)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{reference.duration:>8.1f} {np.median(timings):>10.1f} {max(timings):>8.1f} "
+              f"{result['mean_abs_timing_deviation_ms']:>14.0f} {result['tempo_ratio']:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
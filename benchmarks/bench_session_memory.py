@@ -0,0 +1,81 @@
+"""
+セッションのメッセージ一覧が使うメモリの量を、会話の長さごとに計測
+- list: 変更前の持ち方（辞書のリストに全ターンを保持）
+- transcript: transcript.Transcript（__slots__ のレコード、直近 ct.TRANSCRIPT_MEMORY_TURNS ターンのみメモリに置き、古いターンはストアへ退避）
+結果は tracemalloc で測ったメッセージ一覧の大きさ、Transcript.memory_usage() の概算、1ターンの追加にかかる時間、
+退避したターン1ページ分（ct.TRANSCRIPT_PAGE_TURNS ターン）の読み込み時間
+
+使い方:
+    python benchmarks/bench_session_memory.py --turns 10 100 500 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import constants as ct
+from history_store import HistoryStore
+from transcript import Transcript
+
+
+def turn_messages(turn):
+    # シャドーイングの1ターン（問題文 + 文化的コンテキスト / 回答 / 採点 / LLM評価 / 区切り）
+    # 定数の文字列は共有されてしまうため、本文はターンごとに別の文字列にする
+    return [
+        {"role": "assistant", "content": f"Could you tell me how long it takes to get to the station {turn}?",
+         "cultural_context": f"This is a polite way to ask for directions ({turn}). " * 6},
+        {"role": "user", "content": f"Could you tell me how long it takes to get to the station {turn}?"},
+        {"role": "assistant", "content": f"**正答率 92%**（12 / 13 語）\n\n- 抜けた語: to ({turn})"},
+        {"role": "assistant", "content": f"Your answer was very close to the original sentence ({turn}). " * 12},
+        {"role": "other"},
+    ]
+
+
+def build(messages, turns):
+    start = time.perf_counter()
+    for turn in range(turns):
+        for message in turn_messages(turn):
+            messages.append(message)
+    return (time.perf_counter() - start) * 1000 / max(1, turns)
+
+
+def traced(make, turns):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = make()
+    append_ms = build(messages, turns)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return messages, size, append_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 500, 2000])
+    args = parser.parse_args()
+    temp_dir = tempfile.TemporaryDirectory()
+    store = HistoryStore(os.path.join(temp_dir.name, "history.db"), legacy_json_path=None)
+
+    print(f"memory turns: {ct.TRANSCRIPT_MEMORY_TURNS}, page turns: {ct.TRANSCRIPT_PAGE_TURNS}")
+    print(f"{'turns':>6} {'list_kb':>9} {'transcript_kb':>14} {'estimate_kb':>12} {'append_ms':>10} {'page_load_ms':>13}")
+    for turns in args.turns:
+        _, list_size, _ = traced(list, turns)
+        # 退避の書き込み（SQLite）による確保はセッションのメモリではないため、測定値からは除く
+        transcript, transcript_size, append_ms = traced(lambda: Transcript(store=store), turns)
+        page_load_ms = 0.0
+        if transcript.memory_usage()["turns_spilled"]:
+            start = time.perf_counter()
+            transcript.messages(0, ct.TRANSCRIPT_PAGE_TURNS)
+            page_load_ms = (time.perf_counter() - start) * 1000
+        print(f"{turns:>6} {list_size / 1024:>9.1f} {transcript_size / 1024:>14.1f} "
+              f"{transcript.memory_usage()['bytes'] / 1024:>12.1f} {append_ms:>10.3f} {page_load_ms:>13.2f}")
+    temp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+アプリの起動（streamlit run main.py の最初の描画まで）にかかるインポートの時間とメモリ使用量を計測
+main.py の先頭にある import 文だけを取り出し、新しいPythonプロセスで実行する（st.set_page_config より前に行われる処理）
+- import_ms: import 文の実行にかかった時間（--runs 回の中央値）
+- rss_mb: import 後のプロセスの最大常駐メモリ（ru_maxrss）
+- heavy: 起動時に読み込まれた重いライブラリ（langchain / openai / pydub など）
+--budget-ms / --budget-mb を超えた場合は終了コード1で終わるため、CIで起動時間の予算を確認できる
+
+使い方:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --budget-ms 800 --budget-mb 80
+    python benchmarks/bench_startup.py --importtime 15
+"""
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import constants as ct
+
+HEAVY_MODULES = [
+    "langchain", "langchain_core", "langchain_openai", "openai", "httpx", "tiktoken",
+    "pydub", "pyaudio", "audiorecorder", "numpy", "scipy",
+]
+
+# 子プロセスで実行するコード（{imports} に main.py の先頭の import 文が入る）
+CHILD_TEMPLATE = """
+import resource, sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{imports}
+elapsed = (time.perf_counter() - start) * 1000
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"import_ms": elapsed, "rss_mb": rss_kb / 1024, "heavy": heavy}}))
+"""
+
+
+def leading_imports(script_path):
+    """
+    スクリプトの先頭から、最初の import 以外の文の手前までにある import 文のソース
+    """
+    source = script_path.read_text(encoding="utf-8")
+    lines = []
+    for node in ast.parse(source).body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            break
+        lines.append(ast.get_source_segment(source, node))
+    return "\n".join(lines)
+
+
+def run_child(code, extra_args=()):
+    result = subprocess.run(
+        [sys.executable, *extra_args, "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return result
+
+
+def print_importtime(code, top):
+    """
+    -X importtime の出力から、累積時間の大きいモジュールを表示
+    """
+    result = run_child(code, ("-X", "importtime"))
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # 形式: "import time: <self_us> | <cumulative_us> | <インデント付きのモジュール名>"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # 最上位のモジュール（インデントが1文字のもの）だけを対象にする
+        if not name.startswith("  "):
+            rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    print(f"\n{'cumulative_ms':>14}  module")
+    for cumulative_us, name in rows[:top]:
+        print(f"{cumulative_us / 1000:>14.1f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--script", default=str(ROOT / "main.py"))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=ct.STARTUP_BUDGET_IMPORT_MS)
+    parser.add_argument("--budget-mb", type=float, default=ct.STARTUP_BUDGET_RSS_MB)
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="累積時間の大きい上位N個のモジュールを表示")
+    args = parser.parse_args()
+
+    code = CHILD_TEMPLATE.format(root=str(ROOT), imports=leading_imports(Path(args.script)), heavy=HEAVY_MODULES)
+    # 1回目はバイトコードのキャッシュ作成を含むため捨てる
+    run_child(code)
+    results = [json.loads(run_child(code).stdout.strip().splitlines()[-1]) for _ in range(args.runs)]
+    import_ms = statistics.median(result["import_ms"] for result in results)
+    rss_mb = statistics.median(result["rss_mb"] for result in results)
+    heavy = results[-1]["heavy"]
+
+    print(f"{'import_ms':>10} {'rss_mb':>8}  heavy")
+    print(f"{import_ms:>10.1f} {rss_mb:>8.1f}  {', '.join(heavy) or '-'}")
+    if args.importtime:
+        print_importtime(code, args.importtime)
+
+    over = []
+    if args.budget_ms and import_ms > args.budget_ms:
+        over.append(f"import {import_ms:.1f} ms > budget {args.budget_ms:.0f} ms")
+    if args.budget_mb and rss_mb > args.budget_mb:
+        over.append(f"rss {rss_mb:.1f} MB > budget {args.budget_mb:.0f} MB")
+    if over:
+        print("\nover budget: " + "; ".join(over))
+        sys.exit(1)
+    print(f"\nwithin budget ({args.budget_ms:.0f} ms, {args.budget_mb:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+TTSのストリーミング受信と一括受信で、最初の音声が出せるまでの時間を比較
+ローカルの代替サーバー（mock_openai_server.py）を使うためAPIキーは不要
+
+使い方:
+    python benchmarks/bench_streaming_tts.py --runs 5
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI
+import constants as ct
+import mock_openai_server
+from audio_stream import SpeechStream, drain_ring_buffer
+
+SAMPLE_TEXT = (
+    "Thanks for asking! I spent the weekend hiking near the lake with some friends, "
+    "and the weather was absolutely perfect. How about you?"
+)
+
+
+def measure_buffered(client):
+    start = time.perf_counter()
+    response = client.audio.speech.create(
+        model=ct.TTS_MODEL,
+        voice=ct.TTS_DEFAULT_VOICE,
+        input=SAMPLE_TEXT,
+        response_format="pcm"
+    )
+    pcm = response.content
+    # 一括受信では全データが揃うまで再生を始められない
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, len(pcm)
+
+
+def measure_streaming(client):
+    speech_stream = SpeechStream(client, SAMPLE_TEXT).start()
+    frame_bytes = ct.TTS_PCM_SAMPLE_WIDTH * ct.TTS_PCM_CHANNELS
+    first_write = []
+
+    def null_sink(data):
+        if not first_write:
+            first_write.append(time.perf_counter())
+
+    nbytes = drain_ring_buffer(speech_stream.ring, null_sink, frame_bytes)
+    speech_stream.join()
+    return (
+        first_write[0] - speech_stream.started_at,
+        speech_stream.finished_at - speech_stream.started_at,
+        nbytes,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--first-chunk-delay", type=float, default=mock_openai_server.DEFAULT_FIRST_CHUNK_DELAY)
+    parser.add_argument("--chunk-delay", type=float, default=mock_openai_server.DEFAULT_CHUNK_DELAY)
+    args = parser.parse_args()
+
+    server = mock_openai_server.start_server(
+        first_chunk_delay=args.first_chunk_delay,
+        chunk_delay=args.chunk_delay
+    )
+    client = OpenAI(api_key="mock", base_url=server.base_url)
+
+    results = {"buffered": [], "streaming": []}
+    for _ in range(args.runs):
+        results["buffered"].append(measure_buffered(client))
+        results["streaming"].append(measure_streaming(client))
+    server.shutdown()
+
+    print(f"{'mode':<10} {'first audio (ms)':>17} {'total (ms)':>11} {'bytes':>9}")
+    for mode, rows in results.items():
+        first = statistics.median(row[0] for row in rows) * 1000
+        total = statistics.median(row[1] for row in rows) * 1000
+        print(f"{mode:<10} {first:>17.1f} {total:>11.1f} {rows[0][2]:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+再生速度変更の処理コストを比較（リアルタイム係数 = 処理時間 / 音声の長さ）
+- pydub: 変更前の play_wav の方式（_spawnでframe_rate変更 → set_frame_rate → WAV書き出し）。音程が変わる
+- wsola: time_stretch.WsolaStretcher。音程を保ち、ブロック単位で出力する
+速度1.0は実行時に速度変更を行わないため計測せず、passthrough と表示する
+
+使い方:
+    python benchmarks/bench_time_stretch.py --seconds 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from pydub import AudioSegment
+import constants as ct
+from mock_openai_server import synthesize_tone_pcm
+from time_stretch import stretch_blocks
+
+
+def make_pcm(seconds):
+    # 1単語あたり約0.4秒のダミー音声を必要な長さまで並べる
+    words = " ".join(["practice"] * int(seconds / 0.42 + 1))
+    pcm = synthesize_tone_pcm(words)
+    return pcm[:int(seconds * ct.TTS_PCM_SAMPLE_RATE) * ct.TTS_PCM_SAMPLE_WIDTH]
+
+
+def run_pydub(pcm, speed, workdir):
+    start = time.perf_counter()
+    audio = AudioSegment(pcm, frame_rate=ct.TTS_PCM_SAMPLE_RATE, sample_width=2, channels=1)
+    modified = audio._spawn(audio.raw_data, overrides={"frame_rate": int(audio.frame_rate * speed)})
+    modified = modified.set_frame_rate(audio.frame_rate)
+    modified.export(os.path.join(workdir, "audio_output.wav"), format="wav")
+    elapsed = time.perf_counter() - start
+    # 書き出しが終わるまで再生を始められない
+    return elapsed, elapsed
+
+
+def run_wsola(pcm, speed):
+    block_bytes = ct.PLAYBACK_FRAMES_PER_BUFFER * ct.TTS_PCM_SAMPLE_WIDTH
+    blocks = (pcm[i:i + block_bytes] for i in range(0, len(pcm), block_bytes))
+    start = time.perf_counter()
+    first = None
+    for _ in stretch_blocks(blocks, speed):
+        if first is None:
+            first = time.perf_counter() - start
+    return time.perf_counter() - start, first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=8.0)
+    args = parser.parse_args()
+
+    pcm = make_pcm(args.seconds)
+    duration = len(pcm) / (ct.TTS_PCM_SAMPLE_RATE * ct.TTS_PCM_SAMPLE_WIDTH)
+    print(f"clip: {duration:.1f}s")
+    print(f"{'speed':>5} {'pydub RTF':>10} {'wsola RTF':>10} {'pydub first (ms)':>17} {'wsola first (ms)':>17}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for speed in ct.PLAY_SPEED_OPTION:
+            if speed == 1.0:
+                # 通常速度では実行時に速度変更を行わない（受信したPCMをそのまま再生する）
+                print(f"{speed:>5} {'passthrough':>21}")
+                continue
+            pydub_total, pydub_first = run_pydub(pcm, speed, workdir)
+            wsola_total, wsola_first = run_wsola(pcm, speed)
+            print(
+                f"{speed:>5} {pydub_total / duration:>10.4f} {wsola_total / duration:>10.4f} "
+                f"{pydub_first * 1000:>17.2f} {wsola_first * 1000:>17.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
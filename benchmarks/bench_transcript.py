@@ -0,0 +1,98 @@
+"""
+会話が長くなったときの、main.py の再実行1回あたりの時間を計測
+streamlit.testing の AppTest で main.py を実行し、メッセージ一覧に --turns のターン数
+（シャドーイングと同じ 問題文 + 文化的コンテキスト / 回答 / 採点 / 評価 / 区切り）を入れてから再実行する
+- all: 全ターンを毎回描画する（変更前の動作。ct.TRANSCRIPT_EAGER_TURNS をターン数より大きくして再現）
+- capped: 直近の ct.TRANSCRIPT_EAGER_TURNS ターンだけを描画し、以前のターンは折りたたむ
+- capped+older: 以前のターンの表示を有効にした状態（1ページ分だけ描画される）
+
+使い方:
+    python benchmarks/bench_transcript.py --turns 10 100 500 --runs 5
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from streamlit.testing.v1 import AppTest
+import constants as ct
+from history_store import HistoryStore
+from transcript import Transcript
+
+SCRIPT = str(ROOT / "main.py")
+
+
+def make_messages(turns, store, max_turns=ct.TRANSCRIPT_MEMORY_TURNS):
+    messages = Transcript(max_turns=max_turns, store=store)
+    for turn in range(turns):
+        for message in [
+            {"role": "assistant", "content": f"Problem sentence number {turn} for the practice session.",
+             "cultural_context": f"Cultural notes for sentence {turn}. " * 5},
+            {"role": "user", "content": f"Problem sentence number {turn} for the practice session."},
+            {"role": "assistant", "content": f"**正答率 90%**\n\n- missing: practice ({turn})"},
+            {"role": "assistant", "content": f"Evaluation for turn {turn}. " * 10},
+            {"role": "other"},
+        ]:
+            messages.append(message)
+    return messages
+
+
+def measure(turns, runs, eager_turns, show_older, store):
+    ct.TRANSCRIPT_EAGER_TURNS = eager_turns
+    at = AppTest.from_file(SCRIPT, default_timeout=120).run()
+    # 変更前の動作（全ターンを描画）では、すべてのターンをメモリに置く
+    at.session_state["messages"] = make_messages(turns, store, max(ct.TRANSCRIPT_MEMORY_TURNS, eager_turns))
+    # 文化的コンテキストの表示を有効にする（折りたたみ表示も描画の対象になる）
+    next(checkbox for checkbox in at.sidebar.checkbox if checkbox.label == "文化的コンテキストを表示").check()
+    at.run()
+    if show_older:
+        at.toggle(key="transcript_show_older").set_value(True)
+        at.run()
+    elapsed = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        at.run()
+        elapsed.append((time.perf_counter() - start) * 1000)
+    assert not at.exception, at.exception
+    return statistics.median(elapsed), len(at.markdown)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    warnings.filterwarnings("ignore")
+    eager_turns = ct.TRANSCRIPT_EAGER_TURNS
+    # 退避したターンは一時的なデータベースに書き込む
+    temp_dir = tempfile.TemporaryDirectory()
+    store = HistoryStore(os.path.join(temp_dir.name, "history.db"), legacy_json_path=None)
+
+    print(f"eager turns: {eager_turns}, page turns: {ct.TRANSCRIPT_PAGE_TURNS}")
+    print(f"{'turns':>6} {'mode':<14} {'rerun_ms':>10} {'markdown':>9}")
+    for turns in args.turns:
+        modes = {
+            "all": (turns + 1, False),
+            "capped": (eager_turns, False),
+            "capped+older": (eager_turns, True),
+        }
+        for mode, (eager, show_older) in modes.items():
+            if show_older and turns <= eager_turns:
+                continue
+            rerun_ms, markdown_count = measure(turns, args.runs, eager, show_older, store)
+            print(f"{turns:>6} {mode:<14} {rerun_ms:>10.1f} {markdown_count:>9}")
+    ct.TRANSCRIPT_EAGER_TURNS = eager_turns
+    temp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
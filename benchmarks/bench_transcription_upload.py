@@ -0,0 +1,84 @@
+"""
+文字起こし前の前処理（発話区間検出・無音の除去・16kHzモノラル化）の効果を計測
+録音を模した音声（48kHzステレオ、先頭1秒・途中2秒・末尾5秒の無音と弱いノイズを含む）を
+そのままアップロードした場合と、前処理してからアップロードした場合で比較する
+ローカルの代替サーバー（mock_openai_server.py）を使うためAPIキーは不要
+
+使い方:
+    python benchmarks/bench_transcription_upload.py --runs 5 --upload-kbps 2000
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from openai import OpenAI
+from scipy.signal import resample_poly
+import constants as ct
+import mock_openai_server
+from audio_buffer import PcmBuffer
+from audio_preprocess import preprocess_for_transcription
+
+SAMPLE_TEXT = "I usually take the train to work, but today I decided to walk because the weather was nice"
+
+
+def make_recording(rate=48000):
+    speech = np.frombuffer(mock_openai_server.synthesize_tone_pcm(SAMPLE_TEXT), dtype="<i2").astype(np.float64)
+    speech = resample_poly(speech, rate // 8000, ct.TTS_PCM_SAMPLE_RATE // 8000)
+    half = len(speech) // 2
+
+    def silence(seconds):
+        return np.zeros(int(rate * seconds))
+
+    samples = np.concatenate([silence(1), speech[:half], silence(2), speech[half:], silence(5)])
+    samples += np.random.default_rng(0).normal(0, 20, len(samples))
+    stereo = np.repeat(samples[:, None], 2, axis=1)
+    return PcmBuffer(np.clip(stereo, -32768, 32767).astype("<i2").tobytes(), rate, 2, 2)
+
+
+def measure(client, audio_buffer, preprocess):
+    start = time.perf_counter()
+    if preprocess:
+        audio_buffer, _ = preprocess_for_transcription(audio_buffer)
+    upload = audio_buffer.upload_file()
+    client.audio.transcriptions.create(model=ct.WHISPER_MODEL, file=upload, language="en")
+    return time.perf_counter() - start, len(upload[1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--upload-kbps", type=int, default=2000, help="アップロード帯域（キロビット/秒）")
+    args = parser.parse_args()
+
+    server = mock_openai_server.start_server(upload_bytes_per_sec=args.upload_kbps * 1000 // 8)
+    client = OpenAI(api_key="mock", base_url=server.base_url)
+    recording = make_recording()
+    _, stats = preprocess_for_transcription(recording)
+    print(f"audio: {stats['original_ms'] / 1000:.1f} s -> {stats['processed_ms'] / 1000:.1f} s, "
+          f"preprocess {stats['preprocess_ms']:.1f} ms")
+
+    results = {}
+    for preprocess in (False, True):
+        timings = []
+        for _ in range(args.runs):
+            elapsed, upload_bytes = measure(client, recording, preprocess)
+            timings.append(elapsed)
+        results[preprocess] = (statistics.median(timings), upload_bytes)
+    server.shutdown()
+
+    print(f"{'mode':<12} {'upload_KB':>10} {'latency_ms':>11}")
+    for preprocess, label in ((False, "raw"), (True, "preprocessed")):
+        latency, upload_bytes = results[preprocess]
+        print(f"{label:<12} {upload_bytes / 1024:>10.1f} {latency * 1000:>11.1f}")
+    raw, processed = results[False], results[True]
+    print(f"bytes saved: {raw[1] - processed[1]} ({1 - processed[1] / raw[1]:.1%}), "
+          f"latency saved: {(raw[0] - processed[0]) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
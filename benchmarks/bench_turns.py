@@ -0,0 +1,231 @@
+"""
+代替サーバー（mock_openai_server.py）を相手に、各モードの1ターンを通しで実行し、段階ごとの遅延を集計
+- 日常英会話: 文字起こし → 回答のストリーミング生成 → 文ごとの音声合成（最初の音声まで / 全文）と文化的コンテキスト
+- シャドーイング: 問題生成（LLM + 音声合成） → 文字起こし → ローカル採点 → 発音分析 → LLM評価
+- ディクテーション: 問題生成 → ローカル採点 → LLM評価
+音声の再生はせず、受信が終わった時点を再生可能になった時点とみなす。結果は段階ごとの p50 / p95 / p99（ミリ秒）
+
+使い方:
+    python benchmarks/bench_turns.py --turns 20 --profile realistic
+"""
+import argparse
+import logging
+import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import streamlit as st
+from scipy.signal import resample_poly
+from openai import OpenAI
+from langchain_openai import ChatOpenAI
+from langchain.memory import ConversationSummaryBufferMemory, ConversationBufferWindowMemory
+import constants as ct
+import functions as ft
+import latency
+import mock_openai_server
+from audio_buffer import PcmBuffer
+from audio_stream import drain_ring_buffer
+from sentence_pipeline import SentenceSpeechPipeline
+
+MODES = {"conversation": ct.MODE_1, "shadowing": ct.MODE_2, "dictation": ct.MODE_3}
+
+
+def make_recording(text, rate=48000):
+    """
+    録音を模した音声（48kHzステレオ、前後に無音とノイズ）
+    """
+    speech = np.frombuffer(mock_openai_server.synthesize_tone_pcm(text), dtype="<i2").astype(np.float64)
+    speech = resample_poly(speech, rate // 8000, ct.TTS_PCM_SAMPLE_RATE // 8000)
+    samples = np.concatenate([np.zeros(rate // 2), speech, np.zeros(rate * 2)])
+    samples += np.random.default_rng(0).normal(0, 20, len(samples))
+    stereo = np.repeat(samples[:, None], 2, axis=1)
+    return PcmBuffer(np.clip(stereo, -32768, 32767).astype("<i2").tobytes(), rate, 2, 2)
+
+
+def init_session(base_url, memory_kind):
+    """
+    main.py の初期処理と同じセッション状態を用意（Streamlitはbareモードで動かす）
+    """
+    st.session_state.openai_obj = OpenAI(api_key="mock", base_url=base_url)
+    st.session_state.llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5, api_key="mock", base_url=base_url)
+    if memory_kind == "summary":
+        st.session_state.memory = ConversationSummaryBufferMemory(
+            llm=st.session_state.llm,
+            max_token_limit=1000,
+            return_messages=True
+        )
+    else:
+        st.session_state.memory = ConversationBufferWindowMemory(k=5, return_messages=True)
+    st.session_state.streaming_playback = True
+    st.session_state.speed = 1.0
+    st.session_state.englv = "中級者"
+    st.session_state.theme = "一般会話"
+
+
+def tokenizer_available():
+    """
+    要約付きメモリが使うトークナイザー（tiktoken）の符号表を読み込めるか（オフライン環境では取得できない）
+    """
+    try:
+        st.session_state.llm.get_num_tokens("hello")
+        return True
+    except Exception:
+        return False
+
+
+def receive_speech(prepared, timings, turn_start):
+    """
+    再生の代わりに受信を最後まで行い、最初の音声が届いた時刻を記録
+    """
+    if prepared.speech_stream is None:
+        timings.setdefault("tts_first_audio", (time.perf_counter() - turn_start) * 1000)
+        return
+    stream = prepared.speech_stream
+    drain_ring_buffer(stream.ring, lambda chunk: None, ct.TTS_PCM_SAMPLE_WIDTH * ct.TTS_PCM_CHANNELS)
+    if stream.first_chunk_at is not None:
+        timings.setdefault("tts_first_audio", (stream.first_chunk_at - turn_start) * 1000)
+
+
+def run_conversation_turn(recording, executor):
+    timings = {}
+    turn_start = time.perf_counter()
+
+    start = time.perf_counter()
+    user_text = ft.transcribe_audio_buffer(recording).text
+    timings["transcribe"] = (time.perf_counter() - start) * 1000
+
+    level_template = ft.get_level_specific_template(st.session_state.englv, st.session_state.theme)
+    chain = ft.create_chain(level_template, "conversation", st.session_state.englv, st.session_state.theme)
+    openai_obj = st.session_state.openai_obj
+    pipeline = SentenceSpeechPipeline(
+        lambda sentence: ft.prepare_speech(sentence, ct.TTS_DEFAULT_VOICE, 1.0, openai_obj, True),
+        lambda prepared: receive_speech(prepared, timings, turn_start)
+    )
+
+    reply_start = time.perf_counter()
+
+    def on_text(text):
+        timings.setdefault("llm_first_token", (time.perf_counter() - reply_start) * 1000)
+
+    reply = ft.stream_conversation_reply(chain, user_text, on_text, pipeline.add)
+    timings["llm_reply"] = (time.perf_counter() - reply_start) * 1000
+
+    # 文化的コンテキストは読み上げと並行して取得する（main.py と同じ。2ターン目以降はキャッシュに当たる）
+    cultural_start = time.perf_counter()
+    cultural_future = executor.submit(ft.create_cultural_context_task(reply))
+    pipeline.close()
+    pipeline.join()
+    timings["tts_done"] = (time.perf_counter() - turn_start) * 1000
+    cultural_future.result()
+    timings["cultural_context"] = (time.perf_counter() - cultural_start) * 1000
+    timings["turn_total"] = (time.perf_counter() - turn_start) * 1000
+    return timings
+
+
+def generate_problem(timings):
+    start = time.perf_counter()
+    problem, audio_buffer = ft.generate_problem_with_audio(
+        st.session_state.englv, st.session_state.theme, st.session_state.llm, st.session_state.openai_obj
+    )
+    timings["problem_generation"] = (time.perf_counter() - start) * 1000
+    return problem, audio_buffer
+
+
+def evaluate(problem, answer, timings):
+    start = time.perf_counter()
+    local_score = ft.score_answer(problem, answer)
+    ft.format_score_markdown(local_score)
+    timings["local_score"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    ft.create_evaluation_with_score(problem, answer, st.session_state.englv, local_score)
+    timings["llm_evaluation"] = (time.perf_counter() - start) * 1000
+
+
+def run_shadowing_turn(recording, executor):
+    timings = {}
+    turn_start = time.perf_counter()
+    problem, reference_audio = generate_problem(timings)
+
+    start = time.perf_counter()
+    answer = ft.transcribe_audio_buffer(recording).text
+    timings["transcribe"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    ft.analyze_pronunciation(recording, problem, reference_audio)
+    timings["pronunciation"] = (time.perf_counter() - start) * 1000
+
+    evaluate(problem, answer, timings)
+    timings["turn_total"] = (time.perf_counter() - turn_start) * 1000
+    return timings
+
+
+def run_dictation_turn(recording, executor):
+    timings = {}
+    turn_start = time.perf_counter()
+    problem, _ = generate_problem(timings)
+    evaluate(problem, mock_openai_server.DEFAULT_TRANSCRIPTION_TEXT, timings)
+    timings["turn_total"] = (time.perf_counter() - turn_start) * 1000
+    return timings
+
+
+TURN_RUNNERS = {
+    "conversation": run_conversation_turn,
+    "shadowing": run_shadowing_turn,
+    "dictation": run_dictation_turn,
+}
+
+
+def report(mode, results):
+    print(f"\n[{MODES[mode]}] {len(results)} turns")
+    print(f"{'stage':<20} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    for stage in results[0]:
+        values = np.array([timings[stage] for timings in results if stage in timings])
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"{stage:<20} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--profile", default="realistic", choices=sorted(mock_openai_server.LATENCY_PROFILES))
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--memory", default="summary", choices=["summary", "window"])
+    parser.add_argument("--tts-cache", action="store_true", help="TTSキャッシュを有効にする（既定では毎回合成）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # bareモードのStreamlitとLangChainの非推奨の警告を抑える
+    warnings.simplefilter("ignore", DeprecationWarning)
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+    ct.TTS_CACHE_ENABLED = args.tts_cache
+    ct.AUDIO_DEBUG_SPILL = False
+
+    server = mock_openai_server.start_server(profile=args.profile, seed=args.seed)
+    init_session(server.base_url, args.memory)
+    if args.memory == "summary" and not tokenizer_available():
+        print("tiktoken encodings are not available offline; using window memory instead of summary memory")
+        init_session(server.base_url, "window")
+    recording = make_recording(mock_openai_server.DEFAULT_TRANSCRIPTION_TEXT)
+
+    executor = ThreadPoolExecutor(max_workers=ct.TURN_EXECUTOR_MAX_WORKERS)
+    for mode in args.modes:
+        results = [TURN_RUNNERS[mode](recording, executor) for _ in range(args.turns)]
+        report(mode, results)
+
+    # アプリ内のステージ計測（latency.span）でのプロセス全体の集計
+    print(f"\n[latency registry] {'stage':<22} {'count':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    for row in sorted(latency.get_process_registry().summary(), key=lambda row: -row["p95_ms"]):
+        print(f"{'':<18} {row['stage']:<22} {row['count']:>6} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+    executor.shutdown()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
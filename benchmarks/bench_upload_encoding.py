@@ -0,0 +1,70 @@
+"""
+文字起こし用アップロード音声の形式ごとに、エンコード時間とアップロード量・時間を比較
+16kHzモノラル（前処理後）の 3〜20 秒の発話を想定し、帯域を絞った代替サーバー（mock_openai_server.py）に送る
+代替サーバーの文字起こし待ち時間は形式によらず一定にし、エンコードとアップロードの差だけを比べる
+
+使い方:
+    python benchmarks/bench_upload_encoding.py --seconds 3 5 10 20 --upload-kbps 2000
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from openai import OpenAI
+from scipy.signal import resample_poly
+import constants as ct
+import mock_openai_server
+from audio_buffer import PcmBuffer
+from upload_encoder import EncoderPolicy, encode_for_upload, find_ffmpeg, UPLOAD_FORMATS
+
+
+def make_utterance(seconds, rate=ct.VAD_SAMPLE_RATE):
+    words = " ".join(["conversation"] * int(seconds / 0.74 + 1))
+    speech = np.frombuffer(mock_openai_server.synthesize_tone_pcm(words), dtype="<i2").astype(np.float64)
+    speech = resample_poly(speech, rate // 8000, ct.TTS_PCM_SAMPLE_RATE // 8000)[:int(seconds * rate)]
+    speech += np.random.default_rng(0).normal(0, 60, len(speech))
+    return PcmBuffer(np.clip(speech, -32768, 32767).astype("<i2").tobytes(), rate, 2, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, nargs="+", default=[3, 5, 10, 20])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--upload-kbps", type=int, default=2000, help="アップロード帯域（キロビット/秒）")
+    args = parser.parse_args()
+    if not find_ffmpeg():
+        print("ffmpeg not found: only wav can be measured")
+
+    bytes_per_sec = args.upload_kbps * 1000 // 8
+    server = mock_openai_server.start_server(
+        upload_bytes_per_sec=bytes_per_sec, transcription_delay=0.05, transcription_delay_per_sec=0.0
+    )
+    client = OpenAI(api_key="mock", base_url=server.base_url)
+    policy = EncoderPolicy(bytes_per_sec=bytes_per_sec)
+    formats = ["wav"] + (list(UPLOAD_FORMATS) if find_ffmpeg() else [])
+
+    print(f"{'audio_s':>7} {'format':<6} {'KB':>8} {'saved':>6} {'encode_ms':>10} {'total_ms':>9}")
+    for seconds in args.seconds:
+        audio_buffer = make_utterance(seconds)
+        for fmt in formats:
+            encode_ms, total_ms = [], []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                upload, stats = encode_for_upload(audio_buffer, policy, fmt)
+                client.audio.transcriptions.create(model=ct.WHISPER_MODEL, file=upload, language="en")
+                total_ms.append((time.perf_counter() - start) * 1000)
+                encode_ms.append(stats["encode_ms"])
+            saved = 1 - stats["encoded_bytes"] / stats["wav_bytes"]
+            print(f"{audio_buffer.duration:>7.1f} {fmt:<6} {stats['encoded_bytes'] / 1024:>8.1f} {saved:>6.0%} "
+                  f"{statistics.median(encode_ms):>10.1f} {statistics.median(total_ms):>9.1f}")
+        print(f"{'':>7} policy -> {policy.choose(audio_buffer)}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+プロンプト・チェインの再利用
+(用途, 英語レベル, 会話テーマ, テンプレートのハッシュ) をキーに、構築済みのオブジェクトを使い回す
+- プロンプト（ChatPromptTemplate）は状態を持たないため、プロセス全体のセッション間で共有する
+- チェイン（ConversationChain）はセッションのメモリに紐づくため、セッションごとに保持する
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import constants as ct
+
+
+def make_key(purpose, level, theme, template):
+    digest = hashlib.sha1(template.encode("utf-8")).hexdigest()
+    return (purpose, level, theme, digest)
+
+
+class _LruCache:
+    def __init__(self, max_entries):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+class BuildStats:
+    """
+    構築回数・再利用回数と、再利用によって省けた構築時間の推定値
+    省けた時間は、用途ごとの平均構築時間 × 再利用回数で見積もる
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.build_seconds = 0.0
+        self.saved_seconds = 0.0
+        self._build_seconds_by_purpose = {}
+
+    def record_build(self, purpose, seconds):
+        self.misses += 1
+        self.build_seconds += seconds
+        total, count = self._build_seconds_by_purpose.get(purpose, (0.0, 0))
+        self._build_seconds_by_purpose[purpose] = (total + seconds, count + 1)
+
+    def record_hit(self, purpose, average_seconds):
+        self.hits += 1
+        self.saved_seconds += average_seconds
+
+    def average_build_seconds(self, purpose):
+        total, count = self._build_seconds_by_purpose.get(purpose, (0.0, 0))
+        return total / count if count else 0.0
+
+    def as_dict(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "build_ms": self.build_seconds * 1000,
+            "saved_ms": self.saved_seconds * 1000,
+        }
+
+
+class PromptRegistry:
+    """
+    プロセス全体で共有するプロンプトのキャッシュ
+    """
+    def __init__(self, max_entries=ct.CHAIN_REGISTRY_PROMPT_MAX):
+        self._prompts = _LruCache(max_entries)
+        self._lock = threading.Lock()
+        self.stats = BuildStats()
+
+    def get(self, key, build):
+        """
+        プロンプトの取得（未構築の場合はbuild()で構築して登録）
+        """
+        with self._lock:
+            prompt = self._prompts.get(key)
+            if prompt is not None:
+                self.stats.record_hit(key[0], self.stats.average_build_seconds(key[0]))
+                return prompt
+        start = time.perf_counter()
+        prompt = build()
+        with self._lock:
+            self.stats.record_build(key[0], time.perf_counter() - start)
+            self._prompts.put(key, prompt)
+        return prompt
+
+
+class SessionChains:
+    """
+    セッションごとのチェインのキャッシュ
+    """
+    def __init__(self, max_entries=ct.CHAIN_REGISTRY_SESSION_MAX):
+        self._chains = _LruCache(max_entries)
+        self.stats = BuildStats()
+        # 直近のターンの統計を出すための基準値と、最後に終わったターンの統計
+        self._turn_mark = (0, 0, 0.0)
+        self._last_turn = {"hits": 0, "misses": 0, "saved_ms": 0.0}
+
+    def get(self, key, build):
+        """
+        チェインの取得（未構築の場合はbuild()で構築して登録）
+        """
+        chain = self._chains.get(key)
+        if chain is not None:
+            self.stats.record_hit(key[0], self.stats.average_build_seconds(key[0]))
+            return chain
+        start = time.perf_counter()
+        chain = build()
+        self.stats.record_build(key[0], time.perf_counter() - start)
+        self._chains.put(key, chain)
+        return chain
+
+    def end_turn(self):
+        """
+        ターンの終了を記録し、前回のターン終了以降（1ターン分）の再利用回数・構築回数・省けた時間を確定する
+        """
+        hits, misses, saved = self._turn_mark
+        self._turn_mark = (self.stats.hits, self.stats.misses, self.stats.saved_seconds)
+        self._last_turn = {
+            "hits": self.stats.hits - hits,
+            "misses": self.stats.misses - misses,
+            "saved_ms": (self.stats.saved_seconds - saved) * 1000,
+        }
+        return self._last_turn
+
+    def turn_stats(self):
+        """
+        最後に終わったターンの再利用回数・構築回数・省けた時間（ターン以外の再実行では変わらない）
+        """
+        return self._last_turn
+
+
+_prompt_registry = PromptRegistry()
+
+
+def get_prompt_registry():
+    return _prompt_registry
@@ -1,3 +1,5 @@
+import os
+
 APP_NAME = "生成AI英会話アプリ"
 MODE_1 = "日常英会話"
 MODE_2 = "シャドーイング"
@@ -96,6 +98,11 @@ SYSTEM_TEMPLATE_CREATE_PROBLEM_ADVANCED = """
     
     Limit your response to ONLY the English sentence with no explanations.
 """
+PROBLEM_TEMPLATES_BY_LEVEL = {
+    "初級者": SYSTEM_TEMPLATE_CREATE_PROBLEM_BEGINNER,
+    "中級者": SYSTEM_TEMPLATE_CREATE_PROBLEM_INTERMEDIATE,
+    "上級者": SYSTEM_TEMPLATE_CREATE_PROBLEM_ADVANCED,
+}
 
 # 問題文と回答を比較し、評価結果の生成を支持するプロンプトを作成
 SYSTEM_TEMPLATE_EVALUATION = """
@@ -164,9 +171,7 @@ SYSTEM_TEMPLATE_ENHANCED_EVALUATION = """
 
 # 文化的コンテキスト提供用プロンプト
 SYSTEM_TEMPLATE_CULTURAL_CONTEXT = """
-    You are an expert in English language and cultural nuances. Based on the following sentence or phrase, provide brief cultural context that would help a Japanese learner understand its usage better:
-    
-    Sentence: {sentence}
+    You are an expert in English language and cultural nuances. Based on the sentence or phrase given by the user, provide brief cultural context that would help a Japanese learner understand its usage better.
     
     Respond in Japanese with:
     1. A brief explanation of any cultural references or nuances
@@ -175,23 +180,290 @@ SYSTEM_TEMPLATE_CULTURAL_CONTEXT = """
     
     Keep your response concise and focused on information that would be most helpful for language learning.
 """
+# 文化的コンテキストの対象の文（システムプロンプトを固定し、構築済みのチェインを再利用するため入力として渡す）
+CULTURAL_CONTEXT_INPUT = """
+    Sentence: {sentence}
+"""
 
 # エラーパターン分析プロンプト
+# 会話の本文ではなく、ターンごとに分類・集計済みの誤りの件数（前回の助言以降の増分）だけを渡す
 SYSTEM_TEMPLATE_ERROR_ANALYSIS = """
-    Analyze the following user's English speech patterns based on the last 5-10 interactions:
+    You are tracking an English learner's recurring errors. Errors are classified turn by turn and counted by category.
+    
+    Previous advice (may be empty):
+    {previous_advice}
     
-    {conversation_history}
+    Changes since the previous advice:
+    {error_delta}
     
-    Identify:
-    1. Recurring grammatical errors
-    2. Vocabulary limitations or misuses
-    3. Pronunciation patterns (based on transcription errors)
-    4. Structural patterns in sentences
+    Overall error counts so far:
+    {error_totals}
+    
+    Category names: article, preposition, verb_form, agreement, word_choice, word_order, missing_word, extra_word, short_answer.
     
     Provide a concise Japanese summary of:
-    1. The top 3 error patterns
-    2. Specific exercises or focus areas to address these patterns
-    3. Strengths to build upon
+    1. How the error patterns changed since the previous advice (improvements and new problems)
+    2. The top 3 error patterns to focus on now
+    3. Specific exercises or focus areas to address these patterns
     
     この分析はユーザーの英語学習をサポートするためのものです。建設的で具体的なフィードバックを提供してください。
-"""
\ No newline at end of file
+"""
+
+# エラープロファイル（誤りの傾向の逐次集計）の設定
+ERROR_CATEGORY_LABELS = {
+    "article": "冠詞",
+    "preposition": "前置詞",
+    "verb_form": "動詞の形・語形変化",
+    "agreement": "主語と動詞の一致",
+    "word_choice": "語の選択",
+    "word_order": "語順",
+    "missing_word": "語の抜け",
+    "extra_word": "余分な語",
+    "short_answer": "短すぎる応答",
+}
+# これより短い発話（単語数）は「短すぎる応答」とみなす
+ERROR_PROFILE_SHORT_ANSWER_WORDS = 3
+# 日常英会話のターンは、ローカルの規則に加えて小さなLLM呼び出し1回で分類する（定期的なエラー分析が有効な場合のみ）
+ERROR_PROFILE_LLM_CLASSIFY = True
+# 会話の何ターンごとに助言を更新するか
+ERROR_ADVICE_INTERVAL_TURNS = 10
+SYSTEM_TEMPLATE_ERROR_CLASSIFY = """
+    Classify the grammatical and usage errors in the English learner's utterance below.
+    Answer only with a comma-separated list of category names from this list, or "none":
+    article, preposition, verb_form, agreement, word_choice, word_order, missing_word, extra_word
+    
+    Learner's level: {level}
+    Utterance: {user_text}
+"""
+
+# TTS音声のストリーミング再生設定
+# response_format="pcm" の場合、OpenAIのTTSは 24kHz / 16bit / モノラルのリトルエンディアンPCMを返す
+TTS_MODEL = "tts-1"
+TTS_DEFAULT_VOICE = "alloy"
+TTS_PCM_SAMPLE_RATE = 24000
+TTS_PCM_SAMPLE_WIDTH = 2
+TTS_PCM_CHANNELS = 1
+STREAMING_PLAYBACK_DEFAULT = True
+# HTTPレスポンスから一度に読み取るバイト数
+STREAM_CHUNK_SIZE = 4096
+# リングバッファの容量（約4秒分）。受信が再生より速い場合はここで受信側が待機する
+STREAM_RING_BUFFER_SIZE = TTS_PCM_SAMPLE_RATE * TTS_PCM_SAMPLE_WIDTH * TTS_PCM_CHANNELS * 4
+# 出力ストリームへ書き込む1回あたりのフレーム数
+PLAYBACK_FRAMES_PER_BUFFER = 1024
+
+# 音声データはメモリ上で受け渡す。1にすると確認用に入出力音声をWAVファイルとして書き出す
+AUDIO_DEBUG_SPILL = os.environ.get("AUDIO_DEBUG_SPILL") == "1"
+WHISPER_MODEL = "whisper-1"
+
+# 再生速度変更時に音程を保つかどうか（Falseの場合はサンプリングレート変更による従来方式）
+PITCH_PRESERVING_SPEED = True
+# WSOLAの分析フレーム長と、波形が似た位置を探す許容範囲（ミリ秒）
+TIME_STRETCH_FRAME_MS = 40
+TIME_STRETCH_TOLERANCE_MS = 10
+
+# TTSキャッシュ設定（再生可能なPCMをメモリとディスクに保持）
+TTS_CACHE_ENABLED = True
+TTS_CACHE_DIR = "audio/cache"
+TTS_CACHE_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+TTS_CACHE_DISK_MAX_BYTES = 512 * 1024 * 1024
+
+# 問題の先読み設定（シャドーイング・ディクテーション）
+PROBLEM_PREFETCH_DEPTH = 2
+# 先読み中の問題が届くまで待つ最大秒数
+PROBLEM_PREFETCH_WAIT_SEC = 30
+# 先読みに使うスレッド数（全セッションで共有する）
+PROBLEM_PREFETCH_WORKERS = 4
+
+# セッション間で共有する問題プールの設定（問題文と音声をレベル・テーマごとに使い回す）
+PROBLEM_POOL_ENABLED = True
+# 取り出した後にセッションの未出題の問題がこの数を下回ったら補充する
+PROBLEM_POOL_MIN_UNSEEN = 2
+# キーごとに同時に生成する問題数の上限（同時に不足したセッションは実行中の生成を待つ）
+PROBLEM_POOL_MAX_IN_FLIGHT_PER_KEY = 2
+PROBLEM_POOL_WORKERS = 4
+# 保持する問題数の上限（1問あたり音声で約200KB）。超えた分は古い問題から捨てる
+PROBLEM_POOL_MAX_PER_KEY = 40
+PROBLEM_POOL_MAX_TOTAL = 200
+
+# 会話履歴の保存先（SQLite）。旧形式のJSONファイルが残っていれば初回起動時に取り込む
+HISTORY_DB_PATH = "conversation_history.db"
+LEGACY_HISTORY_JSON_PATH = "conversation_history.json"
+HISTORY_DB_BUSY_TIMEOUT_SEC = 10
+
+# 1ターン内の並行処理の設定
+TURN_EXECUTOR_MAX_WORKERS = 8
+TTS_STAGE_TIMEOUT_SEC = 30
+CULTURAL_CONTEXT_STAGE_TIMEOUT_SEC = 20
+
+# 回答のストリーミング表示と文単位の読み上げ設定
+STREAMING_REPLY_DEFAULT = True
+# これより短い文は次の文とまとめて音声合成する
+SENTENCE_MIN_CHARS = 12
+# 同時に音声合成する文の数（1ターンあたり）
+SENTENCE_TTS_MAX_AHEAD = 2
+# 文ごとの音声合成に使うスレッド数（全セッションで共有する）
+SENTENCE_TTS_WORKERS = 8
+
+# プロンプト・チェインの再利用設定（保持する最大件数）
+CHAIN_REGISTRY_PROMPT_MAX = 256
+CHAIN_REGISTRY_SESSION_MAX = 32
+
+# 用途ごとのメモリ方針（conversation: 会話メモリ / evaluation: 評価専用メモリ / oneshot: メモリなし）
+MEMORY_POLICIES = {
+    "conversation": "conversation",
+    "evaluation": "evaluation",
+    "problem": "oneshot",
+    "cultural_context": "oneshot",
+    "error_analysis": "oneshot",
+    "pronunciation": "oneshot",
+}
+# 評価専用メモリに残す直近のやり取りの数
+EVALUATION_MEMORY_TURNS = 3
+
+# ローカル採点結果（単語の差分）を前提にした評価プロンプト
+# 単語の正確性はローカルで確定済みのため、LLMには文法・表現面の助言のみを求める
+SYSTEM_TEMPLATE_EVALUATION_WITH_DIFF = """
+    あなたは英語学習の専門家です。
+    ユーザーから問題文・回答文・単語の差分（採点済み）が与えられます。
+    レベル：{level}
+    
+    差分を踏まえ、以下を日本語で簡潔に提供してください：
+    【改善点】 差分の原因として考えられる文法・聞き取りの弱点（時制、冠詞、前置詞、音の連結など）
+    【具体的なアドバイス】 このレベルに合わせた練習方法を3つ箇条書きで
+    最後に、前向きに次の練習へ取り組めるような励ましの一言を添えてください。
+"""
+# 評価の対象（ターンごとに変わる内容はシステムプロンプトに含めず、入力として渡す）
+EVALUATION_WITH_DIFF_INPUT = """
+    問題文：{llm_text}
+    回答文：{user_text}
+    
+    【単語の差分（採点済み）】
+    {local_diff}
+"""
+
+# LLMによる詳細評価の既定値（ローカル採点は常に行う）
+LLM_EVALUATION_DEFAULT = True
+
+# 発音分析（お手本のTTS音声と録音の比較）の設定
+PRONUNCIATION_ANALYSIS_ENABLED = True
+PRONUNCIATION_SAMPLE_RATE = 16000
+PRONUNCIATION_FRAME_MS = 25
+PRONUNCIATION_HOP_MS = 10
+# この長さ以上の無音をポーズとみなす
+PRONUNCIATION_MIN_PAUSE_MS = 150
+# DTWで許容する対角線からの幅（系列長に対する比率）
+PRONUNCIATION_DTW_BAND = 0.25
+
+# 文字起こし前の音声の前処理（発話区間検出・無音の除去・16kHzモノラル化）
+VAD_ENABLED = True
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+# ノイズフロア（エネルギーの下位10%）からこの値以上大きいフレームを発話とみなす
+VAD_NOISE_MARGIN_DB = 12
+# 発話とみなすエネルギーの下限（dBFS）
+VAD_MIN_SPEECH_DB = -50
+# 発話区間の前後に残す余白
+VAD_PADDING_MS = 200
+# これより長いポーズはこの長さまで縮める
+VAD_MAX_PAUSE_MS = 600
+
+# 文字起こし用アップロード音声の形式（"auto" の場合はサイズと時間の見積もりから選択、"wav" / "flac" / "ogg" / "mp3" で固定）
+UPLOAD_ENCODING = "auto"
+# 形式選択で想定するアップロード帯域（バイト/秒、2Mbps相当）
+UPLOAD_ASSUMED_BYTES_PER_SEC = 250_000
+UPLOAD_ALLOW_LOSSY = True
+UPLOAD_ENCODE_MIN_BYTES = 32_000
+UPLOAD_OPUS_BITRATE = "24k"
+UPLOAD_MP3_BITRATE = "32k"
+
+# OpenAI APIの代替サーバー（mock_openai_server.py）の接続先。設定した場合はAPIキーなしでローカルに接続する
+MOCK_OPENAI_BASE_URL = os.environ.get("MOCK_OPENAI_BASE_URL")
+
+# ステージごとの処理時間の計測と書き出し
+LATENCY_ENABLED = True
+# パーセンタイルの計算に使う直近の計測値の件数（ステージごと）
+LATENCY_RECENT_SAMPLES = 256
+# 書き出し形式（"jsonl" / "prometheus"。既定は書き出さない。環境変数で指定した場合のみ書き出す）
+LATENCY_EXPORT_FORMAT = os.environ.get("LATENCY_EXPORT_FORMAT") or None
+LATENCY_EXPORT_PATH = os.environ.get(
+    "LATENCY_EXPORT_PATH",
+    "metrics/latency.prom" if LATENCY_EXPORT_FORMAT == "prometheus" else "metrics/latency.jsonl"
+)
+# 書き出しはバックグラウンドのスレッドでまとめて行う（リクエストのスレッドではメモリ上に溜めるだけ）
+LATENCY_EXPORT_FLUSH_SEC = 5
+# JSONLのファイルがこの大きさを超えたら .1, .2 ... に名前を変えて新しいファイルに書く
+LATENCY_EXPORT_MAX_BYTES = 16 * 1024 * 1024
+LATENCY_EXPORT_BACKUPS = 3
+# 書き出し前に溜めておく件数の上限（超えた分は古いものから捨てる）
+LATENCY_EXPORT_BUFFER_MAX = 10000
+
+# 音声の再生先（"browser": 音声データをブラウザへ送って再生、"desktop": サーバーのスピーカーでPyAudioにより再生）
+# 既定はPyAudioによるストリーミング再生（最初のチャンクが届いた時点で再生が始まる）
+# ブラウザ再生は1回分の音声がそろってから送るため、複数人で使うサーバーに置く場合に PLAYBACK_MODE=browser で切り替える
+PLAYBACK_MODE_DEFAULT = os.environ.get("PLAYBACK_MODE", "desktop")
+PLAYBACK_MODE_LABELS = {
+    "browser": "ブラウザで再生",
+    "desktop": "このPCのスピーカーで再生（PyAudio）",
+}
+# ブラウザ再生でTTS APIに指定する形式（文ごとの音声をバイト列のまま連結して1つにするため、フレームを連結できるmp3を使う）
+BROWSER_AUDIO_FORMAT = "mp3"
+BROWSER_AUDIO_MIME_TYPE = "audio/mpeg"
+
+# OpenAI APIへのHTTP接続（プロセス全体で1つの接続プールを共有する）
+# 同時に張る接続の上限（同時に話しているセッション数 × 1ターン内の並行リクエスト数を目安にする）
+OPENAI_HTTP_MAX_CONNECTIONS = 64
+# 使い終わった後も保持しておくkeep-alive接続の数と保持時間
+OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+OPENAI_HTTP_KEEPALIVE_EXPIRY_SEC = 60
+OPENAI_HTTP_CONNECT_TIMEOUT_SEC = 5
+# レスポンス（ストリーミングの各チャンクを含む）を待つ最大秒数
+OPENAI_HTTP_READ_TIMEOUT_SEC = 60
+# 接続プールに空きができるのを待つ最大秒数
+OPENAI_HTTP_POOL_TIMEOUT_SEC = 10
+OPENAI_MAX_RETRIES = 2
+
+# 問題バンク（problem_bank.py で事前に生成・音声合成した問題の索引付きストア）
+PROBLEM_BANK_ENABLED = True
+PROBLEM_BANK_DB_PATH = "problem_bank.db"
+PROBLEM_BANK_AUDIO_DIR = "audio/bank"
+# 難しさの判定に使う基本語彙
+COMMON_WORDS_PATH = "data/common_words.txt"
+# レベルごとに採用する特徴量の範囲（問題生成プロンプトの語数の指定に合わせる）
+PROBLEM_BANK_LEVEL_RANGES = {
+    "初級者": {"words": (8, 12), "syllables_per_word": (1.0, 1.45), "rare_ratio": (0.0, 0.15)},
+    "中級者": {"words": (12, 18), "syllables_per_word": (1.1, 1.7), "rare_ratio": (0.0, 0.35)},
+    "上級者": {"words": (15, 25), "syllables_per_word": (1.25, 2.3), "rare_ratio": (0.1, 0.7)},
+}
+# 実行時に乱数で選んだ問題が出題済みだった場合に引き直す回数
+PROBLEM_BANK_SAMPLE_RETRIES = 8
+# 一括生成の設定（1回のLLM呼び出しで生成する文の数、同時に実行する呼び出し数）
+PROBLEM_BANK_BATCH_SIZE = 8
+PROBLEM_BANK_CONCURRENCY = 4
+PROBLEM_BANK_TARGET_PER_PAIR = 30
+# 目標数に届かない場合に生成を繰り返す上限
+PROBLEM_BANK_MAX_ROUNDS = 10
+PROBLEM_BANK_BATCH_PROMPT = "Following the rules above, write {count} different sentences, one per line, with no numbering or quotes."
+
+# 文化的コンテキストのキャッシュ（完全一致と、文字n-gramのMinHashによる類似文の検索）
+CULTURAL_CACHE_ENABLED = True
+CULTURAL_CACHE_MAX_ENTRIES = 2000
+# 類似とみなす推定Jaccard係数（文字n-gramの集合）の下限
+CULTURAL_CACHE_SIMILARITY = 0.8
+CULTURAL_CACHE_NGRAM = 4
+# MinHashのハッシュ関数の数と、LSHのバンド数（ハッシュ関数の数を割り切れる数にする）
+CULTURAL_CACHE_MINHASH_PERMUTATIONS = 64
+CULTURAL_CACHE_LSH_BANDS = 16
+
+# 起動時間の予算（benchmarks/bench_startup.py で main.py の先頭の import 文を計測して確認する）
+# 重いライブラリ（langchain / openai / pydub / scipy など）は使うモードで初めて読み込む
+STARTUP_BUDGET_IMPORT_MS = 800
+STARTUP_BUDGET_RSS_MB = 80
+
+# チャット欄の会話の表示（再実行のたびに描画するのは直近のターンのみ）
+TRANSCRIPT_EAGER_TURNS = 10
+# 以前のターンを表示する場合の1ページあたりのターン数
+TRANSCRIPT_PAGE_TURNS = 20
+# セッションのメモリに置くターン数（これより古いターンは会話履歴ストアへ退避し、表示するときに読み込む）
+TRANSCRIPT_MEMORY_TURNS = 30
+# 退避したターンの保持期間（秒。ストアを開いた時点でこれより古いものを削除する）
+TRANSCRIPT_SPILL_RETENTION_SEC = 7 * 24 * 60 * 60
@@ -0,0 +1,155 @@
+"""
+文化的コンテキスト（表現の解説）のキャッシュ
+- 1段目: 正規化した文の完全一致
+- 2段目: 文字n-gramのMinHashによる類似文の検索（LSHのバンドで候補を絞り、推定Jaccard係数がしきい値以上なら採用）
+LLMを呼ばずに判定できるため、よく使う表現の解説はすぐに表示できる
+"""
+import re
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+import numpy as np
+import constants as ct
+
+# MinHashのハッシュ関数（multiply-shift: (a * x + b) mod 2^64 の上位32bit）の係数
+# プロセス間で結果が変わらないよう固定のシードで作る（aは奇数）
+_rng = np.random.default_rng(20240601)
+_HASH_A = _rng.integers(0, 1 << 63, ct.CULTURAL_CACHE_MINHASH_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_HASH_B = _rng.integers(0, 1 << 63, ct.CULTURAL_CACHE_MINHASH_PERMUTATIONS, dtype=np.uint64)
+_NON_WORD = re.compile(r"[^a-z0-9' ]+")
+
+
+def normalize_sentence(sentence):
+    """
+    キャッシュキー用の正規化（全角・半角の統一、小文字化、記号の除去、空白の整理）
+    """
+    text = unicodedata.normalize("NFKC", sentence).lower().replace("’", "'")
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def minhash_signature(text, n=ct.CULTURAL_CACHE_NGRAM):
+    """
+    文字n-gramの集合のMinHash署名
+    Args:
+        text: 正規化済みの文
+        n: n-gramの文字数
+    Returns:
+        ハッシュ関数ごとの最小値の配列
+    """
+    padded = f" {text} "
+    shingles = {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+    values = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    # uint64の桁あふれ（mod 2^64）をそのまま使う
+    with np.errstate(over="ignore"):
+        hashed = (values[:, None] * _HASH_A[None, :] + _HASH_B[None, :]) >> np.uint64(32)
+    return hashed.min(axis=0)
+
+
+class CulturalContextCache:
+    """
+    文化的コンテキストのLRUキャッシュ（完全一致 + 類似文）
+    """
+    def __init__(self, max_entries=ct.CULTURAL_CACHE_MAX_ENTRIES, threshold=ct.CULTURAL_CACHE_SIMILARITY,
+                 bands=ct.CULTURAL_CACHE_LSH_BANDS):
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._max_entries = max_entries
+        self._threshold = threshold
+        self._bands = bands
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_similar = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _band_keys(self, signature):
+        rows = len(signature) // self._bands
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self._bands)]
+
+    def get(self, sentence):
+        """
+        解説の取得
+        Args:
+            sentence: 解説の対象の文
+        Returns:
+            キャッシュ済みの解説（該当するものがない場合はNone）
+        """
+        key = normalize_sentence(sentence)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry[1]
+        signature = minhash_signature(key)
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            best_key = None
+            if candidates:
+                # 候補の署名をまとめて比較し、一致したハッシュ関数の割合（推定Jaccard係数）が最大のものを選ぶ
+                candidates = list(candidates)
+                similarities = (np.stack([self._entries[candidate][0] for candidate in candidates]) == signature).mean(axis=1)
+                best = int(similarities.argmax())
+                if similarities[best] >= self._threshold:
+                    best_key = candidates[best]
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits_similar += 1
+            return self._entries[best_key][1]
+
+    def put(self, sentence, explanation):
+        """
+        解説の登録（上限を超えた分は最近使われていないものから捨てる）
+        """
+        key = normalize_sentence(sentence)
+        signature = minhash_signature(key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (signature, explanation)
+            for band_key in self._band_keys(signature):
+                self._buckets.setdefault(band_key, set()).add(key)
+            while len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        signature, _ = self._entries.pop(key)
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_exact + self.hits_similar + self.misses
+            return {
+                "hits_exact": self.hits_exact,
+                "hits_similar": self.hits_similar,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "hit_rate": (self.hits_exact + self.hits_similar) / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cultural_context_cache():
+    """
+    プロセス全体で共有する文化的コンテキストのキャッシュの取得
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CulturalContextCache()
+        return _cache
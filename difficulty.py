@@ -0,0 +1,111 @@
+"""
+問題文の難しさの特徴量（単語数・1語あたりの音節数・基本語彙にない語の割合）
+文の一覧をまとめて単語に展開し、異なり語ごとに1回だけ判定してから numpy で文ごとに集計する
+"""
+import os
+import re
+import numpy as np
+import constants as ct
+from scoring import tokenize
+
+_VOWEL_GROUP = re.compile(r"[aeiouy]+")
+_SUFFIXES = ("ing", "ed", "es", "s", "ly", "er", "est")
+
+_common_words = None
+
+
+def load_common_words(path=ct.COMMON_WORDS_PATH):
+    """
+    基本語彙の読み込み（#で始まる行はコメント。相対パスはこのモジュールの場所を基準にする）
+    """
+    global _common_words
+    if _common_words is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        words = set()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.startswith("#"):
+                    words.update(line.split())
+        _common_words = frozenset(words)
+    return _common_words
+
+
+def count_syllables(word):
+    count = len(_VOWEL_GROUP.findall(word))
+    # 語末の黙字の e（make, time など）は数えない
+    if word.endswith("e") and not word.endswith(("le", "ee")) and count > 1:
+        count -= 1
+    return max(1, count)
+
+
+def is_common(word, common_words):
+    """
+    基本語彙に含まれる語か（活用形は語尾を外して照合する）
+    """
+    if word in common_words or len(word) <= 2:
+        return True
+    for suffix in _SUFFIXES:
+        stem = word[:-len(suffix)]
+        if word.endswith(suffix) and len(stem) >= 2 and (stem in common_words or stem + "e" in common_words):
+            return True
+    # studies / studied → study
+    if word.endswith(("ies", "ied")) and word[:-3] + "y" in common_words:
+        return True
+    # 子音字を重ねる活用（stopped, running など）
+    for suffix in ("ing", "ed"):
+        if word.endswith(suffix) and word[:-len(suffix) - 1] in common_words:
+            return True
+    return False
+
+
+def compute_features(sentences):
+    """
+    文ごとの難しさの特徴量
+    Args:
+        sentences: 英文のリスト
+    Returns:
+        words（単語数）、syllables_per_word、rare_ratio（基本語彙にない語の割合）、difficulty（0〜1程度の総合値）の配列を持つ辞書
+    """
+    common_words = load_common_words()
+    # 短縮形は展開し、数字は読みに変換してから数える
+    tokens = [tokenize(sentence) for sentence in sentences]
+    counts = np.array([len(words) for words in tokens], dtype=np.int64)
+    sentence_index = np.repeat(np.arange(len(sentences)), counts)
+    flat = [word for words in tokens for word in words]
+    if flat:
+        vocabulary, inverse = np.unique(np.array(flat), return_inverse=True)
+        syllables = np.array([count_syllables(word) for word in vocabulary], dtype=np.float64)[inverse]
+        rare = np.array([not is_common(word, common_words) for word in vocabulary], dtype=np.float64)[inverse]
+    else:
+        syllables = rare = np.zeros(0)
+    safe_counts = np.maximum(counts, 1)
+    syllables_per_word = np.bincount(sentence_index, syllables, len(sentences)) / safe_counts
+    rare_ratio = np.bincount(sentence_index, rare, len(sentences)) / safe_counts
+    # 各特徴量を上級者の範囲の上限付近で1になるよう正規化して重み付け
+    difficulty = (
+        0.4 * np.clip(counts / 25, 0, 1)
+        + 0.3 * np.clip((syllables_per_word - 1.0) / 1.0, 0, 1)
+        + 0.3 * np.clip(rare_ratio / 0.5, 0, 1)
+    )
+    return {
+        "words": counts,
+        "syllables_per_word": syllables_per_word,
+        "rare_ratio": rare_ratio,
+        "difficulty": difficulty,
+    }
+
+
+def within_level(features, level):
+    """
+    レベルごとの範囲（ct.PROBLEM_BANK_LEVEL_RANGES）に収まる文かどうか
+    Args:
+        features: compute_features() の結果
+        level: 英語レベル
+    Returns:
+        文ごとの真偽値の配列
+    """
+    ranges = ct.PROBLEM_BANK_LEVEL_RANGES[level]
+    accepted = np.ones(len(features["words"]), dtype=bool)
+    for name, (low, high) in ranges.items():
+        accepted &= (features[name] >= low) & (features[name] <= high)
+    return accepted
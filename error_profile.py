@@ -0,0 +1,192 @@
+"""
+ユーザーの誤りの傾向（エラープロファイル）の逐次集計
+- 1ターンごとに一度だけ分類し（ローカルの規則 + 必要に応じて小さなLLM呼び出し1回）、
+  誤りの種類・英語レベル・会話テーマごとの件数を会話履歴ストアに加算する
+- 表示は集計済みの件数から行い、LLMによる助言には前回の助言以降の増分だけを渡す
+"""
+import re
+from collections import Counter
+import constants as ct
+from scoring import tokenize
+
+_ARTICLES = {"a", "an", "the"}
+_PREPOSITIONS = {
+    "in", "on", "at", "to", "for", "of", "with", "from", "by", "about", "into", "onto",
+    "over", "under", "between", "during", "after", "before", "since", "until", "through",
+}
+_INFLECTION_SUFFIXES = ("ing", "ed", "es", "s", "d")
+
+# 会話モード（お手本のない発話）で使う誤りの規則
+# 照合は scoring.tokenize() で正規化した文に対して行う（短縮形は展開済み）
+_TEXT_RULES = [
+    ("agreement", re.compile(r"\b(?:he|she|it)\s+(?:do|have|are|were)\b")),
+    ("agreement", re.compile(r"\b(?:you|we|they)\s+(?:is|was|has|does)\b")),
+    ("agreement", re.compile(r"\bi\s+(?:is|are|has|does)\b")),
+    ("article", re.compile(r"\ba\s+(?!one\b|once\b|eu|ew)[aeio]\w*")),
+    ("article", re.compile(r"\ban\s+(?!hour|honest|honor|heir)[b-df-hj-np-tv-z]\w*")),
+    ("verb_form", re.compile(r"\b(?:am|is|are)\s+agree\b")),
+    ("verb_form", re.compile(r"\b(?:did|does|do|can|cannot|will|should|must|could|would)\s+(?:not\s+)?(?!need\b|feed\b|seed\b|speed\b)\w+ed\b")),
+    ("verb_form", re.compile(r"\bdid\s+(?:went|came|saw|ate|took|made|got|had|was)\b")),
+    ("word_choice", re.compile(r"\bmore\s+(?:better|worse|bigger|smaller|easier|faster)\b")),
+    ("word_choice", re.compile(r"\bdiscuss\s+about\b")),
+    ("preposition", re.compile(r"\b(?:married|arrive|arrived)\s+to\b")),
+]
+
+
+def _stem(word):
+    for suffix in _INFLECTION_SUFFIXES:
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def _classify_word(word):
+    if word in _ARTICLES:
+        return "article"
+    if word in _PREPOSITIONS:
+        return "preposition"
+    return None
+
+
+def classify_score(local_score):
+    """
+    ローカル採点の差分（シャドーイング・ディクテーション）からの誤りの分類
+    Args:
+        local_score: scoring.score_answer() の結果
+    Returns:
+        誤りの種類ごとの件数（Counter）
+    """
+    counts = Counter()
+    ops = local_score["ops"]
+    deleted = Counter(ref_word for op, ref_word, _ in ops if op == "delete")
+    inserted = Counter(hyp_word for op, _, hyp_word in ops if op == "insert")
+    # 抜けた単語が別の位置に現れている場合は語順の誤りとみなす
+    moved = deleted & inserted
+    counts["word_order"] += sum(moved.values())
+    deleted -= moved
+    inserted -= moved
+    for op, ref_word, hyp_word in ops:
+        if op == "substitute":
+            category = _classify_word(ref_word) or _classify_word(hyp_word)
+            if category is None:
+                category = "verb_form" if _stem(ref_word) == _stem(hyp_word) else "word_choice"
+            counts[category] += 1
+    for word, n in deleted.items():
+        counts[_classify_word(word) or "missing_word"] += n
+    for word, n in inserted.items():
+        counts[_classify_word(word) or "extra_word"] += n
+    return +counts
+
+
+def classify_text(text):
+    """
+    お手本のない発話（日常英会話）からの誤りの分類（よくある誤りの規則との照合のみ）
+    Args:
+        text: ユーザーの発話
+    Returns:
+        誤りの種類ごとの件数（Counter）
+    """
+    normalized = " ".join(tokenize(text))
+    counts = Counter()
+    for category, pattern in _TEXT_RULES:
+        counts[category] += len(pattern.findall(normalized))
+    if len(normalized.split()) < ct.ERROR_PROFILE_SHORT_ANSWER_WORDS:
+        counts["short_answer"] += 1
+    return +counts
+
+
+def parse_llm_categories(text):
+    """
+    LLMによる分類結果（カンマ区切りの種類名）の読み取り（一覧にない種類は無視する）
+    """
+    counts = Counter()
+    for name in re.split(r"[,\s]+", text.strip().lower()):
+        if name in ct.ERROR_CATEGORY_LABELS:
+            counts[name] += 1
+    return counts
+
+
+def merge_counts(local_counts, llm_counts):
+    """
+    ローカルの分類とLLMの分類の統合（同じ誤りを二重に数えないよう、種類ごとに多い方を採用）
+    """
+    return local_counts | llm_counts
+
+
+def build_profile(rows, turn_rows):
+    """
+    ストアの集計行から表示用のプロファイルを作成
+    Args:
+        rows: (英語レベル, 会話テーマ, 誤りの種類, 件数) の一覧
+        turn_rows: (英語レベル, 会話テーマ, 分類したターン数) の一覧
+    Returns:
+        合計・レベル別・テーマ別の件数と、分類したターン数
+    """
+    totals, by_level, by_theme = Counter(), {}, {}
+    for level, theme, category, count in rows:
+        totals[category] += count
+        by_level.setdefault(level, Counter())[category] += count
+        by_theme.setdefault(theme, Counter())[category] += count
+    return {
+        "turns": sum(turns for _, _, turns in turn_rows),
+        "totals": totals,
+        "by_level": by_level,
+        "by_theme": by_theme,
+    }
+
+
+def profile_delta(profile, last_report):
+    """
+    前回の助言以降の増分
+    Args:
+        profile: build_profile() の結果
+        last_report: 前回の助言の記録（totals / turns を持つ辞書、なければNone）
+    Returns:
+        増えたターン数と、誤りの種類ごとの増分
+    """
+    if last_report is None:
+        return {"turns": profile["turns"], "counts": Counter(profile["totals"])}
+    return {
+        "turns": profile["turns"] - last_report["turns"],
+        "counts": profile["totals"] - Counter(last_report["totals"]),
+    }
+
+
+def _format_counts(counts, limit=None):
+    return "、".join(
+        f"{ct.ERROR_CATEGORY_LABELS.get(category, category)} {count}"
+        for category, count in counts.most_common(limit)
+    )
+
+
+def format_profile_markdown(profile, delta=None):
+    """
+    エラープロファイルの表示用Markdown
+    """
+    if not profile["turns"]:
+        return "まだ分析できるターンがありません。"
+    lines = [f"**分析済み {profile['turns']} ターン**"]
+    if profile["totals"]:
+        lines.append(f"- 全体: {_format_counts(profile['totals'])}")
+    else:
+        lines.append("- 誤りは見つかっていません")
+    for level, counts in profile["by_level"].items():
+        lines.append(f"- {level}: {_format_counts(counts, 3)}")
+    for theme, counts in profile["by_theme"].items():
+        lines.append(f"- {theme}: {_format_counts(counts, 3)}")
+    if delta is not None and delta["turns"]:
+        lines.append(f"\n前回の助言以降: {delta['turns']} ターン"
+                     + (f"（{_format_counts(delta['counts'])}）" if delta["counts"] else ""))
+    return "\n".join(lines)
+
+
+def format_delta_for_prompt(profile, delta):
+    """
+    助言の生成に渡す増分の要約（会話の本文は渡さない）
+    """
+    lines = [f"New turns since last advice: {delta['turns']}"]
+    for category, count in delta["counts"].most_common():
+        lines.append(f"- {category}: +{count} (total {profile['totals'][category]})")
+    if not delta["counts"]:
+        lines.append("- no new errors detected")
+    return "\n".join(lines)
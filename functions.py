@@ -1,29 +1,33 @@
 import streamlit as st
-import os
+import subprocess
 import time
-import json
-from pathlib import Path
-import wave
-import pyaudio
-from pydub import AudioSegment
-from audiorecorder import audiorecorder
-import numpy as np
-from scipy.io.wavfile import write
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    MessagesPlaceholder,
-)
-from langchain.schema import SystemMessage
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain_openai import ChatOpenAI
-from langchain.chains import ConversationChain
+# langchain / openai / pydub / scipy などの重いライブラリは起動を遅くするため、
+# ここでは読み込まず、使う関数の中で初めて読み込む（2回目以降は sys.modules から取り出すだけ）
 import constants as ct
+import api_clients
+from audio_buffer import PcmBuffer, EncodedAudio, spill_to_disk
+from upload_encoder import encode, encode_for_upload, get_encoder_policy, find_ffmpeg
+from audio_stream import SpeechStream, play_ring_buffer, play_pcm, collect_ring_buffer, collect_pcm
+from tts_cache import TtsCache, get_tts_cache
+from prefetch import ProblemPrefetcher
+from problem_pool import get_problem_pool
+from history_store import get_history_store
+from sentence_pipeline import SentenceSplitter, SentenceSpeechPipeline
+from chain_registry import SessionChains, get_prompt_registry, make_key as make_chain_key
+from memory_policy import PolicyChain, TokenMeter, count_message_tokens, get_memory_policy
+from scoring import score_answer, format_score_markdown, format_diff_for_prompt
+from turn_executor import get_turn_executor
+from transcript import Transcript, page_range, page_count
+import error_profile
+from error_profile import format_profile_markdown
+import latency
 
-def record_audio(audio_input_file_path):
+def record_audio_buffer():
     """
-    音声入力を受け取って音声ファイルを作成
+    音声入力を受け取ってメモリ上のPCMバッファを作成（ファイルは作成しない）
     """
+    from audiorecorder import audiorecorder
+    
     audio = audiorecorder(
         start_prompt="発話開始",
         pause_prompt="やり直す",
@@ -32,131 +36,512 @@ def record_audio(audio_input_file_path):
         pause_style={"color":"gray", "background-color":"white"},
         stop_style={"color":"white", "background-color":"black"}
     )
-    if len(audio) > 0:
-        audio.export(audio_input_file_path, format="wav")
-    else:
+    if len(audio) == 0:
         st.stop()
+    with latency.span("record_export"):
+        audio_buffer = PcmBuffer.from_segment(audio)
+        spill_to_disk(audio_buffer, ct.AUDIO_INPUT_DIR, "audio_input")
+    return audio_buffer
 
-def transcribe_audio(audio_input_file_path):
+def transcribe_audio_buffer(audio_buffer):
     """
-    音声入力ファイルから文字起こしテキストを取得
+    メモリ上の音声バッファから文字起こしテキストを取得
     Args:
-        audio_input_file_path: 音声入力ファイルのパス
-    """
-    with open(audio_input_file_path, 'rb') as audio_input_file:
-        transcript = st.session_state.openai_obj.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_input_file,
+        audio_buffer: 音声入力のPcmBuffer
+    """
+    upload_stats = {"original_bytes": audio_buffer.nbytes}
+    if ct.VAD_ENABLED:
+        # 無音の除去と16kHzモノラル化でアップロード量を減らす（削減量はサイドバーに表示）
+        from audio_preprocess import preprocess_for_transcription
+        
+        with latency.span("transcribe_preprocess"):
+            audio_buffer, upload_stats = preprocess_for_transcription(audio_buffer)
+    # 帯域に応じてFLAC / Opus / MP3に圧縮
+    fmt = None if ct.UPLOAD_ENCODING == "auto" else ct.UPLOAD_ENCODING
+    with latency.span("transcribe_encode"):
+        upload_file, encode_stats = encode_for_upload(audio_buffer, get_encoder_policy(), fmt)
+    upload_stats.update(encode_stats)
+    st.session_state.transcription_upload_stats = upload_stats
+    with latency.span("transcribe"):
+        return get_openai_obj().audio.transcriptions.create(
+            model=ct.WHISPER_MODEL,
+            file=upload_file,
             language="en"
         )
-    
-    # 音声入力ファイルを削除
-    os.remove(audio_input_file_path)
-    return transcript
 
-def save_to_wav(llm_response_audio, audio_output_file_path):
+class PreparedSpeech:
+    """
+    再生待ちの音声（キャッシュ済み・合成済み・ストリーミング受信中・ブラウザ再生用のエンコード済みのいずれか）
+    """
+    def __init__(self, cache_key, speed, audio_buffer=None, speech_stream=None, from_cache=False, encoded_audio=None):
+        self.cache_key = cache_key
+        self.speed = speed
+        self.audio_buffer = audio_buffer
+        self.speech_stream = speech_stream
+        self.from_cache = from_cache
+        self.encoded_audio = encoded_audio
+
+def prepare_speech(text, voice=ct.TTS_DEFAULT_VOICE, speed=1.0, openai_obj=None, streaming=None, playback_mode=None):
+    """
+    読み上げ用の音声を用意（再生はしない）
+    同じ文・音声・速度の組み合わせはキャッシュを使い、API呼び出しを省く
+    openai_obj・streaming・playback_modeを指定すれば、セッション状態に触れないためバックグラウンドスレッドからも呼び出せる
+    Args:
+        text: 読み上げるテキスト
+        voice: 音声の種類
+        speed: 再生速度（1.0が通常速度）
+        openai_obj: OpenAIのオブジェクト（省略時はセッションのものを使用）
+        streaming: ストリーミング再生するかどうか（省略時はセッションの設定を使用）
+        playback_mode: 再生先（省略時はセッションの設定を使用）
+    """
+    if openai_obj is None:
+        openai_obj = get_openai_obj()
+    if streaming is None:
+        streaming = st.session_state.get("streaming_playback", ct.STREAMING_PLAYBACK_DEFAULT)
+    if playback_mode is None:
+        playback_mode = get_playback_mode()
+
+    if playback_mode == "browser":
+        return prepare_browser_speech(text, voice, speed, openai_obj)
+
+    cache_key = None
+    if ct.TTS_CACHE_ENABLED:
+        cache_key = TtsCache.make_key(ct.TTS_MODEL, voice, text, speed)
+        cached_audio = get_tts_cache().get(cache_key)
+        if cached_audio is not None:
+            # 速度変換済みのPCMを保持しているので、そのまま再生する
+            return PreparedSpeech(cache_key, 1.0, audio_buffer=cached_audio, from_cache=True)
+
+    if streaming:
+        # 最初のチャンクが届いた時点で再生を始められるよう、受信を開始して返す
+        return PreparedSpeech(cache_key, speed, speech_stream=SpeechStream(openai_obj, text, voice).start())
+
+    with latency.span("tts"):
+        llm_response_audio = openai_obj.audio.speech.create(
+            model=ct.TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format="pcm"
+        )
+    return PreparedSpeech(cache_key, speed, audio_buffer=PcmBuffer(llm_response_audio.content))
+
+def prepare_browser_speech(text, voice, speed, openai_obj):
     """
-    一旦mp3形式で音声ファイル作成後、wav形式に変換
+    ブラウザ再生用の音声を用意（TTS APIにエンコード済みの形式で返させ、PCMへの変換やWAVへの包み直しは行わない）
+    速度変換もTTS APIの speed で行う
     Args:
-        llm_response_audio: LLMからの回答の音声データ
-        audio_output_file_path: 出力先のファイルパス
+        text: 読み上げるテキスト
+        voice: 音声の種類
+        speed: 再生速度（1.0が通常速度）
+        openai_obj: OpenAIのオブジェクト
     """
-    temp_audio_output_filename = f"{ct.AUDIO_OUTPUT_DIR}/temp_audio_output_{int(time.time())}.mp3"
-    with open(temp_audio_output_filename, "wb") as temp_audio_output_file:
-        temp_audio_output_file.write(llm_response_audio)
-    
-    audio_mp3 = AudioSegment.from_file(temp_audio_output_filename, format="mp3")
-    audio_mp3.export(audio_output_file_path, format="wav")
-    # 音声出力用に一時的に作ったmp3ファイルを削除
-    os.remove(temp_audio_output_filename)
+    cache_key = None
+    if ct.TTS_CACHE_ENABLED:
+        cache_key = TtsCache.make_key(ct.TTS_MODEL, voice, text, speed, ct.BROWSER_AUDIO_FORMAT)
+        cached_audio = get_tts_cache().get(cache_key)
+        if cached_audio is not None:
+            return PreparedSpeech(cache_key, 1.0, from_cache=True, encoded_audio=cached_audio)
+
+    with latency.span("tts"):
+        llm_response_audio = openai_obj.audio.speech.create(
+            model=ct.TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format=ct.BROWSER_AUDIO_FORMAT,
+            speed=speed
+        )
+    return PreparedSpeech(
+        cache_key, 1.0, encoded_audio=EncodedAudio(llm_response_audio.content, ct.BROWSER_AUDIO_MIME_TYPE)
+    )
+
+def get_playback_mode():
+    """
+    音声の再生先（browser / desktop）の取得
+    """
+    return st.session_state.get("playback_mode", ct.PLAYBACK_MODE_DEFAULT)
 
-def play_wav(audio_output_file_path, speed=1.0):
+def play_speech(prepared_speech, playback_mode=None):
     """
-    音声ファイルの読み上げ
+    prepare_speech() で用意した音声の読み上げ
+    音声はPCMのままメモリ上で扱い、ファイルへの書き出しやmp3からの変換は行わない
+    ブラウザ再生用のエンコード済み音声の場合はここでは再生しない（画面への出力は render_browser_audio()）
     Args:
-        audio_output_file_path: 音声ファイルのパス
-        speed: 再生速度（1.0が通常速度、0.5で半分の速さ、2.0で倍速など）
+        prepared_speech: PreparedSpeech
+        playback_mode: 再生先（省略時はセッションの設定を使用。別スレッドから呼ぶ場合は指定すること）
+    Returns:
+        読み上げた音声データ（PcmBuffer。ブラウザ再生の場合はこれから再生するEncodedAudio）
+    """
+    if playback_mode is None:
+        playback_mode = get_playback_mode()
+    if prepared_speech.encoded_audio is not None:
+        if not prepared_speech.from_cache and prepared_speech.cache_key is not None:
+            get_tts_cache().put(prepared_speech.cache_key, prepared_speech.encoded_audio)
+        return prepared_speech.encoded_audio
+    if playback_mode == "desktop":
+        with latency.span("playback"):
+            if prepared_speech.speech_stream is not None:
+                audio_buffer = play_ring_buffer(prepared_speech.speech_stream.ring, prepared_speech.speed)
+            else:
+                audio_buffer = play_pcm(prepared_speech.audio_buffer, prepared_speech.speed)
+    else:
+        # PCMで用意した音声をブラウザで再生する場合は、受信と速度変換のあとエンコードして返す
+        with latency.span("playback_prepare"):
+            if prepared_speech.speech_stream is not None:
+                audio_buffer = collect_ring_buffer(prepared_speech.speech_stream.ring, prepared_speech.speed)
+            else:
+                audio_buffer = collect_pcm(prepared_speech.audio_buffer, prepared_speech.speed)
+    if not prepared_speech.from_cache:
+        spill_to_disk(audio_buffer, ct.AUDIO_OUTPUT_DIR, "audio_output")
+        if prepared_speech.cache_key is not None:
+            get_tts_cache().put(prepared_speech.cache_key, audio_buffer)
+    if playback_mode != "desktop":
+        return encode_browser_audio(audio_buffer)
+    return audio_buffer
+
+def encode_browser_audio(audio_buffer):
+    """
+    PCMしかない音声（問題文の読み上げなど）をブラウザへ送る形式に変換
+    ffmpegが使える場合は BROWSER_AUDIO_FORMAT にエンコードし、使えない場合はWAVにする
+    Args:
+        audio_buffer: PcmBuffer
+    Returns:
+        EncodedAudio
+    """
+    policy = get_encoder_policy()
+    if find_ffmpeg() and policy.is_available(ct.BROWSER_AUDIO_FORMAT):
+        try:
+            _, data, mime_type = encode(audio_buffer, ct.BROWSER_AUDIO_FORMAT)
+            return EncodedAudio(data, mime_type)
+        except (OSError, subprocess.CalledProcessError):
+            # エンコーダーが含まれていない場合は、以降もエンコードを試さない
+            policy.mark_unavailable(ct.BROWSER_AUDIO_FORMAT)
+    return EncodedAudio(audio_buffer.to_wav_bytes(), "audio/wav")
+
+def render_browser_audio(audio_clips, container=None):
+    """
+    音声をブラウザへ送り、自動再生する（サーバー側では再生を待たない）
+    Args:
+        audio_clips: EncodedAudio、またはその一覧（文ごとの音声はバイト列のまま順につないで1つにする）
+        container: 出力先（省略時は現在の位置）
+    """
+    if isinstance(audio_clips, EncodedAudio):
+        audio_clips = [audio_clips]
+    audio_clips = [audio_clip for audio_clip in audio_clips if audio_clip is not None and audio_clip.nbytes]
+    if not audio_clips:
+        return
+    data = audio_clips[0].data if len(audio_clips) == 1 else b"".join(audio_clip.data for audio_clip in audio_clips)
+    (container or st).audio(data, format=audio_clips[0].mime_type, autoplay=True)
+
+def render_pending_audio():
+    """
+    再実行をまたいで再生する音声（問題文の読み上げなど）があれば、ブラウザへ送る
+    """
+    audio_clip = st.session_state.pop("pending_browser_audio", None)
+    if audio_clip is not None:
+        render_browser_audio(audio_clip)
+
+def render_message(message, show_cultural_context=False):
     """
-    # 音声ファイルの読み込み
-    audio = AudioSegment.from_wav(audio_output_file_path)
+    メッセージ1件の表示
+    Args:
+        message: transcript.Message（アシスタントの場合は cultural_context を持つことがある）
+        show_cultural_context: 文化的コンテキストを表示するかどうか
+    """
+    if message.role == "assistant":
+        with st.chat_message(message.role, avatar=ct.AI_ICON_PATH):
+            st.markdown(message.content)
+            # 文化的コンテキストの表示が有効で、アシスタントのメッセージに英文が含まれている場合
+            if show_cultural_context and message.cultural_context:
+                with st.expander("文化的コンテキスト"):
+                    st.info(message.cultural_context)
+    elif message.role == "user":
+        with st.chat_message(message.role, avatar=ct.USER_ICON_PATH):
+            st.markdown(message.content)
+    else:
+        st.divider()
+
+def create_transcript():
+    """
+    セッションのメッセージ一覧の作成（古いターンは会話履歴ストアへ退避し、メモリに置く量を一定に保つ）
+    """
+    return Transcript()
+
+def render_transcript():
+    """
+    メッセージ一覧の表示
+    直近の ct.TRANSCRIPT_EAGER_TURNS ターンだけを毎回描画し、それより前のターンは折りたたんでページ単位で表示する
+    （再実行の時間が会話の長さに比例して伸びないようにする）
+    """
+    transcript = st.session_state.messages
+    older_turns = max(0, len(transcript) - ct.TRANSCRIPT_EAGER_TURNS)
+    if older_turns:
+        render_older_turns(older_turns)
+    show_cultural_context = st.session_state.show_cultural_context
+    for message in transcript.messages(older_turns):
+        render_message(message, show_cultural_context)
+
+@st.fragment
+def render_older_turns(older_turns):
+    """
+    直近より前のターンの表示（フラグメントとして実行し、表示の切り替えやページ送りでは画面全体を再実行しない）
+    メモリから退避したターンは、表示するページの分だけ会話履歴ストアから読み込む
+    Args:
+        older_turns: 直近の表示範囲より前のターン数
+    """
+    if not st.toggle(f"以前の会話を表示（{older_turns} ターン）", key="transcript_show_older"):
+        return
+    pages = page_count(older_turns, ct.TRANSCRIPT_PAGE_TURNS)
+    page = 1
+    if pages > 1:
+        page = st.number_input(
+            f"ページ（1が最も新しい / 全{pages}ページ）",
+            min_value=1,
+            max_value=pages,
+            value=1,
+            key="transcript_page"
+        )
+    first_turn, last_turn = page_range(older_turns, page, ct.TRANSCRIPT_PAGE_TURNS)
+    show_cultural_context = st.session_state.show_cultural_context
+    with st.container(border=True):
+        for message in st.session_state.messages.messages(first_turn, last_turn):
+            render_message(message, show_cultural_context)
+
+def create_sentence_speech_pipeline(speed=1.0, openai_obj=None, streaming=None):
+    """
+    文単位で音声合成・再生するパイプラインの作成
+    音声は最初の文の内容から選び、以降の文も同じ音声で読み上げる
+    音声合成・再生に失敗した文は、次の文を再生する前にストリーミングせずに読み上げ直す
+    Args:
+        speed: 再生速度（1.0が通常速度）
+        openai_obj: OpenAIのオブジェクト（省略時はセッションのものを使用）
+        streaming: ストリーミング再生するかどうか（省略時はセッションの設定を使用）
+    """
+    if openai_obj is None:
+        openai_obj = get_openai_obj()
+    if streaming is None:
+        streaming = st.session_state.get("streaming_playback", ct.STREAMING_PLAYBACK_DEFAULT)
+    playback_mode = get_playback_mode()
+    
+    def respeak_sentence(sentence_and_voice):
+        # キャッシュやストリーミングの失敗を避けるため、ストリーミングせずに合成し直す
+        return play_speech(prepare_speech(*sentence_and_voice, speed, openai_obj, False, playback_mode), playback_mode)
+    
+    pipeline = SentenceSpeechPipeline(
+        lambda sentence_and_voice: prepare_speech(*sentence_and_voice, speed, openai_obj, streaming, playback_mode),
+        lambda prepared_speech: play_speech(prepared_speech, playback_mode),
+        fallback=respeak_sentence
+    )
+    voice = []
+    
+    def add_sentence(sentence):
+        if not voice:
+            voice.append(select_voice(sentence))
+        pipeline.add((sentence, voice[0]))
+    
+    return pipeline, add_sentence
+
+def stream_conversation_reply(chain, user_input, on_text=None, on_sentence=None):
+    """
+    ConversationChainと同じ入力・メモリで回答をストリーミング生成
+    Args:
+        chain: ConversationChain
+        user_input: ユーザーの入力
+        on_text: 途中までの回答テキストを受け取る関数（画面表示用）
+        on_sentence: 完結した文を受け取る関数（音声合成用）
+    Returns:
+        回答テキスト全体
+    """
+    inputs = {chain.input_key: user_input}
+    inputs.update(chain.memory.load_memory_variables(inputs))
+    messages = chain.prompt.format_messages(**inputs)
+    
+    splitter = SentenceSplitter()
+    response = ""
+    start = time.perf_counter()
+    for chunk in chain.llm.stream(messages):
+        if not chunk.content:
+            continue
+        if not response:
+            latency.record("llm_first_token", (time.perf_counter() - start) * 1000)
+        response += chunk.content
+        if on_text is not None:
+            on_text(response)
+        if on_sentence is not None:
+            for sentence in splitter.feed(chunk.content):
+                on_sentence(sentence)
+    if on_sentence is not None:
+        rest = splitter.flush()
+        if rest:
+            on_sentence(rest)
     
-    # 速度を変更
-    if speed != 1.0:
-        # frame_rateを変更することで速度を調整
-        modified_audio = audio._spawn(
-            audio.raw_data, 
-            overrides={"frame_rate": int(audio.frame_rate * speed)}
+    latency.record("llm_conversation", (time.perf_counter() - start) * 1000)
+    
+    # predict() と同様に、入力と回答をメモリへ保存（必要に応じて要約も行われる）
+    with latency.span("memory_save"):
+        chain.memory.save_context({chain.input_key: user_input}, {chain.output_key: response})
+    record_conversation_history_tokens(chain)
+    return response
+
+def predict_conversation_reply(chain, user_input):
+    """
+    ConversationChain.predict() と同じ回答生成（ストリーミングしない場合）
+    回答の生成とメモリへの保存（要約）を別々に計測し、ストリーミングの場合と比較できるようにする
+    Args:
+        chain: ConversationChain
+        user_input: ユーザーの発話
+    Returns:
+        回答テキスト
+    """
+    inputs = {chain.input_key: user_input}
+    inputs.update(chain.memory.load_memory_variables(inputs))
+    messages = chain.prompt.format_messages(**inputs)
+    with latency.span("llm_conversation"):
+        response = chain.llm.invoke(messages).content
+    with latency.span("memory_save"):
+        chain.memory.save_context({chain.input_key: user_input}, {chain.output_key: response})
+    record_conversation_history_tokens(chain)
+    return response
+
+def record_conversation_history_tokens(chain):
+    """
+    会話メモリの履歴のトークン数を数えてトークン計測に渡す（他の用途との比較用）
+    会話メモリはスクリプトのスレッドでのみ扱うため、保存の直後にここで数える
+    Args:
+        chain: ConversationChain
+    """
+    history = chain.memory.load_memory_variables({})["history"]
+    get_token_meter().set_conversation_history_tokens(count_message_tokens(chain.llm, history))
+
+def get_session_latency():
+    """
+    セッションごとの処理時間の計測値を取得（スクリプトのスレッドに紐付ける）
+    """
+    if "session_latency" not in st.session_state:
+        st.session_state.session_latency = latency.SessionLatency()
+    latency.bind_session(st.session_state.session_latency)
+    return st.session_state.session_latency
+
+def get_openai_obj():
+    """
+    セッションで使うOpenAIのオブジェクトの取得（プロセス全体で共有するクライアントを最初に使う時点で作成する）
+    """
+    if "openai_obj" not in st.session_state:
+        st.session_state.openai_obj, st.session_state.llm = api_clients.get_default_clients()
+    return st.session_state.openai_obj
+
+def get_llm():
+    """
+    セッションで使うChatOpenAIのオブジェクトの取得
+    """
+    if "llm" not in st.session_state:
+        st.session_state.openai_obj, st.session_state.llm = api_clients.get_default_clients()
+    return st.session_state.llm
+
+def get_conversation_memory():
+    """
+    会話用のメモリの取得（会話用のChainを最初に作る時点で作成する）
+    """
+    if "memory" not in st.session_state:
+        from langchain.memory import ConversationSummaryBufferMemory
+        
+        st.session_state.memory = ConversationSummaryBufferMemory(
+            llm=get_llm(),
+            max_token_limit=1000,
+            return_messages=True
         )
-        # 元のframe_rateに戻すことで正常再生させる（ピッチを保持したまま速度だけ変更）
-        modified_audio = modified_audio.set_frame_rate(audio.frame_rate)
-        modified_audio.export(audio_output_file_path, format="wav")
-    # PyAudioで再生
-    with wave.open(audio_output_file_path, 'rb') as play_target_file:
-        p = pyaudio.PyAudio()
-        stream = p.open(
-            format=p.get_format_from_width(play_target_file.getsampwidth()),
-            channels=play_target_file.getnchannels(),
-            rate=play_target_file.getframerate(),
-            output=True
+    return st.session_state.memory
+
+def get_token_meter():
+    """
+    セッションごとのプロンプトトークン数計測の取得
+    """
+    if "token_meter" not in st.session_state:
+        st.session_state.token_meter = TokenMeter()
+    return st.session_state.token_meter
+
+def get_evaluation_memory():
+    """
+    評価専用メモリの取得（直近のやり取りのみ保持し、要約のためのLLM呼び出しは発生しない）
+    """
+    if "evaluation_memory" not in st.session_state:
+        from langchain.memory import ConversationBufferWindowMemory
+        
+        st.session_state.evaluation_memory = ConversationBufferWindowMemory(
+            k=ct.EVALUATION_MEMORY_TURNS,
+            return_messages=True
         )
-        data = play_target_file.readframes(1024)
-        while data:
-            stream.write(data)
-            data = play_target_file.readframes(1024)
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
-    
-    # LLMからの回答の音声ファイルを削除
-    os.remove(audio_output_file_path)
+    return st.session_state.evaluation_memory
 
-def create_chain(system_template):
+def create_chain(system_template, purpose="generic", level=None, theme=None):
     """
     LLMによる回答生成用のChain作成
+    用途ごとのメモリ方針に従い、会話メモリを使うのは会話用のChainのみとする
+    (用途, 英語レベル, 会話テーマ, テンプレート) が同じ場合は構築済みのものを再利用する
+    ターンごとに変わる内容はテンプレートに含めず、predict() の入力として渡すこと
+    Args:
+        system_template: システムプロンプト
+        purpose: 用途（conversation, problem, evaluation など）
+        level: 英語レベル
+        theme: 会話テーマ
     """
-    prompt = ChatPromptTemplate.from_messages([
+    from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+    from langchain.schema import SystemMessage
+    
+    key = make_chain_key(purpose, level, theme, system_template)
+    prompt = get_prompt_registry().get(key, lambda: ChatPromptTemplate.from_messages([
         SystemMessage(content=system_template),
         MessagesPlaceholder(variable_name="history"),
         HumanMessagePromptTemplate.from_template("{input}")
-    ])
-    chain = ConversationChain(
-        llm=st.session_state.llm,
-        memory=st.session_state.memory,
-        prompt=prompt
-    )
-    return chain
+    ]))
+    policy = get_memory_policy(purpose)
+    if policy == "conversation":
+        from langchain.chains import ConversationChain
+        
+        build = lambda: ConversationChain(
+            llm=get_llm(),
+            memory=get_conversation_memory(),
+            prompt=prompt
+        )
+    else:
+        build = lambda: PolicyChain(
+            get_llm(),
+            prompt,
+            purpose,
+            memory=get_evaluation_memory() if policy == "evaluation" else None,
+            token_meter=get_token_meter()
+        )
+    return get_session_chains().get(key, build)
 
-def create_problem_and_play_audio():
+def get_session_chains():
     """
-    問題生成と音声ファイルの再生
-    Args:
-        chain: 問題文生成用のChain
-        speed: 再生速度（1.0が通常速度、0.5で半分の速さ、2.0で倍速など）
-        openai_obj: OpenAIのオブジェクト
+    セッションごとのチェインのキャッシュの取得
     """
-    # 問題文を生成するChainを実行し、問題文を取得
-    problem = st.session_state.chain_create_problem.predict(input="")
-    # LLMからの回答を音声データに変換
-    llm_response_audio = st.session_state.openai_obj.audio.speech.create(
-        model="tts-1",
-        voice="alloy",
-        input=problem
-    )
-    # 音声ファイルの作成
-    audio_output_file_path = f"{ct.AUDIO_OUTPUT_DIR}/audio_output_{int(time.time())}.wav"
-    save_to_wav(llm_response_audio.content, audio_output_file_path)
-    # 音声ファイルの読み上げ
-    play_wav(audio_output_file_path, st.session_state.speed)
-    return problem, llm_response_audio
+    if "session_chains" not in st.session_state:
+        st.session_state.session_chains = SessionChains()
+    return st.session_state.session_chains
 
-def create_evaluation():
+def end_chain_turn(container=None):
     """
-    ユーザー入力値の評価生成
+    ターンの終了時に、チェイン再利用の統計を確定して表示を更新
+    Args:
+        container: render_chain_stats() で描画済みの表示先（Noneの場合は次の再実行で表示される）
     """
-    llm_response_evaluation = st.session_state.chain_evaluation.predict(input="")
-    return llm_response_evaluation
+    get_session_chains().end_turn()
+    if container is not None:
+        render_chain_stats(container)
 
-# 以下、新しく追加する機能
+def render_chain_stats(container):
+    """
+    チェイン再利用の統計の表示（直前のターンの値は、ターンの処理が終わった時点のもの）
+    Args:
+        container: 表示先（st.empty() など）
+    """
+    chain_stats = get_session_chains().stats.as_dict()
+    last_turn_chain_stats = get_session_chains().turn_stats()
+    container.caption(
+        f"チェイン再利用: {chain_stats['hits']}回（構築 {chain_stats['misses']}回）"
+        f" / 節約 {chain_stats['saved_ms']:.1f} ms（直前のターン {last_turn_chain_stats['saved_ms']:.1f} ms）"
+    )
 
 def get_level_specific_template(level, theme="一般会話"):
     """
@@ -181,49 +566,205 @@ def get_level_specific_problem_template(level, theme="一般会話"):
         level: 英語レベル（初級者、中級者、上級者）
         theme: 会話テーマ
     """
-    if level == "初級者":
-        return ct.SYSTEM_TEMPLATE_CREATE_PROBLEM_BEGINNER.format(theme=theme)
-    elif level == "中級者":
-        return ct.SYSTEM_TEMPLATE_CREATE_PROBLEM_INTERMEDIATE.format(theme=theme)
-    elif level == "上級者":
-        return ct.SYSTEM_TEMPLATE_CREATE_PROBLEM_ADVANCED.format(theme=theme)
+    if level in ct.PROBLEM_TEMPLATES_BY_LEVEL:
+        return ct.PROBLEM_TEMPLATES_BY_LEVEL[level].format(theme=theme)
     else:
         return ct.SYSTEM_TEMPLATE_CREATE_PROBLEM
 
-def create_level_appropriate_problem_and_play_audio(level, theme="一般会話"):
+def generate_problem_with_audio(level, theme, llm, openai_obj):
     """
-    レベルに応じた問題文生成と音声ファイルの再生
+    問題文の生成と音声合成（バックグラウンドスレッドから呼ぶため、セッション状態には触れない）
     Args:
         level: 英語レベル（初級者、中級者、上級者）
         theme: 会話テーマ
+        llm: ChatOpenAIのオブジェクト
+        openai_obj: OpenAIのオブジェクト
+    Returns:
+        (問題文, 通常速度の音声データ)
     """
-    # レベル別のテンプレートを取得
-    template = get_level_specific_problem_template(level, theme)
+    from langchain.schema import SystemMessage, HumanMessage
     
-    # 問題生成用のチェインを作成
-    st.session_state.chain_create_problem = create_chain(template)
+    template = get_level_specific_problem_template(level, theme)
+    with latency.span("llm_problem"):
+        problem = llm.invoke([SystemMessage(content=template), HumanMessage(content="")]).content
     
-    # 問題文を生成して音声再生
-    return create_problem_and_play_audio()
+    # 通常速度のPCMはそのまま再生できるため、TTSキャッシュにも登録する
+    cache_key = TtsCache.make_key(ct.TTS_MODEL, ct.TTS_DEFAULT_VOICE, problem, 1.0)
+    audio_buffer = get_tts_cache().get(cache_key) if ct.TTS_CACHE_ENABLED else None
+    if audio_buffer is None:
+        with latency.span("tts"):
+            llm_response_audio = openai_obj.audio.speech.create(
+                model=ct.TTS_MODEL,
+                voice=ct.TTS_DEFAULT_VOICE,
+                input=problem,
+                response_format="pcm"
+            )
+        audio_buffer = PcmBuffer(llm_response_audio.content)
+        if ct.TTS_CACHE_ENABLED:
+            get_tts_cache().put(cache_key, audio_buffer)
+    return problem, audio_buffer
 
-def create_enhanced_evaluation(level):
+def take_pooled_problem(level, theme, seen, llm, openai_obj):
     """
-    強化されたフィードバックの生成
+    セッション間で共有する問題プールから、セッションにまだ出していない問題を取り出す
+    （バックグラウンドスレッドから呼ぶため、セッション状態には触れない）
     Args:
         level: 英語レベル（初級者、中級者、上級者）
+        theme: 会話テーマ
+        seen: セッションの出題済みの問題IDの集合
+        llm: ChatOpenAIのオブジェクト（プールに問題がない場合の生成に使用）
+        openai_obj: OpenAIのオブジェクト
+    Returns:
+        (問題文, 通常速度の音声データ)
     """
-    # 強化されたフィードバックテンプレートを使用
-    system_template = ct.SYSTEM_TEMPLATE_ENHANCED_EVALUATION.format(
-        llm_text=st.session_state.problem,
-        user_text=st.session_state.last_user_input,
-        level=level
+    return get_problem_pool().take(
+        level, theme, seen,
+        lambda level, theme: generate_problem_with_audio(level, theme, llm, openai_obj)
     )
+
+def take_problem(level, theme, seen, llm, openai_obj):
+    """
+    問題の取り出し（事前に生成した問題バンク → セッション間の共有プール → その場での生成の順に試す）
+    （バックグラウンドスレッドから呼ぶため、セッション状態には触れない）
+    Args:
+        level: 英語レベル（初級者、中級者、上級者）
+        theme: 会話テーマ
+        seen: セッションの出題済みの問題の集合
+        llm: ChatOpenAIのオブジェクト
+        openai_obj: OpenAIのオブジェクト
+    Returns:
+        (問題文, 通常速度の音声データ)
+    """
+    from problem_bank import get_problem_bank
+    
+    bank = get_problem_bank()
+    if bank is not None:
+        item = bank.sample(level, theme, seen)
+        if item is not None:
+            return item
+    if ct.PROBLEM_POOL_ENABLED:
+        return take_pooled_problem(level, theme, seen, llm, openai_obj)
+    return generate_problem_with_audio(level, theme, llm, openai_obj)
+
+def get_problem_prefetcher():
+    """
+    セッションごとの問題先読みキューを取得
+    """
+    if "problem_prefetcher" not in st.session_state:
+        llm = get_llm()
+        openai_obj = get_openai_obj()
+        # 出題済みの問題は先読みのスレッドからのみ更新する
+        seen = st.session_state.problem_pool_seen = set()
+        st.session_state.problem_prefetcher = ProblemPrefetcher(
+            lambda level, theme: take_problem(level, theme, seen, llm, openai_obj)
+        )
+    return st.session_state.problem_prefetcher
+
+def prefetch_problems(level, theme):
+    """
+    問題の先読みを開始（レベルやテーマが変わった場合は用意済みの問題を破棄）
+    Args:
+        level: 英語レベル（初級者、中級者、上級者）
+        theme: 会話テーマ
+    """
+    prefetcher = get_problem_prefetcher()
+    prefetcher.set_key(level, theme)
+    prefetcher.fill()
+
+def play_next_problem(level, theme):
+    """
+    先読み済みの問題を取り出して読み上げ（用意できていなければその場で生成）
+    Args:
+        level: 英語レベル（初級者、中級者、上級者）
+        theme: 会話テーマ
+    Returns:
+        (問題文, 読み上げた音声データ)
+    """
+    prefetcher = get_problem_prefetcher()
+    prefetcher.set_key(level, theme)
+    with latency.span("problem_wait"):
+        item = prefetcher.pop()
+    if item is None:
+        item = generate_problem_with_audio(level, theme, get_llm(), get_openai_obj())
+    problem, audio_buffer = item
+    # 発音分析のお手本として、再生速度を変える前の音声を保持
+    st.session_state.problem_audio = audio_buffer
+    if get_playback_mode() == "browser":
+        # 直後に再実行されても再生されるよう、次の描画で送る音声として保持
+        with latency.span("playback_prepare"):
+            st.session_state.pending_browser_audio = encode_browser_audio(
+                collect_pcm(audio_buffer, st.session_state.speed)
+            )
+        return problem, st.session_state.pending_browser_audio
+    with latency.span("playback"):
+        return problem, play_pcm(audio_buffer, st.session_state.speed)
+
+def create_cultural_context_chain():
+    """
+    文化的コンテキスト用のChain作成（会話メモリを使わないため、作成後は別スレッドからも呼び出せる）
+    対象の文は predict() の入力として渡すため、Chainは文によらず1つを再利用する
+    """
+    return create_chain(ct.SYSTEM_TEMPLATE_CULTURAL_CONTEXT, "cultural_context")
+
+def predict_cultural_context(chain, sentence):
+    """
+    文化的コンテキストの生成
+    Args:
+        chain: create_cultural_context_chain() のChain
+        sentence: 文脈を解説する対象の文
+    """
+    return chain.predict(input=ct.CULTURAL_CONTEXT_INPUT.format(sentence=sentence))
+
+def create_evaluation_with_score(problem, user_text, level, local_score):
+    """
+    ローカル採点の差分を渡したうえでのLLM評価（単語の正確性の分析を省く分、プロンプトが短くなる）
+    Args:
+        problem: 問題文
+        user_text: ユーザーの回答
+        level: 英語レベル
+        local_score: scoring.score_answer() の結果
+    """
+    # システムプロンプトはレベルごとに固定し、ターンごとの内容は入力として渡す（Chainを再利用するため）
+    system_template = ct.SYSTEM_TEMPLATE_EVALUATION_WITH_DIFF.format(level=level)
+    return create_chain(system_template, "evaluation", level).predict(input=ct.EVALUATION_WITH_DIFF_INPUT.format(
+        llm_text=problem,
+        user_text=user_text,
+        local_diff=format_diff_for_prompt(local_score)
+    ))
+
+def get_cultural_context_cache():
+    """
+    文化的コンテキストのキャッシュの取得（numpyを使うため、文化的コンテキストを表示する時点で初めて読み込む）
+    """
+    from cultural_cache import get_cultural_context_cache
+    
+    return get_cultural_context_cache()
+
+def create_cultural_context_task(sentence):
+    """
+    文化的コンテキストを返す関数の作成（同じ文・よく似た文の解説がキャッシュにあればLLMを呼ばない）
+    Chainはここで作成するため、返した関数は別スレッドからも呼び出せる
+    Args:
+        sentence: 文脈を解説する対象の文
+    Returns:
+        引数なしで呼び出すと解説を返す関数
+    """
+    if not ct.CULTURAL_CACHE_ENABLED:
+        chain = create_cultural_context_chain()
+        return lambda: predict_cultural_context(chain, sentence)
+    cache = get_cultural_context_cache()
+    with latency.span("cultural_cache_lookup"):
+        cached = cache.get(sentence)
+    if cached is not None:
+        return lambda: cached
+    chain = create_cultural_context_chain()
     
-    # 評価チェインを作成
-    st.session_state.chain_evaluation = create_chain(system_template)
+    def generate():
+        explanation = predict_cultural_context(chain, sentence)
+        cache.put(sentence, explanation)
+        return explanation
     
-    # 評価の生成
-    return st.session_state.chain_evaluation.predict(input="")
+    return generate
 
 def provide_cultural_context(sentence):
     """
@@ -231,41 +772,129 @@ def provide_cultural_context(sentence):
     Args:
         sentence: 文脈を解説する対象の文
     """
-    # 文化的コンテキスト用のテンプレート
-    system_template = ct.SYSTEM_TEMPLATE_CULTURAL_CONTEXT.format(sentence=sentence)
+    # 文化的コンテキストの生成（キャッシュにあればそれを使う）
+    return create_cultural_context_task(sentence)()
+
+def classify_turn_errors(user_text, level, local_score=None, llm=None):
+    """
+    1ターン分の誤りの分類（バックグラウンドスレッドから呼ぶため、セッション状態には触れない）
+    Args:
+        user_text: ユーザーの発話・回答
+        level: 英語レベル
+        local_score: ローカル採点の結果（シャドーイング・ディクテーションの場合）
+        llm: ChatOpenAIのオブジェクト（指定した場合はお手本のない発話をLLMでも1回だけ分類する）
+    Returns:
+        誤りの種類ごとの件数（Counter）
+    """
+    if local_score is not None:
+        return error_profile.classify_score(local_score)
+    counts = error_profile.classify_text(user_text)
+    if llm is not None:
+        from langchain.schema import SystemMessage, HumanMessage
+        
+        prompt = ct.SYSTEM_TEMPLATE_ERROR_CLASSIFY.format(level=level, user_text=user_text)
+        with latency.span("llm_error_classify"):
+            reply = llm.invoke([SystemMessage(content=prompt), HumanMessage(content="")]).content
+        counts = error_profile.merge_counts(counts, error_profile.parse_llm_categories(reply))
+    return counts
+
+def record_turn_errors(user_text, local_score=None):
+    """
+    ターンの誤りを分類してエラープロファイルに加算（分類と保存はバックグラウンドで行い、画面の処理を待たせない）
+    Args:
+        user_text: ユーザーの発話・回答
+        local_score: ローカル採点の結果（シャドーイング・ディクテーションの場合）
+    Returns:
+        分類・保存の Future
+    """
+    level = st.session_state.englv
+    theme = st.session_state.get("theme", "一般会話")
+    llm = None
+    if local_score is None and ct.ERROR_PROFILE_LLM_CLASSIFY and st.session_state.get("show_error_analysis"):
+        llm = get_llm()
     
-    # 一時的なチェインを作成
-    cultural_chain = create_chain(system_template)
+    def classify_and_store():
+        counts = classify_turn_errors(user_text, level, local_score, llm)
+        get_history_store().add_error_counts(level, theme, counts)
+        return counts
     
-    # 文化的コンテキストの生成
-    return cultural_chain.predict(input="")
+    return get_turn_executor().submit(latency.run_in_context(classify_and_store))
 
-def analyze_user_errors(conversation_history):
+def get_error_profile():
+    """
+    集計済みのエラープロファイルと、前回の助言以降の増分の取得（LLMは呼ばない）
+    Returns:
+        (プロファイル, 増分, 前回の助言の記録)
+    """
+    store = get_history_store()
+    profile = error_profile.build_profile(*store.error_counts())
+    last_report = store.latest_error_report()
+    return profile, error_profile.profile_delta(profile, last_report), last_report
+
+def analyze_user_errors(llm=None):
     """
     ユーザーのエラーパターン分析
+    会話の本文は読み直さず、集計済みの件数のうち前回の助言以降の増分だけをLLMに渡す
+    （増分がなければ前回の助言をそのまま返す）
     Args:
-        conversation_history: 会話履歴（最新の5-10回分の会話）
-    """
+        llm: ChatOpenAIのオブジェクト（バックグラウンドスレッドから呼ぶ場合は指定すること）
+    Returns:
+        助言のテキスト
+    """
+    if llm is None:
+        llm = get_llm()
+    profile, delta, last_report = get_error_profile()
+    if last_report is not None and delta["turns"] == 0:
+        return last_report["advice"]
+    if not profile["turns"]:
+        return "まだ分析できるターンがありません。"
+    
     # エラーパターン分析用のテンプレート
     system_template = ct.SYSTEM_TEMPLATE_ERROR_ANALYSIS.format(
-        conversation_history=conversation_history
+        previous_advice=last_report["advice"] if last_report is not None else "",
+        error_delta=error_profile.format_delta_for_prompt(profile, delta),
+        error_totals=", ".join(f"{category}: {count}" for category, count in profile["totals"].most_common()) or "none"
     )
     
-    # 一時的なチェインを作成
-    analysis_chain = create_chain(system_template)
-    
     # エラー分析の生成
-    return analysis_chain.predict(input="")
+    from langchain.schema import SystemMessage, HumanMessage
+    
+    with latency.span("llm_error_analysis"):
+        advice = llm.invoke([SystemMessage(content=system_template), HumanMessage(content="")]).content
+    get_history_store().save_error_report(time.strftime("%Y-%m-%d %H:%M:%S"), profile["turns"], profile["totals"], advice)
+    return advice
+
+def submit_error_advice():
+    """
+    助言の更新をバックグラウンドで開始（結果は pop_error_advice() で次の描画時に受け取る）
+    """
+    if st.session_state.get("error_advice_future") is None:
+        llm = get_llm()
+        st.session_state.error_advice_future = get_turn_executor().submit(
+            latency.run_in_context(lambda: analyze_user_errors(llm))
+        )
+
+def pop_error_advice():
+    """
+    バックグラウンドで更新した助言の取得（まだ終わっていなければNone）
+    """
+    future = st.session_state.get("error_advice_future")
+    if future is None or not future.done():
+        return None
+    st.session_state.error_advice_future = None
+    try:
+        return future.result()
+    except Exception:
+        return None
 
 def save_conversation_history(user_input, ai_response, evaluation=None):
     """
-    会話履歴を保存する
+    会話履歴を保存する（1件追記するだけで、既存の履歴は読み書きしない）
     Args:
         user_input: ユーザーの入力
         ai_response: AIの応答
         evaluation: 評価情報（オプション）
     """
-    history_path = 'conversation_history.json'
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     
     # 新しいエントリ
@@ -281,22 +910,8 @@ def save_conversation_history(user_input, ai_response, evaluation=None):
     if evaluation:
         new_entry["evaluation"] = evaluation
     
-    # 既存の履歴がある場合は読み込み、なければ新規作成
-    if os.path.exists(history_path):
-        with open(history_path, 'r', encoding='utf-8') as f:
-            try:
-                history = json.load(f)
-            except:
-                history = {"conversations": []}
-    else:
-        history = {"conversations": []}
-    
-    # 履歴に追加
-    history["conversations"].append(new_entry)
-    
-    # 履歴の保存
-    with open(history_path, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
+    with latency.span("save_history"):
+        return get_history_store().append(new_entry)
 
 def get_recent_conversation_history(num_entries=5):
     """
@@ -304,25 +919,13 @@ def get_recent_conversation_history(num_entries=5):
     Args:
         num_entries: 取得するエントリ数
     """
-    history_path = 'conversation_history.json'
-    
-    if not os.path.exists(history_path):
-        return []
-    
-    with open(history_path, 'r', encoding='utf-8') as f:
-        try:
-            history = json.load(f)
-            # 最新の n 件を取得
-            return history["conversations"][-num_entries:]
-        except:
-            return []
+    return get_history_store().tail(num_entries)
 
-def adjust_voice_based_on_content(text, openai_obj):
+def select_voice(text):
     """
-    文脈に応じた音声特性の調整
+    文脈に応じた音声の選択
     Args:
         text: 応答テキスト
-        openai_obj: OpenAIクライアントオブジェクト
     """
     # 感情や文脈を分析
     is_question = "?" in text
@@ -340,46 +943,31 @@ def adjust_voice_based_on_content(text, openai_obj):
     elif is_formal:
         voice = "echo"  # よりフォーマルな印象の声
     
-    # 音声生成
-    return openai_obj.audio.speech.create(
-        model="tts-1",
-        voice=voice,
-        input=text
-    )
+    return voice
 
-def analyze_pronunciation(audio_file_path, text):
+def analyze_pronunciation(audio_input, text, reference_audio=None):
     """
-    発音分析機能
+    発音分析機能（お手本のTTS音声と録音を比較し、API呼び出しは行わない）
     Args:
-        audio_file_path: 音声ファイルのパス
+        audio_input: 音声入力のPcmBuffer
         text: 正解のテキスト
-    """
-    # OpenAIのWhisperモデルを使用して音声を文字起こし
-    with open(audio_file_path, 'rb') as audio_file:
-        transcript = st.session_state.openai_obj.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            language="en"
-        )
-    
-    # 発音分析用のプロンプト
-    pronunciation_prompt = f"""
-    以下の「正解テキスト」と「発話テキスト」を比較し、発音の分析をしてください：
+        reference_audio: お手本の音声（省略時は直前に読み上げた問題の音声）
+    Returns:
+        分析結果の辞書（比較できない場合はNone）
+    """
+    if reference_audio is None:
+        reference_audio = st.session_state.get("problem_audio")
+    if reference_audio is None:
+        return None
+    import pronunciation
     
-    正解テキスト: {text}
-    発話テキスト: {transcript.text}
-    
-    以下の点に注目して日本語で分析してください：
-    1. 単語の発音の正確さ
-    2. イントネーションやリズムの自然さ
-    3. 特に改善すべき音素や単語
-    4. 良くできている点
-    
-    具体的なアドバイスと練習方法も提案してください。
+    with latency.span("pronunciation"):
+        return pronunciation.analyze(reference_audio, audio_input, text)
+
+def format_pronunciation_markdown(result):
     """
+    発音評価の表示用Markdown（pronunciation は scipy を使うため、シャドーイングで初めて読み込む）
+    """
+    from pronunciation import format_pronunciation_markdown
     
-    # 一時的なチェインを作成して分析
-    analysis_chain = create_chain(pronunciation_prompt)
-    
-    # 発音分析を生成
-    return analysis_chain.predict(input="")
\ No newline at end of file
+    return format_pronunciation_markdown(result)
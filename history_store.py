@@ -0,0 +1,261 @@
+"""
+会話履歴の保存先（SQLite / WALモード）
+追記は1行のINSERTのみで、最新n件の取得も主キーの索引を逆順にたどるだけで済む
+誤りの傾向（エラープロファイル）は、種類・英語レベル・会話テーマごとの件数として同じデータベースに加算していく
+セッションのメモリに置ききれなくなった古いターン（チャット欄の表示内容）も、セッションごとに1ターン1行で退避する
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import constants as ct
+
+HISTORY_COLUMNS = ["timestamp", "user_input", "ai_response", "english_level", "mode", "theme", "evaluation"]
+_INSERT_SQL = f"INSERT INTO conversations ({', '.join(HISTORY_COLUMNS)}) VALUES ({', '.join('?' * len(HISTORY_COLUMNS))})"
+
+
+class HistoryStore:
+    """
+    会話履歴のストア
+    接続はスレッドごとに作成し、複数セッション・複数プロセスからの同時書き込みはSQLiteのロックで直列化する
+    """
+    def __init__(self, db_path=ct.HISTORY_DB_PATH, legacy_json_path=ct.LEGACY_HISTORY_JSON_PATH):
+        self._db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    user_input TEXT,
+                    ai_response TEXT,
+                    english_level TEXT,
+                    mode TEXT,
+                    theme TEXT,
+                    evaluation TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS error_counts (
+                    english_level TEXT NOT NULL,
+                    theme TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (english_level, theme, category)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS error_turns (
+                    english_level TEXT NOT NULL,
+                    theme TEXT NOT NULL,
+                    turns INTEGER NOT NULL,
+                    PRIMARY KEY (english_level, theme)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS error_reports (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    turns INTEGER NOT NULL,
+                    totals TEXT NOT NULL,
+                    advice TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS transcript_turns (
+                    session_id TEXT NOT NULL,
+                    turn INTEGER NOT NULL,
+                    messages TEXT NOT NULL,
+                    saved_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, turn)
+                )
+            """)
+            # 終了したセッションの退避分は保持期間を過ぎたら削除する
+            conn.execute(
+                "DELETE FROM transcript_turns WHERE saved_at < ?",
+                (time.time() - ct.TRANSCRIPT_SPILL_RETENTION_SEC,)
+            )
+        if legacy_json_path and os.path.exists(legacy_json_path):
+            self.migrate_from_json(legacy_json_path)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=ct.HISTORY_DB_BUSY_TIMEOUT_SEC)
+            conn.row_factory = sqlite3.Row
+            # WALモードでは読み込みが書き込みを待たず、追記はログの末尾に書くだけで済む
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, entry):
+        """
+        会話履歴を1件追加
+        Args:
+            entry: HISTORY_COLUMNSをキーに持つ辞書
+        Returns:
+            追加したエントリのID
+        """
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                _INSERT_SQL,
+                [entry.get(column) for column in HISTORY_COLUMNS]
+            )
+        return cursor.lastrowid
+
+    def tail(self, num_entries=5):
+        """
+        最新のn件を古い順に取得（全件は読まない）
+        Args:
+            num_entries: 取得するエントリ数
+        """
+        rows = self._connect().execute(
+            f"SELECT id, {', '.join(HISTORY_COLUMNS)} FROM conversations ORDER BY id DESC LIMIT ?",
+            (num_entries,)
+        ).fetchall()
+        return [self._to_entry(row) for row in reversed(rows)]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def add_error_counts(self, english_level, theme, counts):
+        """
+        1ターン分の誤りの件数を加算（誤りがなかったターンも分析済みのターン数には数える）
+        Args:
+            english_level: 英語レベル
+            theme: 会話テーマ
+            counts: 誤りの種類ごとの件数
+        """
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO error_counts (english_level, theme, category, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT (english_level, theme, category) DO UPDATE SET count = count + excluded.count
+                """,
+                [(english_level, theme, category, count) for category, count in counts.items() if count]
+            )
+            conn.execute(
+                """
+                INSERT INTO error_turns (english_level, theme, turns) VALUES (?, ?, 1)
+                ON CONFLICT (english_level, theme) DO UPDATE SET turns = turns + 1
+                """,
+                (english_level, theme)
+            )
+
+    def error_counts(self):
+        """
+        集計済みの誤りの件数と分析済みのターン数
+        Returns:
+            ((英語レベル, 会話テーマ, 種類, 件数) の一覧, (英語レベル, 会話テーマ, ターン数) の一覧)
+        """
+        conn = self._connect()
+        rows = conn.execute("SELECT english_level, theme, category, count FROM error_counts").fetchall()
+        turn_rows = conn.execute("SELECT english_level, theme, turns FROM error_turns").fetchall()
+        return [tuple(row) for row in rows], [tuple(row) for row in turn_rows]
+
+    def save_error_report(self, timestamp, turns, totals, advice):
+        """
+        助言を生成した時点の集計と助言の保存（次回はここからの増分だけをLLMに渡す）
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO error_reports (timestamp, turns, totals, advice) VALUES (?, ?, ?, ?)",
+                (timestamp, turns, json.dumps(dict(totals)), advice)
+            )
+
+    def latest_error_report(self):
+        row = self._connect().execute(
+            "SELECT timestamp, turns, totals, advice FROM error_reports ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        return {"timestamp": row["timestamp"], "turns": row["turns"], "totals": json.loads(row["totals"]), "advice": row["advice"]}
+
+    def save_transcript_turn(self, session_id, turn, messages):
+        """
+        チャット欄の1ターン分のメッセージの退避
+        Args:
+            session_id: セッションの識別子
+            turn: ターンの番号（0始まり）
+            messages: (role, content, cultural_context) の一覧
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO transcript_turns (session_id, turn, messages, saved_at) VALUES (?, ?, ?, ?)",
+                (session_id, turn, json.dumps(messages, ensure_ascii=False), time.time())
+            )
+
+    def transcript_turns(self, session_id, first_turn, last_turn):
+        """
+        退避したターンの読み込み（主キーの範囲検索のみ）
+        Args:
+            session_id: セッションの識別子
+            first_turn: 最初のターンの番号
+            last_turn: 最後のターンの次の番号
+        Returns:
+            ターンごとの (role, content, cultural_context) の一覧
+        """
+        rows = self._connect().execute(
+            "SELECT messages FROM transcript_turns WHERE session_id = ? AND turn >= ? AND turn < ? ORDER BY turn",
+            (session_id, first_turn, last_turn)
+        ).fetchall()
+        return [json.loads(row["messages"]) for row in rows]
+
+    @staticmethod
+    def _to_entry(row):
+        # 従来のJSON形式と同じく、評価がない場合はキー自体を含めない
+        entry = {column: row[column] for column in HISTORY_COLUMNS if column != "evaluation"}
+        entry["id"] = row["id"]
+        if row["evaluation"]:
+            entry["evaluation"] = row["evaluation"]
+        return entry
+
+    def migrate_from_json(self, legacy_json_path):
+        """
+        従来の conversation_history.json を取り込み、取り込み済みのファイルは名前を変えて残す
+        Args:
+            legacy_json_path: 旧形式の履歴ファイルのパス
+        Returns:
+            取り込んだ件数
+        """
+        # 先にファイル名を変えた1プロセスだけが取り込む（複数プロセスでの二重取り込みを防ぐ）
+        claimed_path = f"{legacy_json_path}.{os.getpid()}.migrating"
+        try:
+            os.replace(legacy_json_path, claimed_path)
+        except FileNotFoundError:
+            return 0
+        try:
+            with open(claimed_path, "r", encoding="utf-8") as f:
+                conversations = json.load(f).get("conversations", [])
+        except (OSError, ValueError):
+            conversations = []
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                _INSERT_SQL,
+                [[entry.get(column) for column in HISTORY_COLUMNS] for entry in conversations]
+            )
+        os.replace(claimed_path, f"{legacy_json_path}.migrated")
+        return len(conversations)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """
+    プロセス全体で共有する会話履歴ストアの取得
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+        return _store
@@ -0,0 +1,250 @@
+"""
+処理段階（ステージ）ごとの所要時間の計測
+- span() / record() で計測した値を、プロセス全体とセッションごとのヒストグラムに記録する
+- セッションは bind_session() でスクリプトのスレッドに結び付け、別スレッドには run_in_context() で引き継ぐ
+- 設定した場合のみ、1件ごとのJSONLまたはPrometheusのテキスト形式でファイルに書き出す
+  （書き出しはバックグラウンドのスレッドで一定間隔ごとにまとめて行い、計測したスレッドではファイルを開かない）
+"""
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+import constants as ct
+
+# ヒストグラムの区切り（ミリ秒）
+BUCKET_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_current_session = contextvars.ContextVar("latency_session", default=None)
+
+
+class LatencyHistogram:
+    """
+    1ステージ分の所要時間の分布
+    区切りごとの件数（書き出し用）と、直近の値（パーセンタイル表示用）を保持する
+    """
+    def __init__(self, recent_max=ct.LATENCY_RECENT_SAMPLES):
+        self.bucket_counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent = deque(maxlen=recent_max)
+
+    def observe(self, elapsed_ms):
+        self.bucket_counts[bisect.bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.recent.append(elapsed_ms)
+
+    def percentiles(self, qs=(50, 95, 99)):
+        if not self.recent:
+            return [0.0] * len(qs)
+        import numpy as np
+
+        return list(np.percentile(np.fromiter(self.recent, dtype=float), qs))
+
+
+class LatencyRegistry:
+    """
+    ステージ名ごとのヒストグラムの集まり（プロセス全体用とセッションごとに1つずつ作る）
+    """
+    def __init__(self, name="process"):
+        self.name = name
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, elapsed_ms):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram()
+            histogram.observe(elapsed_ms)
+
+    def summary(self):
+        """
+        ステージごとの件数・平均・p50・p95・p99・最大（ミリ秒）
+        """
+        with self._lock:
+            rows = []
+            for stage, histogram in self._histograms.items():
+                p50, p95, p99 = histogram.percentiles()
+                rows.append({
+                    "stage": stage,
+                    "count": histogram.count,
+                    "mean_ms": histogram.total_ms / histogram.count,
+                    "p50_ms": p50,
+                    "p95_ms": p95,
+                    "p99_ms": p99,
+                    "max_ms": histogram.max_ms,
+                })
+            return rows
+
+    def to_prometheus(self):
+        """
+        Prometheusのテキスト形式（秒単位のヒストグラム）
+        """
+        lines = [
+            "# HELP app_stage_latency_seconds Time spent in each stage of a turn.",
+            "# TYPE app_stage_latency_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKET_BOUNDS_MS, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'app_stage_latency_seconds_bucket{{stage="{stage}",le="{bound / 1000:g}"}} {cumulative}')
+                lines.append(f'app_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'app_stage_latency_seconds_sum{{stage="{stage}"}} {histogram.total_ms / 1000:.6f}')
+                lines.append(f'app_stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    計測値のファイルへの書き出し（一定間隔ごとにバックグラウンドのスレッドで行う）
+    - jsonl: 溜まった計測値を1件1行で追記し、上限の大きさを超えたらファイルを切り替える
+    - prometheus: プロセス全体のヒストグラムを書き直す
+    """
+    def __init__(self, fmt=ct.LATENCY_EXPORT_FORMAT, path=ct.LATENCY_EXPORT_PATH,
+                 interval=ct.LATENCY_EXPORT_FLUSH_SEC, max_bytes=ct.LATENCY_EXPORT_MAX_BYTES,
+                 backups=ct.LATENCY_EXPORT_BACKUPS, buffer_max=ct.LATENCY_EXPORT_BUFFER_MAX):
+        self.fmt = fmt
+        self.path = path
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._pending = deque(maxlen=buffer_max)
+        self._registry = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def export(self, registry, stage, elapsed_ms, session_id):
+        """
+        計測値を書き出し待ちに追加（ファイルへの書き込みはしない）
+        """
+        with self._lock:
+            self._registry = registry
+            if self.fmt == "jsonl":
+                self._pending.append((time.time(), stage, round(elapsed_ms, 3), session_id))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="latency-export", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except OSError:
+                # 書き出しの失敗で計測を止めない（次の間隔で再度試す）
+                pass
+
+    def flush(self):
+        """
+        溜まった計測値の書き出し
+        """
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+            registry = self._registry
+        if self.fmt == "jsonl" and pending:
+            self._ensure_dir()
+            self._rotate_if_needed()
+            with open(self.path, "a", encoding="utf-8") as metrics_file:
+                metrics_file.writelines(
+                    json.dumps({"ts": ts, "stage": stage, "ms": ms, "session": session_id}) + "\n"
+                    for ts, stage, ms, session_id in pending
+                )
+        elif self.fmt == "prometheus" and registry is not None:
+            self._ensure_dir()
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as metrics_file:
+                metrics_file.write(registry.to_prometheus())
+            os.replace(temp_path, self.path)
+
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _ensure_dir(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+
+class SessionLatency(LatencyRegistry):
+    """
+    セッションごとの計測値（書き出し時にセッションを区別するためのIDを持つ）
+    """
+    def __init__(self):
+        super().__init__("session")
+        self.session_id = uuid.uuid4().hex[:12]
+
+
+_process_registry = LatencyRegistry()
+_exporter = MetricsExporter()
+
+
+def get_process_registry():
+    return _process_registry
+
+
+def bind_session(session_latency):
+    """
+    現在のスレッド（とそこから run_in_context() で引き継いだ処理）の計測値をセッションにも記録する
+    """
+    _current_session.set(session_latency)
+
+
+def record(stage, elapsed_ms):
+    """
+    計測値の記録
+    Args:
+        stage: ステージ名
+        elapsed_ms: 所要時間（ミリ秒）
+    """
+    if not ct.LATENCY_ENABLED:
+        return
+    _process_registry.observe(stage, elapsed_ms)
+    session_latency = _current_session.get()
+    if session_latency is not None:
+        session_latency.observe(stage, elapsed_ms)
+    if _exporter.fmt:
+        _exporter.export(_process_registry, stage, elapsed_ms,
+                         session_latency.session_id if session_latency is not None else None)
+
+
+@contextmanager
+def span(stage):
+    """
+    with ブロックの所要時間をステージの計測値として記録
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, (time.perf_counter() - start) * 1000)
+
+
+def run_in_context(func):
+    """
+    呼び出し元のセッションの紐付けを引き継いで実行する関数に変換（スレッドプール・別スレッドに渡す処理用）
+    同じコンテキストは同時に1つのスレッドでしか実行できないため、submitごとに変換すること
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
@@ -1,20 +1,8 @@
 import streamlit as st
 import os
-import time
-from time import sleep
-from pathlib import Path
-from streamlit.components.v1 import html
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain.chains import ConversationChain
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    MessagesPlaceholder,
-)
-from langchain.schema import SystemMessage
-from openai import OpenAI
-from langchain_openai import ChatOpenAI
 import functions as ft
+from turn_executor import TurnStages
+import latency
 import constants as ct
 
 # 各種設定
@@ -28,21 +16,18 @@ st.markdown(f"## {ct.APP_NAME}")
 
 # 初期処理
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    # 直近のターンだけをメモリに置き、古いターンは会話履歴ストアへ退避する
+    st.session_state.messages = ft.create_transcript()
     st.session_state.start_flg = False
     st.session_state.pre_mode = ""
     st.session_state.shadowing_flg = False
     st.session_state.shadowing_button_flg = False
     st.session_state.shadowing_count = 0
-    st.session_state.shadowing_first_flg = True
     st.session_state.shadowing_audio_input_flg = False
-    st.session_state.shadowing_evaluation_first_flg = True
     st.session_state.dictation_flg = False
     st.session_state.dictation_button_flg = False
     st.session_state.dictation_count = 0
-    st.session_state.dictation_first_flg = True
     st.session_state.dictation_chat_message = ""
-    st.session_state.dictation_evaluation_first_flg = True
     st.session_state.chat_open_flg = False
     st.session_state.problem = ""
     st.session_state.theme = "一般会話"
@@ -57,16 +42,11 @@ if "messages" not in st.session_state:
     if not os.path.exists(ct.AUDIO_OUTPUT_DIR):
         os.makedirs(ct.AUDIO_OUTPUT_DIR)
     
-    # OpenAI API初期化
-    st.session_state.openai_obj = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-    st.session_state.llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5)
-    st.session_state.memory = ConversationSummaryBufferMemory(
-        llm=st.session_state.llm,
-        max_token_limit=1000,
-        return_messages=True
-    )
-    # モード「日常英会話」用のChain作成
-    st.session_state.chain_basic_conversation = ft.create_chain(ct.SYSTEM_TEMPLATE_BASIC_CONVERSATION)
+    # OpenAI APIのクライアント・会話メモリ・Chainは、最初の描画を遅らせないよう使う時点で作成する
+    # （ft.get_openai_obj() / ft.get_llm() / ft.get_conversation_memory()）
+
+# 処理時間の計測値をこのセッションに紐付け（再実行ごとにスクリプトのスレッドが変わりうるため毎回行う）
+session_latency = ft.get_session_latency()
 
 # サイドバーの設定
 with st.sidebar:
@@ -85,6 +65,74 @@ with st.sidebar:
     # エラー分析の表示設定
     st.session_state.show_error_analysis = st.checkbox("定期的なエラー分析を表示", value=False)
     
+    # 音声のストリーミング再生設定
+    st.session_state.playback_mode = st.radio(
+        "音声の再生先",
+        options=list(ct.PLAYBACK_MODE_LABELS),
+        format_func=ct.PLAYBACK_MODE_LABELS.get,
+        index=list(ct.PLAYBACK_MODE_LABELS).index(ct.PLAYBACK_MODE_DEFAULT)
+    )
+    st.session_state.streaming_playback = st.checkbox("ストリーミング再生（低遅延）", value=ct.STREAMING_PLAYBACK_DEFAULT)
+    st.session_state.streaming_reply = st.checkbox("回答を逐次表示し、文ごとに読み上げる", value=ct.STREAMING_REPLY_DEFAULT)
+    
+    # ディクテーション・シャドーイングの評価設定（ローカル採点は常に表示）
+    st.session_state.llm_evaluation = st.checkbox("AIによる詳細評価を表示", value=ct.LLM_EVALUATION_DEFAULT)
+    # ターンの処理が終わった時点で更新するため、表示先を確保しておく
+    chain_stats_placeholder = st.empty()
+    ft.render_chain_stats(chain_stats_placeholder)
+    if "token_meter" in st.session_state:
+        token_summary = st.session_state.token_meter.summary()
+        if token_summary:
+            with st.expander("プロンプトのトークン数（会話メモリ共有時との比較）"):
+                for row in token_summary:
+                    st.caption(
+                        f"{row['purpose']}: {row['prompt_tokens_per_call']:.0f} tokens/回"
+                        f"（共有時 {row['baseline_tokens_per_call']:.0f}、{row['reduction']:.0%} 削減、{row['calls']}回）"
+                    )
+    if ct.TTS_CACHE_ENABLED:
+        tts_cache_stats = ft.get_tts_cache().stats()
+        st.caption(
+            f"音声キャッシュ: ヒット {tts_cache_stats['hits_memory'] + tts_cache_stats['hits_disk']}"
+            f" / ミス {tts_cache_stats['misses']}"
+        )
+    if ct.CULTURAL_CACHE_ENABLED and st.session_state.show_cultural_context:
+        cultural_cache_stats = ft.get_cultural_context_cache().stats()
+        st.caption(
+            f"文化的コンテキストのキャッシュ: 完全一致 {cultural_cache_stats['hits_exact']}"
+            f" / 類似 {cultural_cache_stats['hits_similar']} / ミス {cultural_cache_stats['misses']}"
+            f"（ヒット率 {cultural_cache_stats['hit_rate']:.0%}）"
+        )
+    # このセッションがメモリに持っている会話の量（古いターンは会話履歴ストアへ退避済み）
+    transcript_usage = st.session_state.messages.memory_usage()
+    st.caption(
+        f"セッションの会話データ: 約 {transcript_usage['bytes'] / 1024:.1f} KB"
+        f"（メモリ上 {transcript_usage['turns_in_memory']} ターン / 退避済み {transcript_usage['turns_spilled']} ターン）"
+    )
+    
+    # 処理時間の表示設定
+    if st.checkbox("処理時間を表示", value=False):
+        with st.expander("ステージごとの処理時間（ms）", expanded=True):
+            latency_scope = st.radio("集計範囲", ["このセッション", "プロセス全体"], horizontal=True)
+            latency_rows = (session_latency if latency_scope == "このセッション" else latency.get_process_registry()).summary()
+            if latency_rows:
+                st.dataframe(
+                    sorted(latency_rows, key=lambda row: row["p95_ms"], reverse=True),
+                    hide_index=True,
+                    column_config={key: st.column_config.NumberColumn(format="%.1f") for key in ["mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"]}
+                )
+            else:
+                st.caption("まだ計測値がありません。")
+    if "transcription_upload_stats" in st.session_state:
+        upload_stats = st.session_state.transcription_upload_stats
+        st.caption(
+            f"直前の音声アップロード: {upload_stats['encoded_bytes'] / 1024:.0f} KB（{upload_stats['encoding']}）"
+            f" / 録音 {upload_stats['original_bytes'] / 1024:.0f} KB"
+            + (f"、{upload_stats['original_ms'] / 1000:.1f} 秒 → {upload_stats['processed_ms'] / 1000:.1f} 秒"
+               if "processed_ms" in upload_stats else "")
+        )
+        if upload_stats.get("unavailable_encodings"):
+            st.caption(f"使用できない圧縮形式: {', '.join(upload_stats['unavailable_encodings'])}（WAVで送信）")
+    
     # 会話履歴の表示
     if st.button("会話履歴を分析"):
         recent_history = ft.get_recent_conversation_history()
@@ -101,13 +149,17 @@ with st.sidebar:
                     history_text += f"- AI応答: {entry['ai_response']}\n\n"
                 st.markdown(history_text)
                 
-                # エラー分析を表示
+                # エラー分析を表示（集計済みの件数から表示するため、LLMの応答を待たない）
                 if st.session_state.show_error_analysis:
-                    with st.spinner("エラーパターンを分析中..."):
-                        history_for_analysis = "\n".join([f"User: {entry['user_input']}\nAI: {entry['ai_response']}" for entry in recent_history])
-                        error_analysis = ft.analyze_user_errors(history_for_analysis)
-                        st.markdown("### エラーパターン分析")
-                        st.info(error_analysis)
+                    error_profile_data, error_delta, last_error_report = ft.get_error_profile()
+                    st.markdown("### エラーパターン分析")
+                    st.markdown(ft.format_profile_markdown(error_profile_data, error_delta))
+                    if last_error_report is not None:
+                        st.info(last_error_report["advice"])
+                    if error_delta["turns"]:
+                        # 増分だけを渡して助言を更新し、終わり次第チャット欄に表示する
+                        ft.submit_error_advice()
+                        st.caption("前回以降のターンをもとに助言を更新しています。")
         else:
             st.info("会話履歴がまだありません。")
 
@@ -144,6 +196,10 @@ with col3:
 with col4:
     st.session_state.englv = st.selectbox(label="英語レベル", options=ct.ENGLISH_LEVEL_OPTION, label_visibility="collapsed")
 
+# シャドーイング・ディクテーション中は、次の問題を先読みしておく（レベル・テーマ変更時は破棄して作り直す）
+if st.session_state.start_flg and st.session_state.mode in [ct.MODE_2, ct.MODE_3]:
+    ft.prefetch_problems(st.session_state.englv, st.session_state.theme)
+
 with st.chat_message("assistant", avatar="images/ai_icon.jpg"):
     st.markdown("こちらは生成AIによる音声英会話の練習アプリです。何度も繰り返し練習し、英語力をアップさせましょう。")
     st.markdown("**【操作説明】**")
@@ -156,20 +212,20 @@ with st.chat_message("assistant", avatar="images/ai_icon.jpg"):
     """)
 st.divider()
 
-# メッセージリストの一覧表示
-for message in st.session_state.messages:
-    if message["role"] == "assistant":
-        with st.chat_message(message["role"], avatar="images/ai_icon.jpg"):
-            st.markdown(message["content"])
-            # 文化的コンテキストの表示が有効で、アシスタントのメッセージに英文が含まれている場合
-            if st.session_state.show_cultural_context and "cultural_context" in message:
-                with st.expander("文化的コンテキスト"):
-                    st.info(message["cultural_context"])
-    elif message["role"] == "user":
-        with st.chat_message(message["role"], avatar="images/user_icon.jpg"):
-            st.markdown(message["content"])
-    else:
-        st.divider()
+# メッセージリストの一覧表示（直近のターンのみ。以前のターンは折りたたんで必要なときに表示）
+ft.render_transcript()
+
+# 前回の実行で用意した音声（ディクテーションの問題文など）をブラウザで再生
+ft.render_pending_audio()
+
+# バックグラウンドで更新したエラーパターン分析の助言があれば表示
+error_advice = ft.pop_error_advice()
+if error_advice:
+    with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+        st.markdown("### 会話パターン分析")
+        st.info(error_advice)
+    st.session_state.messages.append({"role": "assistant", "content": f"### 会話パターン分析\n{error_advice}"})
+    st.session_state.messages.append({"role": "other"})
 
 # LLMレスポンスの下部にモード実行のボタン表示
 if st.session_state.shadowing_flg:
@@ -189,16 +245,14 @@ if st.session_state.start_flg:
     # モード：「ディクテーション」
     # 「ディクテーション」ボタン押下時か、「英会話開始」ボタン押下時か、チャット送信時
     if st.session_state.mode == ct.MODE_3 and (st.session_state.dictation_button_flg or st.session_state.dictation_count == 0 or st.session_state.dictation_chat_message):
-        if st.session_state.dictation_first_flg:
-            # レベルと会話テーマに応じた問題生成テンプレートを使用
-            template = ft.get_level_specific_problem_template(st.session_state.englv, st.session_state.theme)
-            st.session_state.chain_create_problem = ft.create_chain(template)
-            st.session_state.dictation_first_flg = False
-        
         # チャット入力以外
         if not st.session_state.chat_open_flg:
             with st.spinner('問題文生成中...'):
-                st.session_state.problem, llm_response_audio = ft.create_problem_and_play_audio()
+                # レベルと会話テーマに応じて先読みされた問題を使用
+                st.session_state.problem, llm_response_audio = ft.play_next_problem(
+                    st.session_state.englv,
+                    st.session_state.theme
+                )
             st.session_state.chat_open_flg = True
             st.session_state.dictation_flg = False
             st.rerun()
@@ -237,53 +291,61 @@ if st.session_state.start_flg:
             })
             st.session_state.messages.append({"role": "user", "content": st.session_state.dictation_chat_message})
             
-            with st.spinner('評価結果の生成中...'):
-                if st.session_state.dictation_evaluation_first_flg:
-                    # 強化されたフィードバックを使用
-                    system_template = ct.SYSTEM_TEMPLATE_ENHANCED_EVALUATION.format(
-                        llm_text=st.session_state.problem,
-                        user_text=st.session_state.dictation_chat_message,
-                        level=st.session_state.englv
+            # ローカル採点（LLMを待たずに即座に表示）
+            local_score = ft.score_answer(st.session_state.problem, st.session_state.dictation_chat_message)
+            local_score_text = ft.format_score_markdown(local_score)
+            with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+                st.markdown(local_score_text)
+            st.session_state.messages.append({"role": "assistant", "content": local_score_text})
+            
+            # LLMによる詳細評価（有効な場合のみ。採点済みの差分を渡してプロンプトを短くする）
+            llm_response_evaluation = local_score_text
+            if st.session_state.llm_evaluation:
+                with st.spinner('評価結果の生成中...'):
+                    llm_response_evaluation = ft.create_evaluation_with_score(
+                        st.session_state.problem,
+                        st.session_state.dictation_chat_message,
+                        st.session_state.englv,
+                        local_score
                     )
-                    st.session_state.chain_evaluation = ft.create_chain(system_template)
-                    st.session_state.dictation_evaluation_first_flg = False
                 
-                # 問題文と回答を比較し、評価結果の生成を指示するプロンプトを作成
-                llm_response_evaluation = ft.create_evaluation()
-            
-            # 評価結果のメッセージリストへの追加と表示
-            with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
-                st.markdown(llm_response_evaluation)
-            st.session_state.messages.append({"role": "assistant", "content": llm_response_evaluation})
+                # 評価結果のメッセージリストへの追加と表示
+                with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+                    st.markdown(llm_response_evaluation)
+                st.session_state.messages.append({"role": "assistant", "content": llm_response_evaluation})
             st.session_state.messages.append({"role": "other"})
             
-            # 会話履歴を保存
+            # 会話履歴を保存し、採点の差分から誤りをエラープロファイルに加算
             ft.save_conversation_history(
                 st.session_state.dictation_chat_message, 
                 st.session_state.problem, 
                 llm_response_evaluation
             )
+            ft.record_turn_errors(st.session_state.dictation_chat_message, local_score)
             
             # 各種フラグの更新
             st.session_state.dictation_flg = True
             st.session_state.dictation_chat_message = ""
             st.session_state.dictation_count += 1
             st.session_state.chat_open_flg = False
+            ft.end_chain_turn()
             st.rerun()
     
     # モード：「日常英会話」
     if st.session_state.mode == ct.MODE_1:
         # 英語レベルに応じたシステムプロンプトを取得して会話チェインを更新
         level_template = ft.get_level_specific_template(st.session_state.englv, st.session_state.theme)
-        st.session_state.chain_basic_conversation = ft.create_chain(level_template)
+        # レベル・テーマが変わらなければ構築済みのチェインが再利用される
+        st.session_state.chain_basic_conversation = ft.create_chain(
+            level_template, "conversation", st.session_state.englv, st.session_state.theme
+        )
         
-        # 音声入力を受け取って音声ファイルを作成
-        audio_input_file_path = f"{ct.AUDIO_INPUT_DIR}/audio_input_{int(time.time())}.wav"
-        ft.record_audio(audio_input_file_path)
+        # 音声入力を受け取ってメモリ上の音声バッファを作成
+        audio_input = ft.record_audio_buffer()
         
-        # 音声入力ファイルから文字起こしテキストを取得
+        # 音声バッファから文字起こしテキストを取得
         with st.spinner('音声入力をテキストに変換中...'):
-            transcript = ft.transcribe_audio(audio_input_file_path)
+            transcript = ft.transcribe_audio_buffer(audio_input)
             audio_input_text = transcript.text
             
             # 最後のユーザー入力を保存
@@ -293,34 +355,83 @@ if st.session_state.start_flg:
         with st.chat_message("user", avatar=ct.USER_ICON_PATH):
             st.markdown(audio_input_text)
         
-        with st.spinner("回答の音声読み上げ準備中..."):
-            # ユーザー入力値をLLMに渡して回答取得
-            llm_response = st.session_state.chain_basic_conversation.predict(input=audio_input_text)
-            
-            # 文化的コンテキストを取得（有効な場合）
-            cultural_context_data = None
-            if st.session_state.show_cultural_context:
-                with st.spinner("文化的コンテキストを取得中..."):
-                    cultural_context_data = ft.provide_cultural_context(llm_response)
-            
-            # 文脈に応じて声を選択する機能を使用
-            llm_response_audio = ft.adjust_voice_based_on_content(llm_response, st.session_state.openai_obj)
-            
-            # 一旦mp3形式で音声ファイル作成後、wav形式に変換
-            audio_output_file_path = f"{ct.AUDIO_OUTPUT_DIR}/audio_output_{int(time.time())}.wav"
-            ft.save_to_wav(llm_response_audio.content, audio_output_file_path)
+        turn_stages = TurnStages()
         
-        # 音声ファイルの読み上げ
-        ft.play_wav(audio_output_file_path, speed=st.session_state.speed)
-        
-        # AIメッセージの画面表示とリストへの追加
+        # AIメッセージの表示枠（文化的コンテキストは届いた時点で表示）
+        cultural_context_data = None
         with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
-            st.markdown(llm_response)
+            reply_placeholder = st.empty()
+            audio_placeholder = st.empty()
+            cultural_context_placeholder = st.empty()
+        
+        if st.session_state.streaming_reply:
+            # 回答をトークン単位で表示しつつ、完結した文から順に音声合成・再生する
+            speech_pipeline, add_sentence = ft.create_sentence_speech_pipeline(st.session_state.speed)
+            llm_response = ft.stream_conversation_reply(
+                st.session_state.chain_basic_conversation,
+                audio_input_text,
+                on_text=lambda text: reply_placeholder.markdown(text + "▌"),
+                on_sentence=add_sentence
+            )
+            speech_pipeline.close()
+            turn_stages.submit("playback", speech_pipeline.join)
+        else:
+            with st.spinner("回答を生成中..."):
+                # ユーザー入力値をLLMに渡して回答取得（回答の生成とメモリへの保存はそれぞれ計測する）
+                llm_response = ft.predict_conversation_reply(st.session_state.chain_basic_conversation, audio_input_text)
             
-            # 文化的コンテキストの表示（有効な場合）
-            if st.session_state.show_cultural_context and cultural_context_data:
-                with st.expander("文化的コンテキスト"):
-                    st.info(cultural_context_data)
+            # 音声合成と文化的コンテキストの取得は回答文のみに依存するため並行して実行する
+            # （別スレッドで実行する処理にはセッション状態を直接渡す）
+            turn_stages.submit(
+                "tts",
+                lambda text=llm_response, voice=ft.select_voice(llm_response), speed=st.session_state.speed,
+                       openai_obj=ft.get_openai_obj(), streaming=st.session_state.streaming_playback,
+                       playback_mode=ft.get_playback_mode():
+                    ft.prepare_speech(text, voice, speed, openai_obj, streaming, playback_mode),
+                ct.TTS_STAGE_TIMEOUT_SEC
+            )
+        reply_placeholder.markdown(llm_response)
+        
+        if st.session_state.show_cultural_context:
+            turn_stages.submit(
+                "cultural_context",
+                ft.create_cultural_context_task(llm_response),
+                ct.CULTURAL_CONTEXT_STAGE_TIMEOUT_SEC
+            )
+        
+        with st.spinner("回答の音声読み上げ準備中..."):
+            for stage_name, stage_result, stage_error in turn_stages.as_completed():
+                if stage_name == "tts":
+                    if stage_error is not None:
+                        st.warning("回答の音声を生成できませんでした。")
+                    else:
+                        # 音声が用意できた時点で再生を開始（再生中も文化的コンテキストの表示は行える）
+                        turn_stages.submit(
+                            "playback",
+                            lambda prepared_speech=stage_result, playback_mode=ft.get_playback_mode():
+                                ft.play_speech(prepared_speech, playback_mode)
+                        )
+                elif stage_name == "cultural_context":
+                    if stage_error is None and stage_result:
+                        cultural_context_data = stage_result
+                        with cultural_context_placeholder.container():
+                            with st.expander("文化的コンテキスト"):
+                                st.info(cultural_context_data)
+                    else:
+                        cultural_context_placeholder.caption("文化的コンテキストを取得できませんでした。")
+                elif stage_name == "playback":
+                    if stage_error is not None:
+                        st.warning("回答の音声を再生できませんでした。")
+                    elif ft.get_playback_mode() == "browser":
+                        # 再生はブラウザで行うため、音声を送った時点でこのターンの処理を続けられる
+                        ft.render_browser_audio(stage_result, audio_placeholder)
+                    if st.session_state.streaming_reply and speech_pipeline.errors:
+                        # 文ごとの読み上げに失敗した文は、次の文の前にその位置で読み上げ直している
+                        if speech_pipeline.respoken:
+                            st.error("次の文は音声の生成に失敗したため、読み上げ直しました: "
+                                     + " / ".join(sentence for sentence, _ in speech_pipeline.respoken))
+                        for (sentence, _), error in speech_pipeline.fallback_errors:
+                            st.error(f"次の文を読み上げられませんでした: {sentence}（{error}）")
         
         # ユーザー入力値とLLMからの回答をメッセージ一覧に追加
         st.session_state.messages.append({"role": "user", "content": audio_input_text})
@@ -330,56 +441,49 @@ if st.session_state.start_flg:
             "cultural_context": cultural_context_data if cultural_context_data else None
         })
         
-        # 会話履歴を保存
+        # 会話履歴を保存し、このターンの誤りをエラープロファイルに加算
         ft.save_conversation_history(audio_input_text, llm_response)
+        ft.record_turn_errors(audio_input_text)
         
         # 会話カウンターを増やす
         st.session_state.conversation_counter += 1
         
-        # 10回の会話ごとにエラー分析を表示（有効な場合）
-        if st.session_state.show_error_analysis and st.session_state.conversation_counter % 10 == 0:
-            with st.spinner("会話パターンを分析中..."):
-                recent_history = ft.get_recent_conversation_history(10)
-                if recent_history:
-                    history_for_analysis = "\n".join([f"User: {entry['user_input']}\nAI: {entry['ai_response']}" for entry in recent_history])
-                    error_analysis = ft.analyze_user_errors(history_for_analysis)
-                    with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
-                        st.markdown("### 会話パターン分析")
-                        st.info(error_analysis)
-                    st.session_state.messages.append({"role": "assistant", "content": f"### 会話パターン分析\n{error_analysis}"})
-                    st.session_state.messages.append({"role": "other"})
+        # 一定回数の会話ごとにエラー分析の助言を更新（有効な場合）
+        # 前回以降の増分だけをLLMに渡し、結果は次の描画で表示するため、ここでは待たない
+        if st.session_state.show_error_analysis and st.session_state.conversation_counter % ct.ERROR_ADVICE_INTERVAL_TURNS == 0:
+            ft.submit_error_advice()
+        
+        # このターンのチェイン再利用の統計を確定し、サイドバーの表示を更新
+        ft.end_chain_turn(chain_stats_placeholder)
     
     # モード：「シャドーイング」
     # 「シャドーイング」ボタン押下時か、「英会話開始」ボタン押下時
     if st.session_state.mode == ct.MODE_2 and (st.session_state.shadowing_button_flg or st.session_state.shadowing_count == 0 or st.session_state.shadowing_audio_input_flg):
-        if st.session_state.shadowing_first_flg:
-            # レベルと会話テーマに応じた問題生成テンプレートを使用
-            template = ft.get_level_specific_problem_template(st.session_state.englv, st.session_state.theme)
-            st.session_state.chain_create_problem = ft.create_chain(template)
-            st.session_state.shadowing_first_flg = False
-        
         if not st.session_state.shadowing_audio_input_flg:
             with st.spinner('問題文生成中...'):
-                st.session_state.problem, llm_response_audio = ft.create_level_appropriate_problem_and_play_audio(
+                # レベルと会話テーマに応じて先読みされた問題を使用
+                st.session_state.problem, llm_response_audio = ft.play_next_problem(
                     st.session_state.englv, 
                     st.session_state.theme
                 )
-                
+            # 録音の待ち受けで実行が止まる前に問題文の音声を送る（ブラウザ再生の場合）
+            ft.render_pending_audio()
+            
+            with st.spinner('問題文生成中...'):
                 # 文化的コンテキストを取得（有効な場合）
                 cultural_context_data = None
                 if st.session_state.show_cultural_context:
                     with st.spinner("文化的コンテキストを取得中..."):
                         cultural_context_data = ft.provide_cultural_context(st.session_state.problem)
         
-        # 音声入力を受け取って音声ファイルを作成
+        # 音声入力を受け取ってメモリ上の音声バッファを作成
         st.session_state.shadowing_audio_input_flg = True
-        audio_input_file_path = f"{ct.AUDIO_INPUT_DIR}/audio_input_{int(time.time())}.wav"
-        ft.record_audio(audio_input_file_path)
+        audio_input = ft.record_audio_buffer()
         st.session_state.shadowing_audio_input_flg = False
         
         with st.spinner('音声入力をテキストに変換中...'):
-            # 音声入力ファイルから文字起こしテキストを取得
-            transcript = ft.transcribe_audio(audio_input_file_path)
+            # 音声バッファから文字起こしテキストを取得
+            transcript = ft.transcribe_audio_buffer(audio_input)
             audio_input_text = transcript.text
             
             # 最後のユーザー入力を保存
@@ -405,36 +509,51 @@ if st.session_state.start_flg:
         })
         st.session_state.messages.append({"role": "user", "content": audio_input_text})
         
-        with st.spinner('評価結果の生成中...'):
-            if st.session_state.shadowing_evaluation_first_flg:
-                # 強化されたフィードバックを使用
-                system_template = ct.SYSTEM_TEMPLATE_ENHANCED_EVALUATION.format(
-                    llm_text=st.session_state.problem,
-                    user_text=audio_input_text,
-                    level=st.session_state.englv
+        # ローカル採点（LLMを待たずに即座に表示）
+        local_score = ft.score_answer(st.session_state.problem, audio_input_text)
+        local_score_text = ft.format_score_markdown(local_score)
+        with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+            st.markdown(local_score_text)
+        st.session_state.messages.append({"role": "assistant", "content": local_score_text})
+        
+        # お手本の音声との比較による発音分析（ローカル処理のみ）
+        if ct.PRONUNCIATION_ANALYSIS_ENABLED:
+            pronunciation_result = ft.analyze_pronunciation(audio_input, st.session_state.problem)
+            if pronunciation_result:
+                pronunciation_text = ft.format_pronunciation_markdown(pronunciation_result)
+                with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+                    st.markdown(pronunciation_text)
+                st.session_state.messages.append({"role": "assistant", "content": pronunciation_text})
+        
+        # LLMによる詳細評価（有効な場合のみ。採点済みの差分を渡してプロンプトを短くする）
+        llm_response_evaluation = local_score_text
+        if st.session_state.llm_evaluation:
+            with st.spinner('評価結果の生成中...'):
+                llm_response_evaluation = ft.create_evaluation_with_score(
+                    st.session_state.problem,
+                    audio_input_text,
+                    st.session_state.englv,
+                    local_score
                 )
-                st.session_state.chain_evaluation = ft.create_chain(system_template)
-                st.session_state.shadowing_evaluation_first_flg = False
             
-            # 問題文と回答を比較し、評価結果の生成
-            llm_response_evaluation = ft.create_evaluation()
-        
-        # 評価結果のメッセージリストへの追加と表示
-        with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
-            st.markdown(llm_response_evaluation)
-        st.session_state.messages.append({"role": "assistant", "content": llm_response_evaluation})
+            # 評価結果のメッセージリストへの追加と表示
+            with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+                st.markdown(llm_response_evaluation)
+            st.session_state.messages.append({"role": "assistant", "content": llm_response_evaluation})
         st.session_state.messages.append({"role": "other"})
         
-        # 会話履歴を保存
+        # 会話履歴を保存し、採点の差分から誤りをエラープロファイルに加算
         ft.save_conversation_history(
             audio_input_text, 
             st.session_state.problem, 
             llm_response_evaluation
         )
+        ft.record_turn_errors(audio_input_text, local_score)
         
         # 各種フラグの更新
         st.session_state.shadowing_flg = True
         st.session_state.shadowing_count += 1
+        ft.end_chain_turn()
         
         # 「シャドーイング」ボタンを表示するために再描画
         st.rerun()
\ No newline at end of file
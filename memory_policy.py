@@ -0,0 +1,134 @@
+"""
+用途ごとのメモリ方針とプロンプトのトークン数計測
+- conversation: セッションの会話メモリ（ConversationSummaryBufferMemory）を使う通常のConversationChain
+- evaluation: 評価専用の件数制限付きメモリ（会話メモリには書き込まない）
+- oneshot: メモリを使わない1回限りの呼び出し（文化的コンテキスト、エラー分析、発音分析など）
+"""
+import threading
+import latency
+import constants as ct
+
+
+def count_message_tokens(llm, messages):
+    """
+    メッセージのトークン数（tiktokenが使えない環境では文字数から概算）
+    """
+    if not messages:
+        return 0
+    try:
+        return llm.get_num_tokens_from_messages(messages)
+    except Exception:
+        return sum(len(str(message.content)) for message in messages) // 4
+
+
+def prompt_tokens_from_usage(message):
+    """
+    レスポンスの使用量に含まれる入力トークン数（含まれない場合はNone）
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return None
+    return usage.get("input_tokens")
+
+
+class TokenMeter:
+    """
+    用途ごとのプロンプトトークン数の計測
+    会話メモリを共有していた場合のトークン数（baseline）も併せて記録し、削減量を確認できるようにする
+    会話メモリの履歴のトークン数は、会話のターンごとにスクリプトのスレッドで数えたものを受け取る
+    （記録はバックグラウンドスレッドからも行われるため、ここでは会話メモリに触れない）
+    """
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._conversation_history_tokens = 0
+
+    def set_conversation_history_tokens(self, tokens):
+        """
+        会話メモリの履歴のトークン数の更新（会話メモリへの保存の直後に、スクリプトのスレッドから呼ぶ）
+        """
+        with self._lock:
+            self._conversation_history_tokens = tokens
+
+    def record(self, purpose, prompt_tokens, history_tokens):
+        """
+        Args:
+            purpose: 用途
+            prompt_tokens: プロンプト全体のトークン数
+            history_tokens: そのうち用途専用のメモリの履歴のトークン数
+        """
+        with self._lock:
+            # 会話メモリを共有していた場合は、この用途の履歴の代わりに会話メモリの履歴が付与されていた
+            baseline_tokens = prompt_tokens - history_tokens + self._conversation_history_tokens
+            stats = self._stats.setdefault(purpose, {"calls": 0, "prompt_tokens": 0, "baseline_tokens": 0})
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["baseline_tokens"] += baseline_tokens
+
+    def summary(self):
+        """
+        用途ごとの1回あたりの平均トークン数と削減率
+        """
+        with self._lock:
+            rows = []
+            for purpose, stats in self._stats.items():
+                calls = stats["calls"]
+                baseline = stats["baseline_tokens"]
+                rows.append({
+                    "purpose": purpose,
+                    "calls": calls,
+                    "prompt_tokens_per_call": stats["prompt_tokens"] / calls,
+                    "baseline_tokens_per_call": baseline / calls,
+                    "reduction": 1 - stats["prompt_tokens"] / baseline if baseline else 0.0,
+                })
+            return rows
+
+
+class PolicyChain:
+    """
+    メモリ方針を指定して呼び出すチェイン（ConversationChainと同じ predict(input=...) で使える）
+    スクリプトのスレッドで作成しておけば、バックグラウンドスレッドからも呼び出せる
+    """
+    input_key = "input"
+    output_key = "response"
+
+    def __init__(self, llm, prompt, purpose, memory=None, token_meter=None):
+        """
+        Args:
+            llm: ChatOpenAIのオブジェクト
+            prompt: system / history / input からなるChatPromptTemplate
+            purpose: 用途（計測の集計単位）
+            memory: 用途専用のメモリ（Noneの場合は履歴を使わない）
+            token_meter: TokenMeter
+        """
+        self.llm = llm
+        self.prompt = prompt
+        self.purpose = purpose
+        self.memory = memory
+        self._token_meter = token_meter
+
+    def _history(self, memory, inputs):
+        if memory is None:
+            return []
+        return memory.load_memory_variables(inputs)["history"]
+
+    def predict(self, input=""):
+        inputs = {self.input_key: input}
+        history = self._history(self.memory, inputs)
+        messages = self.prompt.format_messages(input=input, history=history)
+        with latency.span(f"llm_{self.purpose}"):
+            reply = self.llm.invoke(messages)
+        response = reply.content
+        if self._token_meter is not None:
+            # プロンプト全体のトークン数はレスポンスの使用量を使い、tiktokenで数えるのは用途専用の履歴がある場合のみ
+            prompt_tokens = prompt_tokens_from_usage(reply)
+            if prompt_tokens is None:
+                prompt_tokens = count_message_tokens(self.llm, messages)
+            self._token_meter.record(self.purpose, prompt_tokens, count_message_tokens(self.llm, history))
+        if self.memory is not None:
+            self.memory.save_context(inputs, {self.output_key: response})
+        return response
+
+
+def get_memory_policy(purpose):
+    return ct.MEMORY_POLICIES.get(purpose, "oneshot")
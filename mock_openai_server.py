@@ -0,0 +1,441 @@
+"""
+OpenAI APIのローカル代替サーバー（オフラインでの動作確認・計測用）
+チャット（/v1/chat/completions、ストリーミング対応）、音声合成（/v1/audio/speech）、
+文字起こし（/v1/audio/transcriptions）に対応し、待ち時間は固定値または分布（プロファイル）で指定できる
+
+使い方:
+    python mock_openai_server.py --port 8765 --profile realistic
+    クライアント側は OpenAI(api_key="mock", base_url="http://127.0.0.1:8765/v1") で接続する
+    アプリは環境変数 MOCK_OPENAI_BASE_URL=http://127.0.0.1:8765/v1 を設定して起動すると接続先が切り替わる
+"""
+import argparse
+import email
+import email.policy
+import io
+import json
+import random
+import re
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import constants as ct
+from upload_encoder import find_ffmpeg
+
+# 最初のチャンクを返すまでの待ち時間（秒）
+DEFAULT_FIRST_CHUNK_DELAY = 0.3
+# 2つ目以降のチャンク間の待ち時間（秒）
+DEFAULT_CHUNK_DELAY = 0.02
+DEFAULT_CHUNK_SIZE = 4096
+# 文字起こしの待ち時間（固定分 + 音声1秒あたり）
+DEFAULT_TRANSCRIPTION_DELAY = 0.3
+DEFAULT_TRANSCRIPTION_DELAY_PER_SEC = 0.03
+# アップロード帯域の上限（バイト/秒、Noneの場合は制限なし）
+DEFAULT_UPLOAD_BYTES_PER_SEC = None
+DEFAULT_TRANSCRIPTION_TEXT = "I would like to practice English conversation."
+# チャットの最初のトークンまでの待ち時間と、トークン間の待ち時間（秒）
+DEFAULT_CHAT_FIRST_TOKEN_DELAY = 0.4
+DEFAULT_CHAT_TOKEN_DELAY = 0.015
+# 新しい接続を受け付けるときの待ち時間（秒、TCP・TLSのハンドシェイクを模したもの）
+DEFAULT_CONNECT_DELAY = 0.0
+DEFAULT_CHAT_REPLY = (
+    "That sounds like a lot of fun! I usually spend my weekends walking in the park near my house. "
+    "What do you like to do when you have free time?"
+)
+
+
+class LatencyDistribution:
+    """
+    待ち時間の分布（対数正規分布。sigmaが0の場合は常に中央値）
+    """
+    def __init__(self, median, sigma=0.0, floor=0.0):
+        self.median = median
+        self.sigma = sigma
+        self.floor = floor
+
+    def sample(self, rng=random):
+        if self.sigma == 0 or self.median == 0:
+            return self.median
+        return max(self.floor, rng.lognormvariate(0, self.sigma) * self.median)
+
+
+# 待ち時間のプロファイル（実際のAPIの傾向を模した中央値とばらつき）
+LATENCY_PROFILES = {
+    "instant": {
+        "chat_first_token_delay": LatencyDistribution(0.0),
+        "chat_token_delay": LatencyDistribution(0.0),
+        "first_chunk_delay": LatencyDistribution(0.0),
+        "chunk_delay": LatencyDistribution(0.0),
+        "transcription_delay": LatencyDistribution(0.0),
+        "transcription_delay_per_sec": LatencyDistribution(0.0),
+    },
+    "fast": {
+        "chat_first_token_delay": LatencyDistribution(0.2, 0.2),
+        "chat_token_delay": LatencyDistribution(0.008, 0.2),
+        "first_chunk_delay": LatencyDistribution(0.15, 0.2),
+        "chunk_delay": LatencyDistribution(0.01),
+        "transcription_delay": LatencyDistribution(0.2, 0.2),
+        "transcription_delay_per_sec": LatencyDistribution(0.015),
+    },
+    "realistic": {
+        "chat_first_token_delay": LatencyDistribution(0.5, 0.45, 0.1),
+        "chat_token_delay": LatencyDistribution(0.02, 0.3),
+        "first_chunk_delay": LatencyDistribution(0.35, 0.4, 0.05),
+        "chunk_delay": LatencyDistribution(0.02, 0.3),
+        "transcription_delay": LatencyDistribution(0.45, 0.4, 0.1),
+        "transcription_delay_per_sec": LatencyDistribution(0.03, 0.2),
+    },
+    "slow": {
+        "chat_first_token_delay": LatencyDistribution(1.2, 0.6, 0.2),
+        "chat_token_delay": LatencyDistribution(0.04, 0.4),
+        "first_chunk_delay": LatencyDistribution(0.9, 0.5, 0.1),
+        "chunk_delay": LatencyDistribution(0.04, 0.4),
+        "transcription_delay": LatencyDistribution(1.0, 0.5, 0.2),
+        "transcription_delay_per_sec": LatencyDistribution(0.06, 0.3),
+    },
+}
+
+
+def synthesize_tone_pcm(text, sample_rate=ct.TTS_PCM_SAMPLE_RATE):
+    """
+    テキストの単語ごとに有声区間と無音区間を並べたダミー音声を生成
+    Args:
+        text: 読み上げ対象のテキスト
+        sample_rate: サンプリングレート
+    Returns:
+        16bitモノラルのPCMデータ
+    """
+    segments = []
+    words = text.split() or [""]
+    for idx, word in enumerate(words):
+        # 単語の長さに応じて有声区間を伸ばし、ピッチも単語ごとに変える
+        duration = 0.18 + 0.04 * len(word)
+        t = np.arange(int(sample_rate * duration)) / sample_rate
+        pitch = 140 + 40 * (idx % 3)
+        envelope = np.sin(np.pi * t / duration)
+        segments.append(0.3 * envelope * np.sin(2 * np.pi * pitch * t))
+        segments.append(np.zeros(int(sample_rate * 0.08)))
+    samples = np.concatenate(segments)
+    return (samples * 32767).astype("<i2").tobytes()
+
+
+def pcm_to_wav(pcm, sample_rate=ct.TTS_PCM_SAMPLE_RATE):
+    """
+    PCMデータにWAVヘッダーを付与
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(ct.TTS_PCM_CHANNELS)
+        wav_file.setsampwidth(ct.TTS_PCM_SAMPLE_WIDTH)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue()
+
+
+# ffmpegでエンコードして返す音声合成の形式（upload_encoder の形式名との対応）
+ENCODED_SPEECH_FORMATS = {"mp3": "mp3", "opus": "ogg", "flac": "flac"}
+
+
+def encode_speech(pcm, response_format):
+    """
+    PCMデータを音声合成APIの形式（mp3など）にffmpegでエンコード
+    Returns:
+        (データ, MIMEタイプ)
+    """
+    from audio_buffer import PcmBuffer
+    from upload_encoder import encode
+
+    _, body, content_type = encode(PcmBuffer(pcm), ENCODED_SPEECH_FORMATS[response_format])
+    return body, content_type
+
+
+def load_speech_audio(path):
+    """
+    音声合成の結果として返す録音済み音声の読み込み
+    """
+    with wave.open(path, "rb") as wav_file:
+        if (wav_file.getframerate(), wav_file.getsampwidth(), wav_file.getnchannels()) != (
+                ct.TTS_PCM_SAMPLE_RATE, ct.TTS_PCM_SAMPLE_WIDTH, ct.TTS_PCM_CHANNELS):
+            raise ValueError(f"{path} must be {ct.TTS_PCM_SAMPLE_RATE} Hz, 16-bit, mono")
+        return wav_file.readframes(wav_file.getnframes())
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 計測の邪魔にならないようアクセスログは出さない
+        pass
+
+    def setup(self):
+        super().setup()
+        # 接続の再利用の確認用に、受け付けた接続の数を数える
+        with self.server.rng_lock:
+            self.server.connection_count += 1
+        delay = self._delay("connect_delay")
+        if delay:
+            time.sleep(delay)
+
+    def _delay(self, name):
+        """
+        設定された待ち時間（固定値または分布からの標本）
+        """
+        value = self.server.config[name]
+        if isinstance(value, LatencyDistribution):
+            with self.server.rng_lock:
+                return value.sample(self.server.rng)
+        return value
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/v1/chat/completions":
+            self._handle_chat()
+        elif self.path.rstrip("/") == "/v1/audio/speech":
+            self._handle_speech()
+        elif self.path.rstrip("/") == "/v1/audio/transcriptions":
+            self._handle_transcription()
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path: {self.path}"}})
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle_speech(self):
+        request = self._read_json()
+        response_format = request.get("response_format", "mp3")
+        pcm = self.server.config["speech_pcm"] or synthesize_tone_pcm(request.get("input", ""))
+        if response_format == "pcm":
+            body, content_type = pcm, "audio/pcm"
+        elif response_format == "wav":
+            body, content_type = pcm_to_wav(pcm), "audio/wav"
+        elif response_format in ENCODED_SPEECH_FORMATS and find_ffmpeg():
+            body, content_type = encode_speech(pcm, response_format)
+        else:
+            self._send_json(400, {"error": {"message": f"Unsupported response_format: {response_format}"}})
+            return
+        self._send_chunked(body, content_type)
+
+    def _read_body(self):
+        """
+        リクエスト本文の受信（帯域の上限が設定されている場合は受信速度を絞る）
+        """
+        length = int(self.headers.get("Content-Length", 0))
+        bytes_per_sec = self.server.config["upload_bytes_per_sec"]
+        if not bytes_per_sec:
+            return self.rfile.read(length)
+        chunks = []
+        start = time.perf_counter()
+        received = 0
+        while received < length:
+            chunk = self.rfile.read(min(DEFAULT_CHUNK_SIZE, length - received))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+            wait = received / bytes_per_sec - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+        return b"".join(chunks)
+
+    def _handle_transcription(self):
+        body = self._read_body()
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("latin-1") + body,
+            policy=email.policy.HTTP
+        )
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = part.get_payload(decode=True)
+        audio = fields.get("file")
+        if not audio:
+            self._send_json(400, {"error": {"message": "file is required"}})
+            return
+        try:
+            with wave.open(io.BytesIO(audio), "rb") as wav_file:
+                duration = wav_file.getnframes() / wav_file.getframerate()
+        except (wave.Error, EOFError):
+            # 圧縮形式（FLAC、Ogg、MP3）はデコードせず、長さに比例する待ち時間を省く
+            duration = 0.0
+        # 実際の文字起こしと同様に、音声が長いほど処理時間がかかる
+        time.sleep(self._delay("transcription_delay") + self._delay("transcription_delay_per_sec") * duration)
+        self._send_json(200, {"text": self.server.config["transcription_text"]})
+
+    def _handle_chat(self):
+        request = self._read_json()
+        model = request.get("model", "gpt-4o-mini")
+        reply = self.server.config["chat_reply"]
+        tokens = re.findall(r"\S+\s*", reply)
+        completion_id = f"chatcmpl-mock-{time.time_ns()}"
+        created = int(time.time())
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in request.get("messages", []))
+        if not request.get("stream"):
+            time.sleep(self._delay("chat_first_token_delay") + self._delay("chat_token_delay") * len(tokens))
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                },
+            })
+            return
+
+        # Server-Sent Eventsでトークンごとに返す
+        def event(delta, finish_reason=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+        self._start_chunked("text/event-stream")
+        time.sleep(self._delay("chat_first_token_delay"))
+        self._write_chunk(event({"role": "assistant", "content": ""}))
+        for idx, token in enumerate(tokens):
+            if idx > 0:
+                time.sleep(self._delay("chat_token_delay"))
+            self._write_chunk(event({"content": token}))
+        self._write_chunk(event({}, "stop"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, chunk):
+        self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii"))
+        self.wfile.write(chunk)
+        self.wfile.write(b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _send_chunked(self, body, content_type):
+        """
+        レスポンスをチャンク転送で少しずつ返す（ストリーミング受信の再現用）
+        """
+        self._start_chunked(content_type)
+        time.sleep(self._delay("first_chunk_delay"))
+        view = memoryview(body)
+        chunk_size = self.server.config["chunk_size"]
+        for offset in range(0, len(view), chunk_size):
+            if offset > 0:
+                time.sleep(self._delay("chunk_delay"))
+            self._write_chunk(view[offset:offset + chunk_size])
+        self._end_chunked()
+
+
+def start_server(host="127.0.0.1", port=0, first_chunk_delay=DEFAULT_FIRST_CHUNK_DELAY,
+                 chunk_delay=DEFAULT_CHUNK_DELAY, chunk_size=DEFAULT_CHUNK_SIZE,
+                 transcription_delay=DEFAULT_TRANSCRIPTION_DELAY,
+                 transcription_delay_per_sec=DEFAULT_TRANSCRIPTION_DELAY_PER_SEC,
+                 upload_bytes_per_sec=DEFAULT_UPLOAD_BYTES_PER_SEC,
+                 transcription_text=DEFAULT_TRANSCRIPTION_TEXT,
+                 chat_first_token_delay=DEFAULT_CHAT_FIRST_TOKEN_DELAY,
+                 chat_token_delay=DEFAULT_CHAT_TOKEN_DELAY,
+                 chat_reply=DEFAULT_CHAT_REPLY,
+                 speech_audio_path=None, profile=None, seed=None,
+                 connect_delay=DEFAULT_CONNECT_DELAY):
+    """
+    代替サーバーをバックグラウンドスレッドで起動
+    Args:
+        host: 待ち受けホスト
+        port: 待ち受けポート（0の場合は空きポートを自動選択）
+        first_chunk_delay: 最初のチャンクを返すまでの待ち時間（秒）
+        chunk_delay: チャンク間の待ち時間（秒）
+        chunk_size: 1チャンクのバイト数
+        transcription_delay: 文字起こしの固定の待ち時間（秒）
+        transcription_delay_per_sec: 音声1秒あたりの文字起こしの待ち時間（秒）
+        upload_bytes_per_sec: アップロード帯域の上限（バイト/秒、Noneの場合は制限なし）
+        transcription_text: 文字起こし結果として返すテキスト
+        chat_first_token_delay: チャットの最初のトークンまでの待ち時間（秒）
+        chat_token_delay: チャットのトークン間の待ち時間（秒）
+        chat_reply: チャットの回答として返すテキスト
+        speech_audio_path: 音声合成の結果として返すWAVファイル（24kHz・16bit・モノラル。Noneの場合はダミー音声を生成）
+        profile: LATENCY_PROFILES のキー（指定した場合は待ち時間をプロファイルの分布で上書き）
+        seed: 待ち時間の乱数のシード
+        connect_delay: 新しい接続を受け付けるときの待ち時間（秒）
+    Returns:
+        起動したサーバー（base_url属性にクライアント用のURLを、connection_count属性に受け付けた接続の数を保持）
+    """
+    server = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+    server.daemon_threads = True
+    server.config = {
+        "first_chunk_delay": first_chunk_delay,
+        "chunk_delay": chunk_delay,
+        "chunk_size": chunk_size,
+        "transcription_delay": transcription_delay,
+        "transcription_delay_per_sec": transcription_delay_per_sec,
+        "upload_bytes_per_sec": upload_bytes_per_sec,
+        "transcription_text": transcription_text,
+        "chat_first_token_delay": chat_first_token_delay,
+        "chat_token_delay": chat_token_delay,
+        "chat_reply": chat_reply,
+        "speech_pcm": load_speech_audio(speech_audio_path) if speech_audio_path else None,
+        "connect_delay": connect_delay,
+    }
+    if profile is not None:
+        server.config.update(LATENCY_PROFILES[profile])
+    server.rng = random.Random(seed)
+    server.rng_lock = threading.Lock()
+    server.connection_count = 0
+    server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI APIのローカル代替サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-chunk-delay", type=float, default=DEFAULT_FIRST_CHUNK_DELAY)
+    parser.add_argument("--chunk-delay", type=float, default=DEFAULT_CHUNK_DELAY)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--transcription-delay", type=float, default=DEFAULT_TRANSCRIPTION_DELAY)
+    parser.add_argument("--transcription-delay-per-sec", type=float, default=DEFAULT_TRANSCRIPTION_DELAY_PER_SEC)
+    parser.add_argument("--upload-bytes-per-sec", type=int, default=DEFAULT_UPLOAD_BYTES_PER_SEC)
+    parser.add_argument("--transcription-text", default=DEFAULT_TRANSCRIPTION_TEXT)
+    parser.add_argument("--chat-first-token-delay", type=float, default=DEFAULT_CHAT_FIRST_TOKEN_DELAY)
+    parser.add_argument("--chat-token-delay", type=float, default=DEFAULT_CHAT_TOKEN_DELAY)
+    parser.add_argument("--chat-reply", default=DEFAULT_CHAT_REPLY)
+    parser.add_argument("--speech-audio", help="音声合成の結果として返すWAVファイル")
+    parser.add_argument("--profile", choices=sorted(LATENCY_PROFILES), help="待ち時間のプロファイル")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--connect-delay", type=float, default=DEFAULT_CONNECT_DELAY)
+    args = parser.parse_args()
+    server = start_server(
+        args.host, args.port, args.first_chunk_delay, args.chunk_delay, args.chunk_size,
+        args.transcription_delay, args.transcription_delay_per_sec, args.upload_bytes_per_sec,
+        args.transcription_text, args.chat_first_token_delay, args.chat_token_delay, args.chat_reply,
+        args.speech_audio, args.profile, args.seed, args.connect_delay
+    )
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
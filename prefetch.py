@@ -0,0 +1,110 @@
+"""
+シャドーイング・ディクテーション用の問題先読みキュー
+ユーザーが回答している間に、次の問題文と音声をバックグラウンドで用意しておく
+生成はプロセス全体で共有するスレッドプールで行い、セッションごとにスレッドを作らない
+"""
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from latency import run_in_context
+import constants as ct
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_prefetch_executor():
+    """
+    プロセス全体で共有する先読み用のスレッドプールの取得
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ct.PROBLEM_PREFETCH_WORKERS, thread_name_prefix="problem-prefetch")
+        return _executor
+
+
+class ProblemPrefetcher:
+    """
+    (英語レベル, 会話テーマ) ごとに問題文と音声を先読みするキュー
+    レベルやテーマが変わった場合は、用意済みの問題と生成中の結果を破棄する
+    """
+    def __init__(self, generate, depth=ct.PROBLEM_PREFETCH_DEPTH, executor=None):
+        """
+        Args:
+            generate: (level, theme) を受け取り (問題文, PcmBuffer) を返す関数
+            depth: 先読みしておく問題数
+            executor: 生成に使うスレッドプール（省略時はプロセス全体で共有するもの）
+        """
+        self._generate = generate
+        self._depth = depth
+        self._key = None
+        self._ready = deque()
+        self._in_flight = 0
+        self._futures = []
+        # キーが変わるたびに増やし、古いキーで生成された結果を捨てる目印にする
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._executor = executor if executor is not None else get_prefetch_executor()
+        self.last_error = None
+
+    def set_key(self, level, theme):
+        """
+        先読み対象の切り替え（変更がなければ何もしない）
+        """
+        with self._cond:
+            if self._key == (level, theme):
+                return
+            self._key = (level, theme)
+            self._ready.clear()
+            self._in_flight = 0
+            self._generation += 1
+            # まだ開始していない古いキーの生成は取り消す
+            for future in self._futures:
+                future.cancel()
+            self._futures = []
+            self._cond.notify_all()
+
+    def fill(self):
+        """
+        先読み数に足りない分の生成をバックグラウンドで開始
+        """
+        with self._cond:
+            if self._key is None:
+                return
+            while len(self._ready) + self._in_flight < self._depth:
+                self._in_flight += 1
+                self._futures.append(self._executor.submit(run_in_context(self._produce), self._key, self._generation))
+            self._futures = [future for future in self._futures if not future.done()]
+
+    def _produce(self, key, generation):
+        try:
+            item = self._generate(*key)
+        except Exception as e:
+            item = None
+            self.last_error = e
+        with self._cond:
+            if generation != self._generation:
+                return
+            self._in_flight -= 1
+            if item is not None:
+                self._ready.append(item)
+            self._cond.notify_all()
+
+    def pop(self, timeout=ct.PROBLEM_PREFETCH_WAIT_SEC):
+        """
+        用意済みの問題を1つ取り出す（生成中のものがあれば完了を待つ）
+        Returns:
+            (問題文, PcmBuffer)。用意できなかった場合はNone
+        """
+        with self._cond:
+            self.fill()
+            self._cond.wait_for(lambda: self._ready or self._in_flight == 0, timeout)
+            item = self._ready.popleft() if self._ready else None
+            # 取り出した分をすぐに補充し、ユーザーの回答中に次の問題を用意する
+            self.fill()
+        return item
+
+    def pending(self):
+        with self._cond:
+            return len(self._ready), self._in_flight
@@ -0,0 +1,305 @@
+"""
+事前に生成・音声合成しておく問題バンク（シャドーイング・ディクテーション用）
+- 一括生成: (英語レベル, 会話テーマ) の組ごとに、並行数を制限してLLMで文をまとめて生成し、
+  難しさの特徴量（difficulty.py）がレベルの範囲に収まる文だけを音声合成して保存する
+- 実行時: (英語レベル, 会話テーマ) ごとの問題IDの配列をメモリに持ち、乱数で位置を選ぶだけで取り出す（生成の待ち時間なし）
+
+使い方:
+    python problem_bank.py --target 30 --concurrency 4
+    python problem_bank.py --levels 初級者 --themes 旅行 買い物 --base-url http://127.0.0.1:8765/v1
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import constants as ct
+from audio_buffer import PcmBuffer
+import difficulty
+
+_LIST_MARKER = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s*")
+
+
+class ProblemBank:
+    """
+    問題文・特徴量・音声ファイルの索引付きストア
+    接続はスレッドごとに作成する（一括生成は複数スレッドから書き込む）
+    """
+    def __init__(self, db_path=ct.PROBLEM_BANK_DB_PATH, audio_dir=ct.PROBLEM_BANK_AUDIO_DIR):
+        self._db_path = db_path
+        self._audio_dir = audio_dir
+        self._local = threading.local()
+        self._index = None
+        self._index_lock = threading.Lock()
+        # 出題済みの集合の確認と追加をまとめて行うためのロック（先読みのスレッドが同じセッションの集合を同時に使う）
+        self._seen_lock = threading.Lock()
+        os.makedirs(audio_dir, exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS problems (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    english_level TEXT NOT NULL,
+                    theme TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    words INTEGER NOT NULL,
+                    syllables_per_word REAL NOT NULL,
+                    rare_ratio REAL NOT NULL,
+                    difficulty REAL NOT NULL,
+                    audio_file TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    UNIQUE (english_level, theme, text)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS problems_by_pair ON problems (english_level, theme, difficulty)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=ct.HISTORY_DB_BUSY_TIMEOUT_SEC)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def existing_texts(self, level, theme):
+        rows = self._connect().execute(
+            "SELECT text FROM problems WHERE english_level = ? AND theme = ?", (level, theme)
+        ).fetchall()
+        return {row["text"] for row in rows}
+
+    def add(self, level, theme, text, features, audio_buffer):
+        """
+        問題の保存（音声はWAVファイルに書いてから索引に登録する）
+        Args:
+            level: 英語レベル
+            theme: 会話テーマ
+            text: 問題文
+            features: words / syllables_per_word / rare_ratio / difficulty を持つ辞書（1文分）
+            audio_buffer: 通常速度の音声（PcmBuffer）
+        Returns:
+            追加した問題のID（同じ文が登録済みの場合はNone）
+        """
+        audio_file = f"{time.time_ns()}_{threading.get_ident()}.wav"
+        path = os.path.join(self._audio_dir, audio_file)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(audio_buffer.wav_header())
+            f.write(audio_buffer.data)
+        os.replace(f"{path}.tmp", path)
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO problems (english_level, theme, text, words, syllables_per_word, rare_ratio,
+                                          difficulty, audio_file, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (level, theme, text, int(features["words"]), float(features["syllables_per_word"]),
+                     float(features["rare_ratio"]), float(features["difficulty"]), audio_file,
+                     time.strftime("%Y-%m-%d %H:%M:%S"))
+                )
+        except sqlite3.IntegrityError:
+            os.remove(path)
+            return None
+        self._index = None
+        return cursor.lastrowid
+
+    def counts(self):
+        """
+        (英語レベル, 会話テーマ) ごとの問題数
+        """
+        return {key: len(ids) for key, ids in self._load_index().items()}
+
+    def _load_index(self):
+        with self._index_lock:
+            if self._index is None:
+                rows = self._connect().execute(
+                    "SELECT english_level, theme, id FROM problems ORDER BY english_level, theme, difficulty"
+                ).fetchall()
+                grouped = {}
+                for row in rows:
+                    grouped.setdefault((row["english_level"], row["theme"]), []).append(row["id"])
+                self._index = {key: np.array(ids, dtype=np.int64) for key, ids in grouped.items()}
+            return self._index
+
+    def sample(self, level, theme, seen=None, rng=random):
+        """
+        セッションにまだ出していない問題を1つ取り出す
+        Args:
+            level: 英語レベル
+            theme: 会話テーマ
+            seen: セッションの出題済みの問題の集合（("bank", ID) を追加する）
+            rng: 乱数生成器
+        Returns:
+            (問題文, PcmBuffer)。該当する問題がない・すべて出題済みの場合はNone
+        """
+        ids = self._load_index().get((level, theme))
+        if ids is None or len(ids) == 0:
+            return None
+        seen = seen if seen is not None else set()
+        with self._seen_lock:
+            # 乱数で選んだ位置が出題済みなら数回だけ引き直し、それでも見つからなければ未出題の問題を探す
+            problem_id = None
+            for _ in range(ct.PROBLEM_BANK_SAMPLE_RETRIES):
+                candidate = int(ids[rng.randrange(len(ids))])
+                if ("bank", candidate) not in seen:
+                    problem_id = candidate
+                    break
+            if problem_id is None:
+                unseen = [int(candidate) for candidate in ids if ("bank", int(candidate)) not in seen]
+                if not unseen:
+                    return None
+                problem_id = rng.choice(unseen)
+            # 音声を読み込む間に他のスレッドが同じ問題を選ばないよう、先に出題済みにする
+            seen.add(("bank", problem_id))
+        row = self._connect().execute("SELECT text, audio_file FROM problems WHERE id = ?", (problem_id,)).fetchone()
+        try:
+            with wave.open(os.path.join(self._audio_dir, row["audio_file"]), "rb") as wav_file:
+                audio_buffer = PcmBuffer(
+                    wav_file.readframes(wav_file.getnframes()),
+                    wav_file.getframerate(),
+                    wav_file.getsampwidth(),
+                    wav_file.getnchannels()
+                )
+        except (OSError, EOFError, wave.Error):
+            with self._seen_lock:
+                seen.discard(("bank", problem_id))
+            return None
+        return row["text"], audio_buffer
+
+
+def parse_sentences(text):
+    """
+    LLMの回答（1行1文）から問題文の候補を取り出す（番号・記号・引用符は取り除く）
+    """
+    sentences = []
+    for line in text.splitlines():
+        sentence = _LIST_MARKER.sub("", line).strip().strip("\"'“”")
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def build_pair(bank, level, theme, llm, openai_obj, target=ct.PROBLEM_BANK_TARGET_PER_PAIR,
+               batch_size=ct.PROBLEM_BANK_BATCH_SIZE, max_rounds=ct.PROBLEM_BANK_MAX_ROUNDS):
+    """
+    1組分の問題の生成（目標数に達するか、生成の回数が上限に達するまで繰り返す）
+    Returns:
+        生成・不採用・採用の件数
+    """
+    # アプリの実行時（出題）には使わないため、生成する時点で読み込む
+    from langchain.schema import SystemMessage, HumanMessage
+
+    stats = {"level": level, "theme": theme, "generated": 0, "out_of_range": 0, "duplicate": 0, "accepted": 0}
+    known = bank.existing_texts(level, theme)
+    template = ct.PROBLEM_TEMPLATES_BY_LEVEL[level].format(theme=theme)
+    for _ in range(max_rounds):
+        remaining = target - len(known)
+        if remaining <= 0:
+            break
+        reply = llm.invoke([
+            SystemMessage(content=template),
+            HumanMessage(content=ct.PROBLEM_BANK_BATCH_PROMPT.format(count=min(batch_size, remaining * 2)))
+        ]).content
+        candidates = parse_sentences(reply)
+        stats["generated"] += len(candidates)
+        fresh = []
+        for sentence in candidates:
+            if sentence in known or sentence in fresh:
+                stats["duplicate"] += 1
+            else:
+                fresh.append(sentence)
+        if not fresh:
+            continue
+        features = difficulty.compute_features(fresh)
+        accepted = difficulty.within_level(features, level)
+        stats["out_of_range"] += int((~accepted).sum())
+        for i in np.flatnonzero(accepted)[:remaining]:
+            audio = openai_obj.audio.speech.create(
+                model=ct.TTS_MODEL,
+                voice=ct.TTS_DEFAULT_VOICE,
+                input=fresh[i],
+                response_format="pcm"
+            )
+            row = {name: values[i] for name, values in features.items()}
+            if bank.add(level, theme, fresh[i], row, PcmBuffer(audio.content)) is not None:
+                known.add(fresh[i])
+                stats["accepted"] += 1
+    return stats
+
+
+def build(bank, llm, openai_obj, levels, themes, target=ct.PROBLEM_BANK_TARGET_PER_PAIR,
+          batch_size=ct.PROBLEM_BANK_BATCH_SIZE, concurrency=ct.PROBLEM_BANK_CONCURRENCY,
+          max_rounds=ct.PROBLEM_BANK_MAX_ROUNDS, on_done=None):
+    """
+    すべての (英語レベル, 会話テーマ) の組の問題を、同時に concurrency 組まで並行して生成
+    Args:
+        on_done: 1組終わるごとに結果を受け取る関数
+    Returns:
+        組ごとの結果のリスト
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="problem-bank") as executor:
+        futures = [
+            executor.submit(build_pair, bank, level, theme, llm, openai_obj, target, batch_size, max_rounds)
+            for level in levels for theme in themes
+        ]
+        for future in as_completed(futures):
+            stats = future.result()
+            results.append(stats)
+            if on_done is not None:
+                on_done(stats)
+    return results
+
+
+_bank = None
+_bank_lock = threading.Lock()
+
+
+def get_problem_bank():
+    """
+    プロセス全体で共有する問題バンクの取得（一括生成をしていない場合はNone）
+    """
+    global _bank
+    with _bank_lock:
+        if _bank is None and ct.PROBLEM_BANK_ENABLED and os.path.exists(ct.PROBLEM_BANK_DB_PATH):
+            _bank = ProblemBank()
+        return _bank
+
+
+if __name__ == "__main__":
+    import api_clients
+
+    parser = argparse.ArgumentParser(description="シャドーイング・ディクテーション用の問題バンクの一括生成")
+    parser.add_argument("--levels", nargs="+", default=ct.ENGLISH_LEVEL_OPTION, choices=ct.ENGLISH_LEVEL_OPTION)
+    parser.add_argument("--themes", nargs="+", default=ct.CONVERSATION_THEMES, choices=ct.CONVERSATION_THEMES)
+    parser.add_argument("--target", type=int, default=ct.PROBLEM_BANK_TARGET_PER_PAIR, help="1組あたりの問題数")
+    parser.add_argument("--batch-size", type=int, default=ct.PROBLEM_BANK_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=ct.PROBLEM_BANK_CONCURRENCY)
+    parser.add_argument("--max-rounds", type=int, default=ct.PROBLEM_BANK_MAX_ROUNDS)
+    parser.add_argument("--db", default=ct.PROBLEM_BANK_DB_PATH)
+    parser.add_argument("--audio-dir", default=ct.PROBLEM_BANK_AUDIO_DIR)
+    parser.add_argument("--base-url", default=ct.MOCK_OPENAI_BASE_URL, help="OpenAI APIの代替サーバーの接続先")
+    args = parser.parse_args()
+
+    api_key = "mock" if args.base_url else os.environ["OPENAI_API_KEY"]
+    started = time.perf_counter()
+    results = build(
+        ProblemBank(args.db, args.audio_dir),
+        api_clients.get_chat_model(api_key, args.base_url),
+        api_clients.get_openai_client(api_key, args.base_url),
+        args.levels, args.themes, args.target, args.batch_size, args.concurrency, args.max_rounds,
+        on_done=lambda stats: print(
+            f"{stats['level']} / {stats['theme']}: accepted {stats['accepted']}, "
+            f"out of range {stats['out_of_range']}, duplicate {stats['duplicate']} (generated {stats['generated']})"
+        )
+    )
+    generated = sum(stats["generated"] for stats in results)
+    accepted = sum(stats["accepted"] for stats in results)
+    print(f"\n{accepted} / {generated} sentences accepted in {time.perf_counter() - started:.1f} s")
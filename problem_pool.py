@@ -0,0 +1,183 @@
+"""
+シャドーイング・ディクテーション用の問題（問題文 + 音声）をセッション間で共有するプール
+問題文は (英語レベル, 会話テーマ) だけで決まりユーザーに依存しないため、生成と音声合成の結果をプロセス全体で使い回す
+- 同じキーで同時に不足した場合は、実行中の生成を待って結果を共有する（同じ問題を重ねて生成しない）
+- セッションごとに出題済みの問題を記録し、同じセッションには同じ問題を2度出さない
+- 残りの未出題の問題が少なくなったら補充し、キーごと・全体の上限を超えたら古い問題から捨てる
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from latency import run_in_context
+import constants as ct
+
+
+class PooledProblem:
+    __slots__ = ("problem_id", "problem", "audio_buffer", "created_at", "served")
+
+    def __init__(self, problem_id, problem, audio_buffer):
+        self.problem_id = problem_id
+        self.problem = problem
+        self.audio_buffer = audio_buffer
+        self.created_at = time.monotonic()
+        self.served = 0
+
+
+class ProblemPool:
+    """
+    (英語レベル, 会話テーマ) ごとの出題可能な問題の集まり
+    """
+    def __init__(self, max_per_key=ct.PROBLEM_POOL_MAX_PER_KEY, max_total=ct.PROBLEM_POOL_MAX_TOTAL,
+                 min_unseen=ct.PROBLEM_POOL_MIN_UNSEEN, max_in_flight=ct.PROBLEM_POOL_MAX_IN_FLIGHT_PER_KEY,
+                 workers=ct.PROBLEM_POOL_WORKERS):
+        """
+        Args:
+            max_per_key: キーごとに保持する問題数の上限
+            max_total: 全キー合計の問題数の上限
+            min_unseen: 取り出した後にセッションの未出題の問題がこの数を下回ったら補充を始める
+            max_in_flight: キーごとに同時に生成する問題数の上限
+            workers: 生成に使うスレッド数
+        """
+        self.max_per_key = max_per_key
+        self.max_total = max_total
+        self.min_unseen = min_unseen
+        self.max_in_flight = max_in_flight
+        self._problems = {}
+        self._in_flight = {}
+        self._total = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="problem-pool")
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.generated = 0
+        self.evicted = 0
+
+    def take(self, level, theme, seen, generate, timeout=ct.PROBLEM_PREFETCH_WAIT_SEC):
+        """
+        セッションにまだ出していない問題を1つ取り出す（なければ生成を待つ）
+        Args:
+            level: 英語レベル
+            theme: 会話テーマ
+            seen: セッションの出題済みの問題IDの集合（取り出した問題のIDを追加する）
+            generate: (level, theme) を受け取り (問題文, PcmBuffer) を返す関数（新たに生成する場合に使用）
+            timeout: 生成を待つ最大秒数
+        Returns:
+            (問題文, PcmBuffer)
+        """
+        key = (level, theme)
+        deadline = time.monotonic() + timeout
+        missed = False
+        while True:
+            with self._lock:
+                entry = self._pick(key, seen)
+                if entry is not None:
+                    if missed:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+                    self._refill_if_needed(key, seen, generate)
+                    return entry.problem, entry.audio_buffer
+                in_flight = self._pending(key)
+                if not missed and in_flight:
+                    # 他のセッションが始めた生成の結果を待つ
+                    self.coalesced += 1
+                missed = True
+                if not in_flight:
+                    in_flight = [self._start(key, generate)]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No problem became available for {key} within {timeout} seconds")
+            done, _ = wait(in_flight, remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                # 生成に失敗した場合は呼び出し元に伝える
+                future.result()
+
+    def _pick(self, key, seen):
+        for entry in self._problems.get(key, ()):
+            if entry.problem_id not in seen:
+                seen.add(entry.problem_id)
+                entry.served += 1
+                return entry
+        return None
+
+    def _refill_if_needed(self, key, seen, generate):
+        """
+        セッションの未出題の問題が少なければ、次の取り出しに備えて生成を始める
+        """
+        unseen = sum(1 for entry in self._problems.get(key, ()) if entry.problem_id not in seen)
+        in_flight = len(self._pending(key))
+        for _ in range(min(self.min_unseen - unseen - in_flight, self.max_in_flight - in_flight)):
+            self._start(key, generate)
+
+    def _pending(self, key):
+        """
+        キーの実行中の生成の一覧（完了したものは取り除く）
+        """
+        in_flight = [future for future in self._in_flight.get(key, ()) if not future.done()]
+        self._in_flight[key] = in_flight
+        return in_flight
+
+    def _start(self, key, generate):
+        future = self._executor.submit(run_in_context(self._produce), key, generate)
+        self._in_flight.setdefault(key, []).append(future)
+        return future
+
+    def _produce(self, key, generate):
+        problem, audio_buffer = generate(*key)
+        with self._lock:
+            entry = PooledProblem(next(self._ids), problem, audio_buffer)
+            self._problems.setdefault(key, deque()).append(entry)
+            self._total += 1
+            self.generated += 1
+            self._evict(key)
+        return entry
+
+    def _evict(self, key):
+        """
+        上限を超えた分を古い問題から捨てる（キーごと → 全体の順）
+        """
+        problems = self._problems[key]
+        while len(problems) > self.max_per_key:
+            problems.popleft()
+            self._total -= 1
+            self.evicted += 1
+        while self._total > self.max_total:
+            oldest_key = min(
+                (k for k, entries in self._problems.items() if entries),
+                key=lambda k: self._problems[k][0].created_at
+            )
+            self._problems[oldest_key].popleft()
+            self._total -= 1
+            self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": sum(1 for entries in self._problems.values() if entries),
+                "problems": self._total,
+                "in_flight": sum(len(self._pending(key)) for key in list(self._in_flight)),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "generated": self.generated,
+                "evicted": self.evicted,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_problem_pool():
+    """
+    プロセス全体で共有する問題プールの取得
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProblemPool()
+        return _pool
@@ -0,0 +1,338 @@
+"""
+音声信号レベルの発音分析（API呼び出しなし）
+ユーザーの録音と、同じ問題文のTTS音声（お手本）をフレーム特徴量で比較する
+- 特徴量: 対数エネルギー、ケプストラム（帯域エネルギーのDCT）、ピッチ（自己相関）
+- DTW（動的時間伸縮）で2つの音声の時間対応を求め、単語ごとの区間に割り当てる
+- お手本の単語区間は、発話区間を単語の音節数の比で配分した推定値
+"""
+import re
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import dct, irfft, rfft
+from scipy.signal import medfilt
+from scipy.spatial.distance import cdist
+from audio_preprocess import to_mono_samples
+import constants as ct
+
+_WORD = re.compile(r"[A-Za-z0-9']+")
+_VOWEL_GROUP = re.compile(r"[aeiouy]+")
+_MEL_BANDS = 26
+_CEPSTRUM_COEFFS = 12
+_PITCH_MIN_HZ = 75
+_PITCH_MAX_HZ = 400
+# 自己相関のピークがこの値以上のフレームを有声とみなす
+_VOICING_THRESHOLD = 0.45
+# 単語を強勢ありとみなす基準（単語ごとの中央値との差）
+_STRESS_ENERGY_DB = 1.5
+_STRESS_PITCH_SEMITONES = 2.0
+
+
+def _mel_filterbank(n_fft, sample_rate, n_bands=_MEL_BANDS):
+    def to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    edges = to_hz(np.linspace(to_mel(0), to_mel(sample_rate / 2), n_bands + 2))
+    bins = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bins - lower) / (center - lower)
+    falling = (upper - bins) / (upper - center)
+    return np.maximum(0, np.minimum(rising, falling))
+
+
+def extract_features(samples, sample_rate=ct.PRONUNCIATION_SAMPLE_RATE,
+                     frame_ms=ct.PRONUNCIATION_FRAME_MS, hop_ms=ct.PRONUNCIATION_HOP_MS):
+    """
+    フレームごとの特徴量（全フレームを一括で計算）
+    Returns:
+        energy_db, cepstrum, pitch_hz（無声フレームは0）, speech（発話フレームかどうか）をまとめた辞書
+    """
+    frame_len = int(sample_rate * frame_ms / 1000)
+    hop = int(sample_rate * hop_ms / 1000)
+    if len(samples) < frame_len:
+        samples = np.pad(samples, (0, frame_len - len(samples)))
+    frames = sliding_window_view(samples, frame_len)[::hop]
+    windowed = frames * np.hanning(frame_len).astype(np.float32)
+
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+    n_fft = 1 << (frame_len - 1).bit_length()
+    power = np.abs(rfft(windowed, n=n_fft, axis=1)) ** 2
+    band_energy = power @ _mel_filterbank(n_fft, sample_rate).T
+    cepstrum = dct(np.log(band_energy + 1e-10), type=2, norm="ortho", axis=1)[:, 1:_CEPSTRUM_COEFFS + 1]
+
+    # 自己相関（FFT経由）のピーク位置からピッチを推定
+    spectrum = rfft(frames - frames.mean(axis=1, keepdims=True), n=2 * frame_len, axis=1)
+    autocorr = irfft(np.abs(spectrum) ** 2, axis=1)[:, :frame_len]
+    autocorr /= autocorr[:, :1] + 1e-10
+    min_lag = int(sample_rate / _PITCH_MAX_HZ)
+    max_lag = min(int(sample_rate / _PITCH_MIN_HZ), frame_len - 1)
+    lags = np.argmax(autocorr[:, min_lag:max_lag], axis=1) + min_lag
+    peaks = autocorr[np.arange(len(frames)), lags]
+
+    # 発話区間：ノイズフロアと最大値の両方を基準にしたしきい値
+    threshold = max(np.percentile(energy_db, 10) + 12, energy_db.max() - 45)
+    speech = medfilt((energy_db > threshold).astype(np.float32), 5) > 0
+    pitch_hz = np.where(speech & (peaks > _VOICING_THRESHOLD), sample_rate / lags, 0.0)
+
+    return {
+        "energy_db": energy_db,
+        "cepstrum": cepstrum,
+        "pitch_hz": pitch_hz,
+        "speech": speech,
+        "hop_ms": hop_ms,
+    }
+
+
+def _dtw_matrix(features, speech_range):
+    """
+    DTW用の特徴量行列（発話区間のみ、発話ごとに正規化して話者・録音環境の差を抑える）
+    """
+    start, end = speech_range
+    cepstrum = features["cepstrum"][start:end]
+    cepstrum = cepstrum - cepstrum.mean(axis=0)
+    energy = features["energy_db"][start:end]
+    energy = (energy - energy.mean()) / (energy.std() + 1e-6)
+    pitch = features["pitch_hz"][start:end]
+    log_pitch = np.zeros_like(pitch)
+    voiced = pitch > 0
+    if voiced.any():
+        values = np.log2(pitch[voiced])
+        log_pitch[voiced] = (values - values.mean()) / (values.std() + 1e-6)
+    return np.column_stack([cepstrum, 2.0 * energy, 0.5 * log_pitch])
+
+
+def dtw_path(reference, query, band=ct.PRONUNCIATION_DTW_BAND):
+    """
+    DTWの最適経路（累積コストは反対角線ごとにまとめて計算する）
+    Args:
+        reference: お手本の特徴量行列（フレーム数 × 次元）
+        query: ユーザーの特徴量行列
+        band: 対角線からの許容幅（系列長に対する比率、Sakoe-Chibaバンド）
+    Returns:
+        (お手本のフレーム番号の配列, ユーザーのフレーム番号の配列, フレームあたりの平均コスト)
+    """
+    n, m = len(reference), len(query)
+    cost = cdist(reference, query)
+    rows = np.arange(n)[:, None] / max(n - 1, 1)
+    cols = np.arange(m)[None, :] / max(m - 1, 1)
+    cost[np.abs(rows - cols) > band] = np.inf
+
+    acc = np.full((n + 1, m + 1), np.inf)
+    acc[0, 0] = 0.0
+    for diagonal in range(2, n + m + 1):
+        i = np.arange(max(1, diagonal - m), min(n, diagonal - 1) + 1)
+        j = diagonal - i
+        acc[i, j] = cost[i - 1, j - 1] + np.minimum(np.minimum(acc[i - 1, j - 1], acc[i - 1, j]), acc[i, j - 1])
+
+    path_i, path_j = [], []
+    i, j = n, m
+    while i > 0 and j > 0:
+        path_i.append(i - 1)
+        path_j.append(j - 1)
+        step = np.argmin((acc[i - 1, j - 1], acc[i - 1, j], acc[i, j - 1]))
+        if step == 0:
+            i, j = i - 1, j - 1
+        elif step == 1:
+            i -= 1
+        else:
+            j -= 1
+    return np.array(path_i[::-1]), np.array(path_j[::-1]), acc[n, m] / (n + m)
+
+
+def _speech_range(speech):
+    indices = np.flatnonzero(speech)
+    if len(indices) == 0:
+        return None
+    return int(indices[0]), int(indices[-1]) + 1
+
+
+def _pauses(speech, speech_range, min_frames):
+    """
+    発話区間内の無音（ポーズ）の (開始フレーム, 終了フレーム) のリスト
+    """
+    start, end = speech_range
+    silent = ~speech[start:end]
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], silent.astype(np.int8), [0]))))
+    return [(start + a, start + b) for a, b in zip(edges[::2], edges[1::2]) if b - a >= min_frames]
+
+
+def _syllables(word):
+    return max(1, len(_VOWEL_GROUP.findall(word.lower())))
+
+
+def _reference_word_windows(words, speech, speech_range):
+    """
+    お手本の単語区間の推定（発話フレームだけをつないだ時間軸を、音節数の比で単語に配分する）
+    """
+    start, end = speech_range
+    speech_frames = np.flatnonzero(speech[start:end]) + start
+    weights = np.array([_syllables(word) + 0.5 for word in words])
+    bounds = np.concatenate(([0], np.cumsum(weights) / weights.sum())) * (len(speech_frames) - 1)
+    positions = speech_frames[np.round(bounds).astype(int)]
+    windows = []
+    for idx in range(len(words)):
+        window_start = positions[idx] if idx == 0 else positions[idx] + 1
+        windows.append((int(window_start), int(max(window_start + 1, positions[idx + 1] + 1))))
+    windows[0] = (start, windows[0][1])
+    windows[-1] = (windows[-1][0], end)
+    return windows
+
+
+def _word_prosody(features, window, speech_median_db, median_pitch):
+    start, end = window
+    energy_rel = float(features["energy_db"][start:end].mean() - speech_median_db)
+    pitch = features["pitch_hz"][start:end]
+    voiced = pitch[pitch > 0]
+    pitch_rel = float(12 * np.log2(voiced.max() / median_pitch)) if len(voiced) and median_pitch else 0.0
+    return energy_rel, pitch_rel
+
+
+def _prosody_baseline(features, speech_range):
+    start, end = speech_range
+    speech = features["speech"][start:end]
+    energy = features["energy_db"][start:end][speech]
+    pitch = features["pitch_hz"][start:end]
+    voiced = pitch[pitch > 0]
+    return float(np.median(energy)), float(np.median(voiced)) if len(voiced) else 0.0
+
+
+def _pause_after_word(pauses, centers):
+    """
+    ポーズの直前にある単語の番号の集合
+    """
+    indices = set()
+    for pause_start, pause_end in pauses:
+        idx = int(np.searchsorted(centers, (pause_start + pause_end) / 2)) - 1
+        if 0 <= idx < len(centers) - 1:
+            indices.add(idx)
+    return indices
+
+
+def analyze(reference_audio, user_audio, text):
+    """
+    お手本の音声とユーザーの録音の比較
+    Args:
+        reference_audio: お手本（TTS）のPcmBuffer
+        user_audio: ユーザーの録音のPcmBuffer
+        text: 問題文
+    Returns:
+        話速、ポーズ、強勢、単語ごとのタイミングのずれ（ミリ秒）をまとめた辞書
+        （どちらかの音声から発話を検出できない場合はNone）
+    """
+    words = _WORD.findall(text)
+    if not words:
+        return None
+    ref = extract_features(to_mono_samples(reference_audio, ct.PRONUNCIATION_SAMPLE_RATE))
+    usr = extract_features(to_mono_samples(user_audio, ct.PRONUNCIATION_SAMPLE_RATE))
+    ref_range = _speech_range(ref["speech"])
+    usr_range = _speech_range(usr["speech"])
+    if ref_range is None or usr_range is None:
+        return None
+    hop_ms = ref["hop_ms"]
+    min_pause_frames = max(1, int(ct.PRONUNCIATION_MIN_PAUSE_MS / hop_ms))
+
+    path_ref, path_usr, dtw_cost = dtw_path(_dtw_matrix(ref, ref_range), _dtw_matrix(usr, usr_range))
+    path_ref += ref_range[0]
+    path_usr += usr_range[0]
+
+    ref_windows = _reference_word_windows(words, ref["speech"], ref_range)
+    usr_windows = []
+    for start, end in ref_windows:
+        matched = path_usr[(path_ref >= start) & (path_ref < end)]
+        usr_windows.append((int(matched.min()), int(matched.max()) + 1) if len(matched) else usr_windows[-1])
+
+    # 全体の話速の違いを除いたうえで、単語ごとのずれを求める
+    ref_span = ref_range[1] - ref_range[0]
+    usr_span = usr_range[1] - usr_range[0]
+    tempo = usr_span / ref_span
+    ref_baseline = _prosody_baseline(ref, ref_range)
+    usr_baseline = _prosody_baseline(usr, usr_range)
+
+    word_rows = []
+    for word, ref_window, usr_window in zip(words, ref_windows, usr_windows):
+        ref_onset = (ref_window[0] - ref_range[0]) * hop_ms
+        usr_onset = (usr_window[0] - usr_range[0]) * hop_ms
+        ref_duration = (ref_window[1] - ref_window[0]) * hop_ms
+        usr_duration = (usr_window[1] - usr_window[0]) * hop_ms
+        ref_energy, ref_pitch = _word_prosody(ref, ref_window, *ref_baseline)
+        usr_energy, usr_pitch = _word_prosody(usr, usr_window, *usr_baseline)
+        ref_stressed = ref_energy >= _STRESS_ENERGY_DB or ref_pitch >= _STRESS_PITCH_SEMITONES
+        usr_stressed = usr_energy >= _STRESS_ENERGY_DB or usr_pitch >= _STRESS_PITCH_SEMITONES
+        word_rows.append({
+            "word": word,
+            "reference_onset_ms": ref_onset,
+            "reference_duration_ms": ref_duration,
+            "user_onset_ms": usr_onset,
+            "user_duration_ms": usr_duration,
+            "timing_deviation_ms": usr_onset - ref_onset * tempo,
+            "duration_deviation_ms": usr_duration - ref_duration * tempo,
+            "reference_stressed": ref_stressed,
+            "user_stressed": usr_stressed,
+            "energy_diff_db": usr_energy - ref_energy,
+        })
+
+    ref_pauses = _pauses(ref["speech"], ref_range, min_pause_frames)
+    usr_pauses = _pauses(usr["speech"], usr_range, min_pause_frames)
+    ref_pause_words = _pause_after_word(ref_pauses, [sum(w) / 2 for w in ref_windows])
+    usr_pause_words = _pause_after_word(usr_pauses, [sum(w) / 2 for w in usr_windows])
+
+    syllables = sum(_syllables(word) for word in words)
+
+    def rate(features, speech_range, pauses):
+        span_ms = (speech_range[1] - speech_range[0]) * hop_ms
+        articulation_ms = int(features["speech"][speech_range[0]:speech_range[1]].sum()) * hop_ms
+        return {
+            "words_per_minute": len(words) / (span_ms / 60000),
+            "syllables_per_second": syllables / (articulation_ms / 1000) if articulation_ms else 0.0,
+            "speech_ms": span_ms,
+            "pause_count": len(pauses),
+            "pause_ms": sum(end - start for start, end in pauses) * hop_ms,
+        }
+
+    return {
+        "reference": rate(ref, ref_range, ref_pauses),
+        "user": rate(usr, usr_range, usr_pauses),
+        "tempo_ratio": tempo,
+        "dtw_cost": float(dtw_cost),
+        "mean_abs_timing_deviation_ms": float(np.mean([abs(row["timing_deviation_ms"]) for row in word_rows])),
+        "stress_match_rate": float(np.mean([row["reference_stressed"] == row["user_stressed"] for row in word_rows])),
+        "missing_pauses": [words[idx] for idx in sorted(ref_pause_words - usr_pause_words)],
+        "extra_pauses": [words[idx] for idx in sorted(usr_pause_words - ref_pause_words)],
+        "words": word_rows,
+    }
+
+
+def format_pronunciation_markdown(result):
+    """
+    発音分析結果の表示用Markdown
+    """
+    ref, usr = result["reference"], result["user"]
+    lines = [
+        "**【発音分析（音声比較）】**",
+        "",
+        f"- 話速：{usr['syllables_per_second']:.1f} 音節/秒（お手本 {ref['syllables_per_second']:.1f}）、"
+        f"発話時間はお手本の {result['tempo_ratio']:.0%}",
+        f"- ポーズ：{usr['pause_count']} 回・計 {usr['pause_ms']} ms（お手本 {ref['pause_count']} 回・計 {ref['pause_ms']} ms）",
+        f"- タイミングのずれ（平均）：{result['mean_abs_timing_deviation_ms']:.0f} ms",
+        f"- 強勢の一致率：{result['stress_match_rate']:.0%}",
+    ]
+    if result["missing_pauses"]:
+        lines.append(f"- 区切りが抜けた箇所：{', '.join(result['missing_pauses'])} の後")
+    if result["extra_pauses"]:
+        lines.append(f"- 余分な区切り：{', '.join(result['extra_pauses'])} の後")
+    lines += [
+        "",
+        "| 単語 | お手本 (ms) | あなた (ms) | タイミングのずれ (ms) | 強勢 |",
+        "|---|---|---|---|---|",
+    ]
+    for row in result["words"]:
+        stress = "○" if row["reference_stressed"] == row["user_stressed"] else (
+            "弱い" if row["reference_stressed"] else "強すぎ")
+        lines.append(
+            f"| {row['word']} | {row['reference_duration_ms']:.0f} | {row['user_duration_ms']:.0f} "
+            f"| {row['timing_deviation_ms']:+.0f} | {stress} |"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,155 @@
+"""
+ディクテーション・シャドーイングのローカル採点
+問題文と回答を単語に分割・正規化し、単語単位のアラインメントから WER（単語誤り率）と差分を求める
+LLMを呼ばないため、回答直後に結果を表示できる
+"""
+import re
+import unicodedata
+
+_CONTRACTIONS = {
+    "i'm": "i am", "you're": "you are", "we're": "we are", "they're": "they are",
+    "he's": "he is", "she's": "she is", "it's": "it is", "that's": "that is",
+    "there's": "there is", "what's": "what is", "let's": "let us",
+    "i've": "i have", "you've": "you have", "we've": "we have", "they've": "they have",
+    "i'll": "i will", "you'll": "you will", "we'll": "we will", "they'll": "they will",
+    "he'll": "he will", "she'll": "she will", "it'll": "it will",
+    "i'd": "i would", "you'd": "you would", "we'd": "we would", "they'd": "they would",
+    "don't": "do not", "doesn't": "does not", "didn't": "did not", "can't": "cannot",
+    "couldn't": "could not", "won't": "will not", "wouldn't": "would not",
+    "shouldn't": "should not", "isn't": "is not", "aren't": "are not", "wasn't": "was not",
+    "weren't": "were not", "haven't": "have not", "hasn't": "has not", "hadn't": "had not",
+}
+_NUMBERS = {
+    "0": "zero", "1": "one", "2": "two", "3": "three", "4": "four", "5": "five",
+    "6": "six", "7": "seven", "8": "eight", "9": "nine", "10": "ten",
+    "11": "eleven", "12": "twelve", "20": "twenty", "30": "thirty", "100": "hundred",
+}
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def tokenize(text):
+    """
+    採点用の単語列に変換（小文字化、記号の除去、短縮形の展開、数字の読みへの変換）
+    Args:
+        text: 英文
+    Returns:
+        単語のリスト
+    """
+    text = unicodedata.normalize("NFKC", text).lower().replace("’", "'").replace("‘", "'")
+    words = []
+    for word in _WORD.findall(text):
+        word = _CONTRACTIONS.get(word, word)
+        words.extend(_NUMBERS.get(part, part) for part in word.split())
+    return words
+
+
+def align(reference, hypothesis):
+    """
+    編集距離が最小となる単語単位のアラインメント
+    Args:
+        reference: 問題文の単語リスト
+        hypothesis: 回答の単語リスト
+    Returns:
+        (操作, 問題文の単語, 回答の単語) のリスト。操作は equal / substitute / delete / insert
+    """
+    rows, cols = len(reference) + 1, len(hypothesis) + 1
+    cost = [[0] * cols for _ in range(rows)]
+    for i in range(rows):
+        cost[i][0] = i
+    for j in range(cols):
+        cost[0][j] = j
+    for i in range(1, rows):
+        ref_word = reference[i - 1]
+        prev_row, row = cost[i - 1], cost[i]
+        for j in range(1, cols):
+            if ref_word == hypothesis[j - 1]:
+                row[j] = prev_row[j - 1]
+            else:
+                row[j] = 1 + min(prev_row[j - 1], prev_row[j], row[j - 1])
+
+    ops = []
+    i, j = len(reference), len(hypothesis)
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and reference[i - 1] == hypothesis[j - 1] and cost[i][j] == cost[i - 1][j - 1]:
+            ops.append(("equal", reference[i - 1], hypothesis[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and j > 0 and cost[i][j] == cost[i - 1][j - 1] + 1:
+            ops.append(("substitute", reference[i - 1], hypothesis[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and cost[i][j] == cost[i - 1][j] + 1:
+            ops.append(("delete", reference[i - 1], None))
+            i -= 1
+        else:
+            ops.append(("insert", None, hypothesis[j - 1]))
+            j -= 1
+    ops.reverse()
+    return ops
+
+
+def score_answer(problem, answer):
+    """
+    問題文と回答の比較
+    Args:
+        problem: 問題文
+        answer: ユーザーの回答
+    Returns:
+        WER、正解率、単語ごとの差分などをまとめた辞書
+    """
+    reference = tokenize(problem)
+    ops = align(reference, tokenize(answer))
+    counts = {"equal": 0, "substitute": 0, "delete": 0, "insert": 0}
+    for op, _, _ in ops:
+        counts[op] += 1
+    errors = counts["substitute"] + counts["delete"] + counts["insert"]
+    wer = errors / len(reference) if reference else float(errors > 0)
+    return {
+        "wer": wer,
+        "accuracy": counts["equal"] / len(reference) if reference else 1.0,
+        "reference_words": len(reference),
+        "counts": counts,
+        "ops": ops,
+    }
+
+
+def format_diff(result):
+    """
+    差分を1行のMarkdownで表現（抜けた単語は取り消し線、追加された単語は太字）
+    """
+    parts = []
+    for op, ref_word, hyp_word in result["ops"]:
+        if op == "equal":
+            parts.append(ref_word)
+        elif op == "substitute":
+            parts.append(f"~~{ref_word}~~ → **{hyp_word}**")
+        elif op == "delete":
+            parts.append(f"~~{ref_word}~~")
+        else:
+            parts.append(f"**{hyp_word}**")
+    return " ".join(parts)
+
+
+def format_score_markdown(result):
+    """
+    ローカル採点結果の表示用Markdown
+    """
+    counts = result["counts"]
+    return (
+        f"**【ローカル採点】** 正解率 {result['accuracy']:.0%}（WER {result['wer']:.0%}）\n\n"
+        f"{format_diff(result)}\n\n"
+        f"誤った単語 {counts['substitute']} / 抜けた単語 {counts['delete']} / 追加された単語 {counts['insert']}"
+    )
+
+
+def format_diff_for_prompt(result):
+    """
+    LLM評価のプロンプトに渡す差分の要約（単語の正確性はここで確定させ、LLMには分析させない）
+    """
+    lines = [f"WER: {result['wer']:.2f}"]
+    for op, ref_word, hyp_word in result["ops"]:
+        if op == "substitute":
+            lines.append(f"- 誤り: {ref_word} → {hyp_word}")
+        elif op == "delete":
+            lines.append(f"- 抜け: {ref_word}")
+        elif op == "insert":
+            lines.append(f"- 追加: {hyp_word}")
+    return "\n".join(lines)
@@ -0,0 +1,165 @@
+"""
+LLMのストリーミング出力を文単位に区切り、文ごとに音声合成・再生するパイプライン
+1文目の合成・再生は、2文目以降の生成を待たずに始まる
+"""
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from latency import run_in_context
+import constants as ct
+
+# 文末記号（英語・日本語）の直後に空白・改行が来た位置を文の区切りとみなす
+_SENTENCE_END = re.compile(r"[.!?。！？]+[\"')\]]*(?=\s)|[。！？]+|\n+")
+# 文末のピリオドを区切りとみなさない略語
+_ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "vs.", "etc.", "e.g.", "i.e.", "u.s.", "a.m.", "p.m."}
+
+
+class SentenceSplitter:
+    """
+    少しずつ届くテキストから、完結した文を取り出す
+    短すぎる文（「Oh!」など）は次の文とまとめて1回の音声合成にする
+    """
+    def __init__(self, min_chars=ct.SENTENCE_MIN_CHARS):
+        self._buffer = ""
+        self._min_chars = min_chars
+
+    def feed(self, text):
+        """
+        テキストの追加
+        Args:
+            text: 新たに届いたテキスト
+        Returns:
+            完結した文のリスト
+        """
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start:match.end()].strip()
+            last_word = candidate.rsplit(None, 1)[-1].lower() if candidate else ""
+            if last_word in _ABBREVIATIONS or len(candidate) < self._min_chars:
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """
+        残りのテキストを最後の文として取り出す
+        """
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return rest
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_sentence_tts_executor():
+    """
+    プロセス全体で共有する文ごとの音声合成用のスレッドプールの取得
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ct.SENTENCE_TTS_WORKERS, thread_name_prefix="sentence-tts")
+        return _executor
+
+
+class SentenceSpeechPipeline:
+    """
+    文ごとの音声合成を並行して進め、再生は専用スレッドで文の順番どおりに行う
+    音声合成は共有のスレッドプールで行い、1つのパイプラインが同時に合成する文は max_ahead までとする
+    """
+    def __init__(self, synthesize, play, max_ahead=ct.SENTENCE_TTS_MAX_AHEAD, fallback=None, executor=None):
+        """
+        Args:
+            synthesize: 文を受け取り、再生可能な音声を返す関数
+            play: synthesizeの戻り値を受け取って再生する関数
+            max_ahead: 同時に音声合成する文の数
+            fallback: 合成・再生に失敗した文を受け取って読み上げ直す関数（次の文を再生する前に、その文の位置で呼ぶ）
+            executor: 音声合成に使うスレッドプール（省略時は共有のもの）
+        """
+        self._synthesize = synthesize
+        self._play = play
+        self._fallback = fallback
+        self._max_ahead = max_ahead
+        self._executor = executor if executor is not None else get_sentence_tts_executor()
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._in_flight = 0
+        self._queue = queue.Queue()
+        self._player = threading.Thread(target=run_in_context(self._play_loop), daemon=True)
+        self._player.start()
+        self.played = []
+        # 失敗した文と例外の組のリスト
+        self.errors = []
+        # 失敗したあと、fallbackで読み上げ直せた文のリスト
+        self.respoken = []
+        # fallbackでも読み上げられなかった文と例外の組のリスト
+        self.fallback_errors = []
+
+    def add(self, sentence):
+        slot = Future()
+        with self._lock:
+            self._pending.append((run_in_context(self._synthesize_into), sentence, slot))
+            self._submit_pending()
+        self._queue.put((sentence, slot))
+
+    def _submit_pending(self):
+        # 呼び出し元でロックを取得していること
+        while self._pending and self._in_flight < self._max_ahead:
+            task, sentence, slot = self._pending.popleft()
+            self._in_flight += 1
+            self._executor.submit(task, sentence, slot)
+
+    def _synthesize_into(self, sentence, slot):
+        try:
+            slot.set_result(self._synthesize(sentence))
+        except Exception as e:
+            slot.set_exception(e)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._submit_pending()
+
+    def close(self):
+        """
+        文の追加終了（再生スレッドは残りの文を再生し終えると終了する）
+        """
+        self._queue.put(None)
+
+    def join(self, timeout=None):
+        """
+        すべての文の再生完了を待つ
+        Returns:
+            再生した音声のリスト
+        """
+        self._player.join(timeout)
+        return self.played
+
+    def _play_loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            sentence, slot = entry
+            try:
+                self.played.append(self._play(slot.result()))
+            except Exception as e:
+                # 1文の失敗で残りの読み上げを止めず、失敗した文は次の文より先にその位置で読み上げ直す
+                self.errors.append((sentence, e))
+                self._respeak(sentence)
+
+    def _respeak(self, sentence):
+        if self._fallback is None:
+            return
+        try:
+            self.played.append(self._fallback(sentence))
+            self.respoken.append(sentence)
+        except Exception as e:
+            self.fallback_errors.append((sentence, e))
@@ -0,0 +1,142 @@
+"""
+WSOLA（波形類似度に基づく重畳加算）による音程を保った再生速度変換
+PCMをブロック単位で受け取り、変換できた分から順に返すため、再生しながら処理できる
+"""
+import numpy as np
+import constants as ct
+
+
+class WsolaStretcher:
+    """
+    16bitモノラルPCMの再生速度を、音程を変えずに変換する
+    process() に入力ブロックを渡すと、確定した出力を返す。最後に flush() で残りを取り出す
+    """
+    def __init__(self, speed, sample_rate=ct.TTS_PCM_SAMPLE_RATE,
+                 frame_ms=ct.TIME_STRETCH_FRAME_MS, tolerance_ms=ct.TIME_STRETCH_TOLERANCE_MS):
+        self.speed = speed
+        # 50%オーバーラップのハン窓は足し合わせると1になる
+        self._frame = int(sample_rate * frame_ms / 1000) // 2 * 2
+        self._synthesis_hop = self._frame // 2
+        self._analysis_hop = self._synthesis_hop * speed
+        self._tolerance = int(sample_rate * tolerance_ms / 1000)
+        self._window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self._frame) / self._frame)).astype(np.float32)
+        self._input = np.zeros(0, dtype=np.float32)
+        # self._input[0] が入力全体の何サンプル目にあたるか
+        self._input_offset = 0
+        self._input_total = 0
+        self._output = np.zeros(self._frame, dtype=np.float32)
+        self._output_total = 0
+        self._frame_index = 0
+        self._prev_pos = None
+
+    def _required_end(self, nominal):
+        end = nominal + self._tolerance + self._frame
+        if self._prev_pos is not None:
+            end = max(end, self._prev_pos + self._synthesis_hop + self._frame)
+        return end
+
+    def _segment(self, start, length):
+        start -= self._input_offset
+        return self._input[start:start + length]
+
+    def _best_position(self, nominal):
+        """
+        直前フレームの自然な続きと最も波形が似ている位置を、許容範囲内から探す
+        """
+        if self._prev_pos is None:
+            return nominal
+        template = self._segment(self._prev_pos + self._synthesis_hop, self._frame)
+        low = max(nominal - self._tolerance, self._input_offset)
+        high = nominal + self._tolerance
+        region = self._segment(low, high - low + self._frame)
+        candidates = np.lib.stride_tricks.sliding_window_view(region, self._frame)
+        # 候補すべての相関を行列積でまとめて計算
+        scores = candidates @ template
+        energy = np.sqrt(np.einsum("ij,ij->i", candidates, candidates)) + 1e-9
+        return low + int(np.argmax(scores / energy))
+
+    def _run(self, final):
+        emitted = []
+        while True:
+            nominal = int(round(self._frame_index * self._analysis_hop))
+            if final:
+                if nominal >= self._input_total:
+                    break
+            elif self._required_end(nominal) > self._input_offset + len(self._input):
+                break
+            pos = self._best_position(nominal)
+            self._output += self._window * self._segment(pos, self._frame)
+            emitted.append(self._output[:self._synthesis_hop].copy())
+            self._output = np.concatenate((self._output[self._synthesis_hop:], np.zeros(self._synthesis_hop, dtype=np.float32)))
+            self._prev_pos = pos
+            self._frame_index += 1
+            # 以降の探索で参照しない入力を捨てる
+            next_nominal = int(round(self._frame_index * self._analysis_hop))
+            keep_from = min(pos + self._synthesis_hop, next_nominal - self._tolerance)
+            drop = max(0, keep_from - self._input_offset)
+            if drop:
+                self._input = self._input[drop:]
+                self._input_offset += drop
+        if not emitted:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(emitted)
+
+    def _to_pcm(self, samples):
+        pcm = np.clip(samples, -32768, 32767).astype("<i2")
+        self._output_total += len(pcm)
+        return pcm.tobytes()
+
+    def process(self, data):
+        """
+        入力ブロックの追加
+        Args:
+            data: 16bitモノラルPCMのバイト列
+        Returns:
+            出力が確定した分のPCMバイト列
+        """
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32)
+        self._input = np.concatenate((self._input, samples))
+        self._input_total += len(samples)
+        return self._to_pcm(self._run(final=False))
+
+    def flush(self):
+        """
+        入力終了後に残りの出力を取り出す
+        """
+        # 末尾のフレームが参照する範囲を無音で埋める
+        padding = self._tolerance * 2 + self._frame * 2 + int(self._analysis_hop)
+        self._input = np.concatenate((self._input, np.zeros(padding, dtype=np.float32)))
+        tail = np.concatenate((self._run(final=True), self._output[:self._synthesis_hop]))
+        # 出力の長さを「入力の長さ / 速度」に揃える
+        expected = int(round(self._input_total / self.speed))
+        return self._to_pcm(tail[:max(0, expected - self._output_total)])
+
+
+def stretch(data, speed, sample_rate=ct.TTS_PCM_SAMPLE_RATE):
+    """
+    PCM全体の再生速度を一括で変換
+    Args:
+        data: 16bitモノラルPCMのバイト列
+        speed: 再生速度（1.0が通常速度）
+        sample_rate: サンプリングレート
+    """
+    stretcher = WsolaStretcher(speed, sample_rate)
+    return stretcher.process(data) + stretcher.flush()
+
+
+def stretch_blocks(blocks, speed, sample_rate=ct.TTS_PCM_SAMPLE_RATE):
+    """
+    PCMブロックを順に変換し、確定した出力から順に返す
+    Args:
+        blocks: 16bitモノラルPCMのバイト列を返すイテラブル
+        speed: 再生速度（1.0が通常速度）
+        sample_rate: サンプリングレート
+    """
+    stretcher = WsolaStretcher(speed, sample_rate)
+    for block in blocks:
+        out = stretcher.process(block)
+        if out:
+            yield out
+    tail = stretcher.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,137 @@
+"""
+チャット欄に表示する会話（st.session_state.messages）のセッションごとの保持
+- メッセージは __slots__ の軽いレコードにし、ターン単位でまとめて持つ
+- メモリに置くのは直近の ct.TRANSCRIPT_MEMORY_TURNS ターンだけにし、あふれた古いターンは会話履歴ストアへ退避する
+  （以前の会話を表示するときに、必要なページの分だけ読み込む）
+- 表示は直近のターンだけを毎回描画し、それより前のターンはページ単位で必要なときだけ描画する
+"""
+import sys
+import uuid
+from collections import deque
+import constants as ct
+from history_store import get_history_store
+
+
+class Message:
+    """
+    チャット欄のメッセージ1件（role が "other" のものはターンの区切り）
+    """
+    __slots__ = ("role", "content", "cultural_context")
+
+    def __init__(self, role, content=None, cultural_context=None):
+        self.role = role
+        self.content = content
+        self.cultural_context = cultural_context
+
+    def nbytes(self):
+        """
+        レコードと本文の文字列の大きさ（role は共有される短い文字列のため数えない）
+        """
+        size = sys.getsizeof(self)
+        if self.content is not None:
+            size += sys.getsizeof(self.content)
+        if self.cultural_context is not None:
+            size += sys.getsizeof(self.cultural_context)
+        return size
+
+
+class Transcript:
+    """
+    セッションのメッセージ一覧（直近のターンのリングと、ストアに退避したそれ以前のターン）
+    区切り（role が "other" のメッセージ）の次、またはユーザーの発話が既にあるターンで次の発話が来た位置を新しいターンの開始とする
+    """
+    def __init__(self, session_id=None, max_turns=ct.TRANSCRIPT_MEMORY_TURNS, store=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self._max_turns = max(1, max_turns)
+        self._store = store
+        self._turns = deque()
+        # ストアに退避したターン数（= リングの先頭のターンの番号）
+        self._spilled = 0
+        self._last_role = "other"
+        self._turn_has_user = False
+        self._nbytes = 0
+
+    def append(self, message):
+        """
+        メッセージを1件追加（リングからあふれたターンはストアへ退避する）
+        Args:
+            message: role / content / cultural_context を持つ辞書
+        """
+        record = Message(message["role"], message.get("content"), message.get("cultural_context"))
+        if not self._turns or self._last_role == "other" or (record.role == "user" and self._turn_has_user):
+            self._turns.append([])
+            self._turn_has_user = False
+        self._turns[-1].append(record)
+        self._nbytes += record.nbytes()
+        self._last_role = record.role
+        if record.role == "user":
+            self._turn_has_user = True
+        while len(self._turns) > self._max_turns:
+            self._spill(self._turns.popleft())
+
+    def _spill(self, turn):
+        store = self._store or get_history_store()
+        store.save_transcript_turn(
+            self.session_id,
+            self._spilled,
+            [(record.role, record.content, record.cultural_context) for record in turn]
+        )
+        self._spilled += 1
+        self._nbytes -= sum(record.nbytes() for record in turn)
+
+    def __len__(self):
+        """
+        ターン数（退避したターンを含む）
+        """
+        return self._spilled + len(self._turns)
+
+    def messages(self, first_turn=0, last_turn=None):
+        """
+        ターンの範囲のメッセージ（退避したターンはストアから読み込む）
+        Args:
+            first_turn: 最初のターンの番号（0始まり）
+            last_turn: 最後のターンの次の番号（Noneの場合は最新のターンまで）
+        Returns:
+            Message の一覧
+        """
+        if last_turn is None or last_turn > len(self):
+            last_turn = len(self)
+        records = []
+        if first_turn < self._spilled:
+            store = self._store or get_history_store()
+            for turn in store.transcript_turns(self.session_id, first_turn, min(last_turn, self._spilled)):
+                records.extend(Message(*message) for message in turn)
+        for turn_number in range(max(first_turn, self._spilled), last_turn):
+            records.extend(self._turns[turn_number - self._spilled])
+        return records
+
+    def memory_usage(self):
+        """
+        セッションのメモリ上にあるメッセージの大きさ（概算）
+        Returns:
+            バイト数、メモリ上のターン数・メッセージ数、退避したターン数
+        """
+        return {
+            "bytes": self._nbytes + sys.getsizeof(self._turns) + sum(sys.getsizeof(turn) for turn in self._turns),
+            "turns_in_memory": len(self._turns),
+            "messages_in_memory": sum(len(turn) for turn in self._turns),
+            "turns_spilled": self._spilled,
+        }
+
+
+def page_range(older_turns, page, page_turns):
+    """
+    以前のターンのページに対応するターンの範囲（1ページ目が最も新しい）
+    Args:
+        older_turns: 直近の表示範囲より前のターン数
+        page: ページ番号（1始まり）
+        page_turns: 1ページあたりのターン数
+    Returns:
+        (最初のターン, 最後のターンの次)
+    """
+    last_turn = max(0, older_turns - (page - 1) * page_turns)
+    return max(0, last_turn - page_turns), last_turn
+
+
+def page_count(older_turns, page_turns):
+    return max(1, -(-older_turns // page_turns))
@@ -0,0 +1,181 @@
+"""
+TTS音声のキャッシュ
+(モデル, 音声, 正規化したテキスト, 再生速度) をキーに、再生可能なPCMをメモリとディスクの2層で保持する
+ブラウザ再生用のエンコード済み音声（EncodedAudio）は形式もキーに含め、メモリ層のみで保持する
+"""
+import hashlib
+import os
+import threading
+import unicodedata
+import wave
+from collections import OrderedDict
+import constants as ct
+from audio_buffer import PcmBuffer
+
+
+def normalize_text(text):
+    """
+    キャッシュキー用のテキスト正規化（全角・半角の統一と空白の整理）
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class TtsCache:
+    """
+    プロセス内のLRU（メモリ層）と、容量上限付きのディスク層からなるTTSキャッシュ
+    """
+    def __init__(self, memory_max_bytes=ct.TTS_CACHE_MEMORY_MAX_BYTES,
+                 disk_dir=ct.TTS_CACHE_DIR, disk_max_bytes=ct.TTS_CACHE_DISK_MAX_BYTES):
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._memory_max_bytes = memory_max_bytes
+        self._disk_dir = disk_dir
+        self._disk_max_bytes = disk_max_bytes
+        self._disk_index = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(model, voice, text, speed, response_format="pcm"):
+        parts = (model, voice, normalize_text(text), f"{speed:.2f}")
+        if response_format != "pcm":
+            parts += (response_format,)
+        source = "\0".join(parts)
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self._disk_dir, f"{key}.wav")
+
+    def _load_disk_index(self):
+        # 最終利用日時の古い順に並べ、追い出し順とする
+        entries = []
+        for name in os.listdir(self._disk_dir):
+            if name.endswith(".wav"):
+                stat = os.stat(os.path.join(self._disk_dir, name))
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def get(self, key):
+        """
+        キャッシュの取得
+        Args:
+            key: make_key() で作成したキー
+        Returns:
+            再生可能なPcmBuffer、またはEncodedAudio（存在しない場合はNone）
+        """
+        with self._lock:
+            audio_buffer = self._memory.get(key)
+            if audio_buffer is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return audio_buffer
+            if key not in self._disk_index:
+                self.misses += 1
+                return None
+            self._disk_index.move_to_end(key)
+        try:
+            with wave.open(self._disk_path(key), "rb") as wav_file:
+                audio_buffer = PcmBuffer(
+                    wav_file.readframes(wav_file.getnframes()),
+                    wav_file.getframerate(),
+                    wav_file.getsampwidth(),
+                    wav_file.getnchannels()
+                )
+            os.utime(self._disk_path(key))
+        except (OSError, EOFError, wave.Error):
+            # 他プロセスによる削除や書き込み途中のファイルはミス扱い
+            with self._lock:
+                self._forget_disk(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits_disk += 1
+            self._put_memory(key, audio_buffer)
+        return audio_buffer
+
+    def put(self, key, audio_buffer):
+        """
+        キャッシュへの登録
+        Args:
+            key: make_key() で作成したキー
+            audio_buffer: 再生可能なPcmBuffer、またはEncodedAudio
+        """
+        with self._lock:
+            self._put_memory(key, audio_buffer)
+        if self._disk_dir and isinstance(audio_buffer, PcmBuffer):
+            self._put_disk(key, audio_buffer)
+
+    def _put_memory(self, key, audio_buffer):
+        if audio_buffer.nbytes > self._memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.nbytes
+        self._memory[key] = audio_buffer
+        self._memory_bytes += audio_buffer.nbytes
+        while self._memory_bytes > self._memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _put_disk(self, key, audio_buffer):
+        path = self._disk_path(key)
+        # 書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(audio_buffer.wav_header())
+            f.write(audio_buffer.data)
+        os.replace(temp_path, path)
+        size = audio_buffer.nbytes + 44
+        with self._lock:
+            self._forget_disk(key)
+            self._disk_index[key] = size
+            self._disk_bytes += size
+            while self._disk_bytes > self._disk_max_bytes and len(self._disk_index) > 1:
+                evicted_key, _ = next(iter(self._disk_index.items()))
+                self._forget_disk(evicted_key)
+                try:
+                    os.remove(self._disk_path(evicted_key))
+                except OSError:
+                    pass
+                self.evictions += 1
+
+    def _forget_disk(self, key):
+        size = self._disk_index.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """
+    プロセス全体で共有するTTSキャッシュの取得
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TtsCache()
+        return _cache
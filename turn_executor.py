@@ -0,0 +1,72 @@
+"""
+1ターン内の独立した処理（文化的コンテキスト取得、音声合成、再生など）を並行実行する仕組み
+結果は呼び出し元のスレッドで完了順に受け取れるため、Streamlitの描画はスクリプトのスレッドで行える
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from latency import run_in_context
+import constants as ct
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_turn_executor():
+    """
+    プロセス全体で共有するスレッドプールの取得
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ct.TURN_EXECUTOR_MAX_WORKERS, thread_name_prefix="turn-stage")
+        return _executor
+
+
+class StageTimeoutError(TimeoutError):
+    pass
+
+
+class TurnStages:
+    """
+    1ターン分の処理（ステージ）をまとめて実行し、完了したものから順に結果を返す
+    各ステージには個別にタイムアウトを設定でき、結果の処理中に後続のステージを追加できる
+    ステージ内ではst.session_stateに触れないこと（別スレッドで実行されるため）
+    """
+    def __init__(self, executor=None):
+        self._executor = executor if executor is not None else get_turn_executor()
+        self._pending = {}
+
+    def submit(self, name, func, timeout=None):
+        """
+        ステージの追加
+        Args:
+            name: ステージ名
+            func: 引数なしで呼び出す処理
+            timeout: タイムアウト秒数（Noneの場合は無制限）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # 計測値をセッションにも記録できるよう、呼び出し元のコンテキストを引き継ぐ
+        self._pending[self._executor.submit(run_in_context(func))] = (name, deadline)
+
+    def as_completed(self):
+        """
+        完了したステージから順に (ステージ名, 結果, 例外) を返す
+        タイムアウトしたステージは StageTimeoutError を例外として返す（処理自体は中断できないため結果は捨てる）
+        """
+        while self._pending:
+            deadlines = [deadline for _, deadline in self._pending.values() if deadline is not None]
+            wait_timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            done, _ = wait(list(self._pending), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, _ = self._pending.pop(future)
+                try:
+                    yield name, future.result(), None
+                except Exception as e:
+                    yield name, None, e
+            now = time.monotonic()
+            for future, (name, deadline) in list(self._pending.items()):
+                if deadline is not None and deadline <= now and not future.done():
+                    future.cancel()
+                    del self._pending[future]
+                    yield name, None, StageTimeoutError(f"{name} timed out")
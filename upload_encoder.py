@@ -0,0 +1,198 @@
+"""
+文字起こし用アップロード音声の圧縮（メモリ上でエンコード）
+ffmpeg（pydubが使うものと同じ実行ファイル）に標準入出力で PCM を渡し、一時ファイルを作らずに変換する
+形式は「エンコード時間 + 想定帯域でのアップロード時間」が最小になるものを選ぶ
+"""
+import shutil
+import subprocess
+import threading
+import time
+import constants as ct
+
+# 形式ごとの ffmpeg の出力オプション、拡張子、MIMEタイプ
+UPLOAD_FORMATS = {
+    "flac": (["-c:a", "flac", "-f", "flac"], "flac", "audio/flac"),
+    "ogg": (["-c:a", "libopus", "-b:a", ct.UPLOAD_OPUS_BITRATE, "-application", "voip", "-f", "ogg"], "ogg", "audio/ogg"),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", ct.UPLOAD_MP3_BITRATE, "-f", "mp3"], "mp3", "audio/mpeg"),
+}
+_LOSSY_FORMATS = {"ogg", "mp3"}
+
+# 実測値がない間に使う見積もり（WAVに対するサイズ比、音声1秒あたりのエンコード時間）
+_PRIORS = {
+    "wav": (1.0, 0.0),
+    "flac": (0.55, 0.004),
+    "ogg": (0.1, 0.012),
+    "mp3": (0.13, 0.01),
+}
+# 実測値の指数移動平均の重み
+_EMA_WEIGHT = 0.3
+
+_ffmpeg_path = None
+_ffmpeg_checked = False
+
+
+def find_ffmpeg():
+    """
+    ffmpegの実行ファイルのパス（見つからない場合はNone）
+    """
+    global _ffmpeg_path, _ffmpeg_checked
+    if not _ffmpeg_checked:
+        from pydub.utils import get_encoder_name
+
+        _ffmpeg_path = shutil.which(get_encoder_name())
+        _ffmpeg_checked = True
+    return _ffmpeg_path
+
+
+def encode(audio_buffer, fmt):
+    """
+    PcmBufferを指定形式にエンコード
+    Args:
+        audio_buffer: PcmBuffer
+        fmt: UPLOAD_FORMATS のキー
+    Returns:
+        OpenAIクライアントにそのまま渡せる (ファイル名, データ, MIMEタイプ)
+    Raises:
+        FileNotFoundError: ffmpegが見つからない場合
+    """
+    ffmpeg_path = find_ffmpeg()
+    if ffmpeg_path is None:
+        raise FileNotFoundError("ffmpeg was not found")
+    output_args, extension, mime_type = UPLOAD_FORMATS[fmt]
+    sample_format = {1: "u8", 2: "s16le", 4: "s32le"}[audio_buffer.sample_width]
+    command = [
+        ffmpeg_path, "-hide_banner", "-loglevel", "error",
+        "-f", sample_format, "-ar", str(audio_buffer.sample_rate), "-ac", str(audio_buffer.channels),
+        "-i", "pipe:0", *output_args, "pipe:1",
+    ]
+    result = subprocess.run(command, input=audio_buffer.data, capture_output=True, check=True)
+    return f"audio_input.{extension}", result.stdout, mime_type
+
+
+class EncoderPolicy:
+    """
+    アップロード形式の選択
+    形式ごとのサイズ比とエンコード時間を実測で更新し、想定帯域でのアップロード時間と合わせて比較する
+    """
+    def __init__(self, bytes_per_sec=ct.UPLOAD_ASSUMED_BYTES_PER_SEC, allow_lossy=ct.UPLOAD_ALLOW_LOSSY,
+                 min_bytes=ct.UPLOAD_ENCODE_MIN_BYTES):
+        """
+        Args:
+            bytes_per_sec: 想定するアップロード帯域（バイト/秒）
+            allow_lossy: 非可逆圧縮（Opus、MP3）を候補に含めるか
+            min_bytes: これより小さい音声はエンコードせずWAVで送る（プロセス起動の時間の方が大きいため）
+        """
+        self.bytes_per_sec = bytes_per_sec
+        self.allow_lossy = allow_lossy
+        self.min_bytes = min_bytes
+        self._estimates = dict(_PRIORS)
+        # エンコードに失敗した形式（ffmpegにエンコーダーが含まれていない場合など）。以降は候補にしない
+        self._unavailable = set()
+        self._lock = threading.Lock()
+
+    def candidates(self):
+        formats = ["wav"]
+        if find_ffmpeg():
+            with self._lock:
+                formats += [
+                    fmt for fmt in UPLOAD_FORMATS
+                    if (self.allow_lossy or fmt not in _LOSSY_FORMATS) and fmt not in self._unavailable
+                ]
+        return formats
+
+    def is_available(self, fmt):
+        with self._lock:
+            return fmt not in self._unavailable
+
+    def mark_unavailable(self, fmt):
+        """
+        エンコードに失敗した形式を候補から外す（毎ターン失敗するプロセス起動を繰り返さない）
+        """
+        with self._lock:
+            self._unavailable.add(fmt)
+
+    def unavailable(self):
+        with self._lock:
+            return sorted(self._unavailable)
+
+    def estimate_seconds(self, fmt, audio_buffer):
+        """
+        エンコードとアップロードにかかる時間の見積もり
+        """
+        with self._lock:
+            ratio, encode_per_sec = self._estimates[fmt]
+        upload_bytes = audio_buffer.nbytes * ratio
+        return encode_per_sec * audio_buffer.duration + upload_bytes / self.bytes_per_sec
+
+    def choose(self, audio_buffer):
+        if audio_buffer.nbytes < self.min_bytes:
+            return "wav"
+        return min(self.candidates(), key=lambda fmt: self.estimate_seconds(fmt, audio_buffer))
+
+    def record(self, fmt, audio_buffer, encoded_bytes, encode_seconds):
+        if fmt == "wav" or audio_buffer.nbytes == 0:
+            return
+        with self._lock:
+            ratio, encode_per_sec = self._estimates[fmt]
+            self._estimates[fmt] = (
+                (1 - _EMA_WEIGHT) * ratio + _EMA_WEIGHT * encoded_bytes / audio_buffer.nbytes,
+                (1 - _EMA_WEIGHT) * encode_per_sec + _EMA_WEIGHT * encode_seconds / max(audio_buffer.duration, 1e-3),
+            )
+
+
+def _mark_all_unavailable(policy):
+    for fmt in UPLOAD_FORMATS:
+        policy.mark_unavailable(fmt)
+
+
+def encode_for_upload(audio_buffer, policy, fmt=None):
+    """
+    アップロード用のファイルを作成
+    Args:
+        audio_buffer: PcmBuffer
+        policy: EncoderPolicy
+        fmt: 形式の指定（Noneの場合はpolicyで選択）
+    Returns:
+        ((ファイル名, データ, MIMEタイプ), 処理結果の辞書)
+        エンコードに失敗した場合はWAVで返し、その形式は以降の候補から外す
+    """
+    fmt = fmt or policy.choose(audio_buffer)
+    failed_encoding = None
+    if fmt != "wav" and not find_ffmpeg():
+        # ffmpegがない場合は、どの形式もエンコードできない（形式が指定された場合もWAVで送る）
+        _mark_all_unavailable(policy)
+    if fmt != "wav" and not policy.is_available(fmt):
+        # 指定された形式が使えないことが分かっている場合は、エンコードを試さない
+        failed_encoding, fmt = fmt, "wav"
+    start = time.perf_counter()
+    upload = None
+    if fmt != "wav":
+        try:
+            upload = encode(audio_buffer, fmt)
+        except OSError:
+            # ffmpeg自体を起動できない場合は、どの形式もエンコードできない
+            _mark_all_unavailable(policy)
+            failed_encoding, fmt = fmt, "wav"
+        except subprocess.CalledProcessError:
+            # エンコーダー（libopus / libmp3lame など）が含まれていない場合は、その形式だけを外す
+            policy.mark_unavailable(fmt)
+            failed_encoding, fmt = fmt, "wav"
+    if upload is None:
+        upload = audio_buffer.upload_file()
+    encode_seconds = time.perf_counter() - start
+    policy.record(fmt, audio_buffer, len(upload[1]), encode_seconds)
+    return upload, {
+        "encoding": fmt,
+        "encoded_bytes": len(upload[1]),
+        "wav_bytes": audio_buffer.nbytes + 44,
+        "encode_ms": encode_seconds * 1000,
+        "failed_encoding": failed_encoding,
+        "unavailable_encodings": policy.unavailable(),
+    }
+
+
+_encoder_policy = EncoderPolicy()
+
+
+def get_encoder_policy():
+    return _encoder_policy